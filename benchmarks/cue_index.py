@@ -0,0 +1,167 @@
+"""
+readers.read_subtitles and CueIndex on the SRT and VTT files SubtitlesProcessor.save writes.
+
+Checks that reading a saved file back gives its cues (times to the millisecond, text), that thumbnail VTT
+cues parse, and that CueIndex.active and CueIndex.between agree with a scan over all cues, including
+overlapping ones and cues that last the whole file. Then times reading an `--hours`-long file against a
+line-by-line parser and the queries against the scan, with and without a cue on screen throughout.
+
+    python benchmarks/cue_index.py --hours 4
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+from word_timings import make_transcript
+
+from readers import CUE_BLOCK, CueIndex, parse_subtitles, read_subtitles, thumbnail
+from subtitles import CREDIT_TEXT, Cue, SubtitlesProcessor, segments_from_output
+from utils import format_timestamp, parse_timestamp
+from writers import writer_for
+
+
+def line_by_line(path):
+    """The obvious parser: read the lines and look for timing lines."""
+    cues = []
+    with open(path, encoding="utf-8") as file:
+        lines = file.read().splitlines()
+    i = 0
+    while i < len(lines):
+        if "-->" in lines[i]:
+            start, _, end = lines[i].partition("-->")
+            text = []
+            i += 1
+            while i < len(lines) and lines[i]:
+                text.append(lines[i])
+                i += 1
+            cues.append(Cue(parse_timestamp(start), parse_timestamp(end.split()[0]), "\n".join(text)))
+        i += 1
+
+    return cues
+
+
+def scan(cues, start, end):
+    return [(cue.start, cue.end, cue.text) for cue in cues if cue.start < max(end, start + 1e-9) and cue.end > start]
+
+
+def cue_times(cues):
+    return [(cue.start, cue.end, cue.text) for cue in cues]
+
+
+def save(segments, lang, path):
+    """Writes the subtitles of segments to path and returns the cues written, with the credit."""
+    processor = SubtitlesProcessor(segments_from_output(segments), lang, 60, 30)
+    with open(path, "w", encoding="utf-8") as file:
+        processor.write([writer_for(path)(file)])
+    cues = processor.process_segments(True)
+    last_end_time = cues[-1].end if cues else 0
+    cues.append(Cue(last_end_time + 1, last_end_time + 4.5, CREDIT_TEXT))
+    return [cue for cue in cues if cue.text.strip()]
+
+
+def check_round_trip(count, seed, directory):
+    rng = random.Random(seed)
+    for index in range(count):
+        segments = make_transcript(rng, "en-us", rng.uniform(0.1, 5))
+        for extension in ("srt", "vtt"):
+            path = os.path.join(directory, f"check.{extension}")
+            written = save(segments, "en-us", path)
+            milliseconds = lambda seconds: parse_timestamp(format_timestamp(seconds))
+            expected = [(milliseconds(cue.start), milliseconds(cue.end), cue.text.strip()) for cue in written]
+            # CueIndex orders cues by start, and a file can have them out of order
+            if sorted(expected, key=lambda cue: cue[0]) != cue_times(read_subtitles(path)):
+                raise SystemExit(f"Transcript {index} ({extension}) reads back differently")
+
+    vtt = "WEBVTT\n\n00:00.000 --> 00:05.000\nimages/img1.jpg#xywh=0,0,160,90\n\n00:05.000 --> 00:10.000 align:start\n"
+    vtt += "images/img1.jpg#xywh=160,0,160,90\r\n\r\n01:00:00,5 --> 01:00:01,25\nlast\n"
+    cues = parse_subtitles(vtt)
+    if [thumbnail(cue.text) for cue in cues][:2] != [
+        ("images/img1.jpg", 0, 0, 160, 90),
+        ("images/img1.jpg", 160, 0, 160, 90),
+    ] or cue_times(cues)[2] != (3600.5, 3601.25, "last"):
+        raise SystemExit("Thumbnail VTT reads back differently")
+
+    print(f"{count} transcripts: SRT and VTT read back to the cues written.")
+
+
+def check_queries(count, seed):
+    rng = random.Random(seed)
+    for index in range(count):
+        cues = []
+        for _ in range(rng.choice([rng.randint(0, 200), rng.randint(0, 3000)])):
+            start = round(rng.uniform(0, 600), 3)
+            cues.append(Cue(start, start + rng.choice([0, rng.uniform(0.1, 5), rng.uniform(5, 120)]), str(len(cues))))
+        # Title cards and background lines, on screen for most of the file
+        for _ in range(rng.choice([0, 0, 1, 3])):
+            start = rng.uniform(0, 30)
+            cues.append(Cue(start, rng.uniform(300, 700), str(len(cues))))
+        # Small blocks, so the tree of latest ends is used on these small sets too
+        cue_index = CueIndex.from_cues(cues, block=rng.choice([1, 4, 64, CUE_BLOCK]))
+        for _ in range(50):
+            a = rng.choice([rng.uniform(-10, 610), rng.choice(cues).start if cues else 0])
+            b = a + rng.choice([0, rng.uniform(0, 60)])
+            if sorted(cue_times(cue_index.active(a))) != sorted(scan(cues, a, a)) or (
+                b > a and sorted(cue_times(cue_index.between(a, b))) != sorted(scan(cues, a, b))
+            ):
+                raise SystemExit(f"Cue set {index} (blocks of {cue_index.block}) answers differently at {a}, {b}")
+
+    print(f"{count} cue sets: active and between match a scan.")
+
+
+def best_time(function, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--transcripts", type=int, default=50)
+    parser.add_argument("--hours", type=float, default=4)
+    parser.add_argument("--queries", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        check_round_trip(args.transcripts, args.seed, directory)
+        check_queries(args.transcripts * 4, args.seed)
+
+        path = os.path.join(directory, "long.srt")
+        save(make_transcript(random.Random(args.seed), "en-us", args.hours * 60), "en-us", path)
+        cues = line_by_line(path)
+        if sorted(cue_times(cues), key=lambda cue: cue[0]) != cue_times(read_subtitles(path)):
+            raise SystemExit("The parsers disagree")
+
+        lines_ms = best_time(lambda: line_by_line(path), args.repeat)
+        mmap_ms = best_time(lambda: read_subtitles(path), args.repeat)
+        size = os.path.getsize(path)
+        print(
+            f"{args.hours:g} h, {len(cues)} cues, {size / 2**20:.1f} MiB: line by line {lines_ms:.1f} ms, "
+            f"read_subtitles {mmap_ms:.1f} ms ({lines_ms / mmap_ms:.1f}x)"
+        )
+
+    cue_index = CueIndex.from_cues(cues)
+    rng = random.Random(args.seed)
+    times = [rng.uniform(0, args.hours * 3600) for _ in range(args.queries)]
+    scan_ms = best_time(lambda: [scan(cues, t, t) for t in times[: args.queries // 100]], 1) * 100
+    index_ms = best_time(lambda: [cue_index.active(t) for t in times], args.repeat)
+    print(
+        f"{args.queries} active-at queries: scan {scan_ms:.0f} ms (extrapolated), CueIndex {index_ms:.1f} ms "
+        f"({scan_ms / index_ms:.0f}x)"
+    )
+    title_index = CueIndex.from_cues([Cue(0, args.hours * 3600, "title"), *cues])
+    title_ms = best_time(lambda: [title_index.active(t) for t in times], args.repeat)
+    print(f"With a cue on screen throughout: CueIndex {title_ms:.1f} ms")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""
+SubtitlesProcessor.feed against process_segments on synthetic WhisperX output (see whisperx.py).
+
+Feeds every transcript in random parts (empty ones, single segments, all at once) in the modes of
+subtitles_engine.py and checks the cues and the words' timestamps are those of process_segments on the whole
+transcript. Then shows how soon the first cues of a `--minutes`-long transcript are ready when it arrives
+a minute of speech at a time, against processing it all once it's done.
+
+    python benchmarks/incremental.py --minutes 180
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from whisperx import LANGUAGES, make_output  # noqa: E402
+
+from subtitles import SubtitlesProcessor, segments_from_output  # noqa: E402
+
+MODES = {
+    "greedy": ("greedy", True, True),
+    "optimal": ("optimal", True, True),
+    "sentences": ("greedy", True, False),
+    "segments": ("greedy", False, True),
+}
+
+
+def processor(segments, lang, line_breaking):
+    return SubtitlesProcessor(segments, lang, 60, 30, line_breaking=line_breaking)
+
+
+def cue_times(cues):
+    return [(cue.start, cue.end, cue.text) for cue in cues]
+
+
+def word_times(segments):
+    return [(word.start, word.end) for segment in segments for word in segment.words or ()]
+
+
+def check(transcripts, seed):
+    rng = random.Random(seed)
+    for index in range(transcripts):
+        lang = rng.choice(LANGUAGES)
+        output = make_output(seed + index, lang, rng.choice([1, 3, 10]))
+        for mode, (line_breaking, advanced_splitting, normal_handling) in MODES.items():
+            original = segments_from_output(output["segments"])
+            whole = processor(original, lang, line_breaking)
+            segments = segments_from_output(output["segments"])
+            fed = processor([], lang, line_breaking)
+            cues = []
+            start = 0
+            while start < len(segments):
+                end = start + rng.choice([0, 1, 1, 2, 5, len(segments)])
+                cues += fed.feed(segments[start:end], advanced_splitting, normal_handling)
+                start = end
+            cues += fed.feed([], advanced_splitting, normal_handling, final=True)
+
+            expected = whole.process_segments(advanced_splitting, normal_handling)
+            if cue_times(cues) != cue_times(expected) or word_times(segments) != word_times(original):
+                raise SystemExit(f"Transcript {index} ({lang}, {mode}) differs when fed in parts")
+
+    print(f"{transcripts} transcripts in {len(MODES)} modes: fed in parts, the cues match process_segments.")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--transcripts", type=int, default=100)
+    parser.add_argument("--minutes", type=float, default=180)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    check(args.transcripts, args.seed)
+
+    output = make_output(args.seed, "en-us", args.minutes)
+    segments = segments_from_output(output["segments"])
+    start = time.perf_counter()
+    cues = processor(segments, "en-us", "greedy").process_segments()
+    whole_ms = (time.perf_counter() - start) * 1000
+
+    segments = segments_from_output(output["segments"])
+    fed = processor([], "en-us", "greedy")
+    first_ms = None
+    feed_ms = 0
+    count = 0
+    minute = 0
+    while minute * 60 < segments[-1].end:
+        minute += 1
+        part = [segment for segment in segments if (minute - 1) * 60 <= segment.start < minute * 60]
+        start = time.perf_counter()
+        count += len(fed.feed(part, final=minute * 60 >= segments[-1].end))
+        feed_ms += (time.perf_counter() - start) * 1000
+        if first_ms is None and count:
+            first_ms = feed_ms
+    if count != len(cues):
+        raise SystemExit("Feeding by the minute gave a different number of cues")
+
+    print(
+        f"{args.minutes:g} min, {len(segments)} segments, {len(cues)} cues: process_segments after the last segment "
+        f"{whole_ms:.1f} ms; fed a minute at a time, first cues after 1 minute of speech and {first_ms:.2f} ms, "
+        f"{feed_ms / minute:.2f} ms per minute"
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""
+Greedy vs optimal line breaking in SubtitlesProcessor, on the seeded corpus from split_points.py.
+
+Reports how even the cues of each split segment are (the shortest cue as a share of the longest, and
+cues shorter than min_char_length_splitter), cues longer than max_line_length, and how long each mode
+takes to split the whole corpus (the best of `--repeat` runs).
+
+    python benchmarks/line_breaking.py --segments 3000
+"""
+
+import argparse
+import statistics
+import time
+
+from split_points import make_corpus
+
+from subtitles import segments_from_output
+
+
+def split(corpus, mode):
+    segments = segments_from_output([segment for _, segment, _ in corpus])
+
+    start = time.perf_counter()
+    results = []
+    for (processor, _, next_start), segment in zip(corpus, segments):
+        split_points = (
+            processor.determine_optimal_split_points(segment, next_start)
+            if mode == "optimal"
+            else processor.determine_advanced_split_points(segment, next_start)
+        )
+        results.append(processor.generate_subtitles_from_split_points(segment, split_points, next_start))
+
+    return results, time.perf_counter() - start
+
+
+def run(corpus, mode, repeat):
+    cue_count = 0
+    balance = []
+    short = 0
+    too_long = 0
+
+    runs = [split(corpus, mode) for _ in range(repeat)]
+    elapsed = min(seconds for _, seconds in runs)
+
+    for (processor, _, _), cues in zip(corpus, runs[0][0]):
+        lengths = [len(cue.text.strip()) for cue in cues]
+        cue_count += len(lengths)
+        too_long += sum(length > processor.max_line_length for length in lengths)
+        # A segment that fits on one line says nothing about how breaks are chosen
+        if len(lengths) > 1:
+            balance.append(min(lengths) / max(lengths))
+            short += sum(length < processor.min_char_length_splitter for length in lengths)
+
+    print(
+        f"{mode:>8}: {cue_count:>6} cues, shortest/longest cue per segment {statistics.mean(balance):.2f}, "
+        f"short {short:>5}, over the limit {too_long:>4}, {elapsed * 1000:7.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--segments", type=int, default=3000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.segments, args.seed)
+    for processor, _, _ in corpus:
+        # The limits the bot uses for subtitles in the spoken language
+        processor.max_line_length = 60 if processor.lang != "zh" else 30
+        processor.min_char_length_splitter = 30 if processor.lang != "zh" else 20
+
+    run(corpus, "greedy", args.repeat)
+    run(corpus, "optimal", args.repeat)
+
+
+if __name__ == "__main__":
+    main()
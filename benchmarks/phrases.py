@@ -0,0 +1,109 @@
+"""
+LanguageProfile.break_kinds against the obvious matcher, which compares every conjunction with the words at
+every position.
+
+Checks both agree on seeded word streams of every language with conjunctions: commas, punctuation around
+words, multi-word conjunctions, and conjunctions cut by the end of a segment. Then times both on a
+`--words`-long stream.
+
+    python benchmarks/phrases.py --words 200000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from conjunctions import conjunctions_by_language  # noqa: E402
+from profiles import COMMA, CONJUNCTION, normalize, profile_for  # noqa: E402
+
+
+def naive_kinds(profile, conjunctions, texts, offsets):
+    phrases = [[normalize(word) for word in conjunction.split()] for conjunction in conjunctions]
+    if not profile.separator:
+        phrases += [list("".join(phrase)) for phrase in phrases]
+    kinds = []
+    for s in range(len(offsets) - 1):
+        words = [normalize(text) for text in texts[offsets[s] : offsets[s + 1]]]
+        for i, text in enumerate(texts[offsets[s] : offsets[s + 1]]):
+            if text.endswith(profile.comma):
+                kinds.append(COMMA)
+            elif any(words[i : i + len(phrase)] == phrase for phrase in phrases):
+                kinds.append(CONJUNCTION)
+            else:
+                kinds.append(0)
+
+    return kinds
+
+
+def make_stream(rng, lang, count):
+    """Words, conjunctions (some split across segments) and punctuation, with segment offsets."""
+    profile = profile_for(lang)
+    conjunctions = sorted(conjunctions_by_language[lang])
+    filler = ["x", "yy", "zzz", "Alpha", "beta"]
+    texts = []
+    while len(texts) < count:
+        roll = rng.random()
+        if roll < 0.2:
+            words = rng.choice(conjunctions).split()
+            if not profile.separator and rng.random() < 0.5:
+                words = list("".join(words))
+            texts.extend(words)
+        elif roll < 0.25:
+            texts.append(rng.choice(filler) + profile.comma)
+        elif roll < 0.3:
+            texts.append(rng.choice(["(", "«", "“"]) + rng.choice(conjunctions).split()[0].capitalize())
+        else:
+            texts.append(rng.choice(filler) + rng.choice(["", "", ".", "?", "…"]))
+
+    offsets = sorted({0, len(texts), *(rng.randrange(len(texts)) for _ in range(len(texts) // 20))})
+    return texts, offsets
+
+
+def check(streams, seed):
+    rng = random.Random(seed)
+    for index in range(streams):
+        lang = rng.choice(list(conjunctions_by_language))
+        texts, offsets = make_stream(rng, lang, rng.randint(1, 400))
+        profile = profile_for(lang)
+        expected = naive_kinds(profile, conjunctions_by_language[lang], texts, offsets)
+        if profile.break_kinds(texts, offsets).tolist() != expected:
+            raise SystemExit(f"Stream {index} ({lang}) differs")
+
+    print(f"{streams} streams: break_kinds matches the naive matcher.")
+
+
+def best_time(function, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streams", type=int, default=500)
+    parser.add_argument("--words", type=int, default=200_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    check(args.streams, args.seed)
+
+    for lang in ("pl", "fa"):
+        texts, offsets = make_stream(random.Random(args.seed), lang, args.words)
+        profile = profile_for(lang)
+        conjunctions = conjunctions_by_language[lang]
+        naive_ms = best_time(lambda: naive_kinds(profile, conjunctions, texts, offsets), 1)
+        trie_ms = best_time(lambda: profile.break_kinds(texts, offsets), args.repeat)
+        print(f"{lang}, {len(texts)} words: naive {naive_ms:.0f} ms, trie {trie_ms:.1f} ms ({naive_ms / trie_ms:.0f}x)")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""
+Queue simulation comparing FIFO with the scheduler's order (shortest job first, paid weighting, aging).
+
+Jobs arrive as a Poisson stream, mostly short clips with some long uploads, and `--workers` slots take
+the next job the way CLAIM_JOB does. Reports median and p95 completion time (arrival to finish) per job
+class, and the time to drain the whole load, which is the same for both orders when the slots stay busy.
+
+    python benchmarks/scheduling.py --jobs 2000 --workers 4
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scheduler import PAID_WEIGHT, SHORT_JOB_SECONDS, effective_priority  # noqa: E402
+
+
+def make_jobs(count, long_share, paid_share, load, workers, seed):
+    rng = random.Random(seed)
+    jobs = []
+    for index in range(count):
+        long_job = rng.random() < long_share
+        # Long uploads take 20-60 minutes of work, clips 10-120 seconds
+        seconds = rng.uniform(1200, 3600) if long_job else rng.uniform(10, 120)
+        jobs.append({"id": index, "seconds": seconds, "paid": rng.random() < paid_share})
+
+    mean_seconds = statistics.mean(job["seconds"] for job in jobs)
+    clock = 0.0
+    for job in jobs:
+        # Arrivals keep the slots `load` busy on average
+        clock += rng.expovariate(load * workers / mean_seconds)
+        job["arrival"] = clock
+        job["priority"] = int(job["seconds"] * (PAID_WEIGHT if job["paid"] else 1))
+
+    return jobs
+
+
+def simulate(jobs, workers, order):
+    free_at = [0.0] * workers
+    pending = list(jobs)
+    queued = []
+    finished = []
+
+    while pending or queued:
+        slot = min(range(workers), key=lambda i: free_at[i])
+        now = free_at[slot]
+        if not queued and pending[0]["arrival"] > now:
+            now = pending[0]["arrival"]
+        while pending and pending[0]["arrival"] <= now:
+            queued.append(pending.pop(0))
+
+        job = min(queued, key=lambda job: order(job, now))
+        queued.remove(job)
+        free_at[slot] = now + job["seconds"]
+        finished.append((job, free_at[slot] - job["arrival"]))
+
+    return finished, max(free_at)
+
+
+def fifo(job, now):
+    return job["id"]
+
+
+def scheduled(job, now):
+    return (effective_priority(job["priority"], now - job["arrival"]), job["id"])
+
+
+def report(name, finished, makespan):
+    print(f"{name}: drained in {makespan / 3600:.1f} h")
+    for tier in ("free", "paid"):
+        for size in ("short", "long"):
+            times = [
+                seconds
+                for job, seconds in finished
+                if job["paid"] == (tier == "paid") and (job["seconds"] <= SHORT_JOB_SECONDS) == (size == "short")
+            ]
+            if not times:
+                continue
+            p95 = sorted(times)[int(len(times) * 0.95) - 1] if len(times) >= 20 else max(times)
+            print(
+                f"  {tier}:{size:<5} {len(times):>5} jobs  median {statistics.median(times):>8.0f}s  p95 {p95:>8.0f}s"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--long-share", type=float, default=0.1)
+    parser.add_argument("--paid-share", type=float, default=0.2)
+    parser.add_argument("--load", type=float, default=0.9, help="average share of busy worker slots")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    jobs = make_jobs(args.jobs, args.long_share, args.paid_share, args.load, args.workers, args.seed)
+    report("FIFO", *simulate(jobs, args.workers, fifo))
+    report("Scheduled", *simulate(jobs, args.workers, scheduled))
+
+
+if __name__ == "__main__":
+    main()
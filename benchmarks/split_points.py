@@ -0,0 +1,182 @@
+"""
+Regression corpus and timing for SubtitlesProcessor.determine_advanced_split_points.
+
+Runs the current split engine and the previous implementation (kept below as the reference) over a seeded
+corpus: timed and untimed words, words without timestamps, commas, conjunctions, CJK text, and long
+monologues without any punctuation. It fails on the first segment where the split points or the
+estimated word timestamps differ, then times both on an hour-long single-segment monologue.
+
+    python benchmarks/split_points.py --segments 3000
+"""
+
+import argparse
+import copy
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from subtitles import SubtitlesProcessor, Word, segments_from_output  # noqa: E402
+
+VOCABULARY = {
+    "en-us": "the quick brown fox jumps over lazy dog river mountain subtitles generator telegram video".split(),
+    "fr": "le renard brun saute par dessus chien paresseux rivière montagne sous titres vidéo".split(),
+    "zh": "我们 今天 讨论 视频 字幕 生成 问题 时间 语言 模型 识别 结果".split(),
+}
+
+CONJUNCTIONS = {"en-us": ["and", "but", "because", "while"], "fr": ["et", "mais", "quand"], "zh": ["但是", "因为", "所以"]}
+
+
+def reference_split_points(processor, segment, next_segment_start_time=None):
+    """determine_advanced_split_points as it was before the prefix-sum rewrite."""
+    self = processor
+    split_points = []
+    last_split_point = 0
+    char_count = 0
+
+    words = segment.words if segment.words is not None else segment.text.split()
+    add_space = 0 if self.lang in ["zh", "ja"] else 1
+
+    total_char_count = sum(len(word.text) if isinstance(word, Word) else len(word) + add_space for word in words)
+    char_count_after = total_char_count
+
+    for i, word in enumerate(words):
+        word_text = word.text if isinstance(word, Word) else word
+        word_length = len(word_text) + add_space
+        char_count += word_length
+        char_count_after -= word_length
+
+        char_count_before = char_count - word_length
+
+        if isinstance(word, Word) and (word.start is None or word.end is None):
+            self.estimate_timestamp_for_word(words, i, next_segment_start_time)
+
+        if (
+            word_text.endswith(self.comma)
+            and char_count_before >= self.min_char_length_splitter
+            and char_count_after >= self.min_char_length_splitter
+        ):
+            split_points.append(i)
+            last_split_point = i + 1
+            char_count = 0
+
+        elif (
+            word_text.lower() in self.profile.conjunctions
+            and char_count_before >= self.min_char_length_splitter
+            and char_count_after >= self.min_char_length_splitter
+        ):
+            split_points.append(i - 1)
+            last_split_point = i
+            char_count = word_length
+
+        elif char_count >= self.max_line_length:
+            midpoint = int((last_split_point + i) / 2)
+            if char_count_before >= self.min_char_length_splitter:
+                split_points.append(midpoint)
+                last_split_point = midpoint + 1
+                char_count = sum(
+                    len(words[j].text) if isinstance(words[j], Word) else len(words[j]) + add_space
+                    for j in range(last_split_point, i + 1)
+                )
+
+    return split_points
+
+
+def make_segment(rng, lang, start, word_count, timed, punctuation, comma):
+    """A segment as WhisperX returns it."""
+    vocabulary = VOCABULARY[lang]
+    texts = []
+    for _ in range(word_count):
+        roll = rng.random()
+        if roll < 0.08 * punctuation:
+            texts.append(rng.choice(CONJUNCTIONS[lang]))
+        elif roll < 0.16 * punctuation:
+            texts.append(rng.choice(vocabulary) + comma)
+        else:
+            texts.append(rng.choice(vocabulary))
+
+    separator = "" if lang == "zh" else " "
+    text = separator.join(texts)
+    if not timed:
+        return {"start": start, "end": start + word_count * 0.4, "text": text}
+
+    words = []
+    clock = start
+    for word in texts:
+        entry = {"word": word}
+        # WhisperX leaves numbers and some symbols without timestamps
+        if rng.random() > 0.1:
+            entry["start"] = round(clock, 3)
+            entry["end"] = round(clock + rng.uniform(0.1, 0.6), 3)
+        clock += rng.uniform(0.2, 0.7)
+        words.append(entry)
+
+    return {"start": start, "end": clock, "text": text, "words": words}
+
+
+def make_corpus(count, seed):
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(count):
+        lang = rng.choice(list(VOCABULARY))
+        processor = SubtitlesProcessor([], lang)
+        # Mostly sentence-sized segments, some monologues with no punctuation at all
+        long_monologue = rng.random() < 0.1
+        segment = make_segment(
+            rng,
+            lang,
+            start=rng.uniform(0, 3600),
+            word_count=rng.randint(200, 800) if long_monologue else rng.randint(1, 60),
+            timed=rng.random() < 0.8,
+            punctuation=0 if long_monologue else rng.random(),
+            comma=processor.comma,
+        )
+        next_start = segment["end"] + rng.uniform(0, 2) if rng.random() < 0.7 else None
+        corpus.append((processor, segment, next_start))
+
+    return corpus
+
+
+def word_times(segment):
+    return [(word.text, word.start, word.end) for word in segment.words] if segment.words is not None else None
+
+
+def check(corpus):
+    for index, (processor, segment, next_start) in enumerate(corpus):
+        expected_segment, actual_segment = segments_from_output([segment, segment])
+        expected = reference_split_points(processor, expected_segment, next_start)
+        actual = processor.determine_advanced_split_points(actual_segment, next_start)
+        if expected != actual or word_times(expected_segment) != word_times(actual_segment):
+            raise SystemExit(f"Segment {index} ({processor.lang}) differs:\n{expected}\n{actual}")
+
+    print(f"{len(corpus)} segments: split points and word timestamps match the reference.")
+
+
+def timed(function, processor, segment):
+    segment = copy.deepcopy(segment)
+    start = time.perf_counter()
+    function(processor, segment)
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--segments", type=int, default=3000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    check(make_corpus(args.segments, args.seed))
+
+    # About an hour of speech in one segment with no punctuation, the worst case for midpoint splits
+    processor = SubtitlesProcessor([], "en-us")
+    monologue = make_segment(random.Random(args.seed), "en-us", 0, 9000, True, 0, processor.comma)
+    (segment,) = segments_from_output([monologue])
+    reference_ms = timed(reference_split_points, processor, segment)
+    current_ms = timed(SubtitlesProcessor.determine_advanced_split_points, processor, segment)
+    print(f"Hour-long monologue (9000 words): reference {reference_ms:.1f} ms, current {current_ms:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Regression checks and timing for the subtitle engine on synthetic WhisperX output (see whisperx.py).
+
+Every case renders a transcript the way the bot does in one of four modes and records a digest of the file
+it writes and of the words' timestamps afterwards (estimated ones included):
+
+    greedy     advanced splitting, greedy line breaking, SRT
+    optimal    advanced splitting, optimal line breaking, VTT
+    sentences  segments resplit into sentences first (normal_handling=False), then advanced splitting
+    segments   one cue per segment with the words' timestamps estimated (normal_handling=True)
+
+Cases cover every language in conjunctions.py at 1 and 10 minutes, and a few up to 3 hours. The digests
+are compared with benchmarks/golden/subtitles.json, so a change to the engine can show it keeps the output
+byte for byte; run with --update after a change that is meant to alter it. A case that raises fails the
+check rather than being recorded. Then process_segments and save are timed on 1-minute to 3-hour transcripts.
+
+    python benchmarks/subtitles_engine.py
+    python benchmarks/subtitles_engine.py --update
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from whisperx import LANGUAGES, make_output  # noqa: E402
+
+from subtitles import SubtitlesProcessor, segments_from_output  # noqa: E402
+from writers import SrtWriter, VttWriter  # noqa: E402
+
+GOLDEN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden", "subtitles.json")
+
+SEED = 0
+MODES = ("greedy", "optimal", "sentences", "segments")
+CASES = [
+    *((lang, minutes) for lang in LANGUAGES for minutes in (1, 10)),
+    ("en-us", 60),
+    ("en-us", 180),
+    ("zh", 60),
+    ("ar", 180),
+]
+
+
+def render(output, lang, mode):
+    """The subtitle file the bot would write for output in mode, and the words' timestamps after writing it."""
+    segments = segments_from_output(output["segments"])
+    processor = SubtitlesProcessor(
+        segments,
+        lang,
+        max_line_length=60,
+        min_char_length_splitter=30,
+        is_vtt=mode == "optimal",
+        line_breaking="optimal" if mode == "optimal" else "greedy",
+    )
+    sink = io.StringIO()
+    writer = (VttWriter if processor.is_vtt else SrtWriter)(sink)
+
+    if mode == "segments":
+        # Transcripts to be translated: a cue per segment, written after translation
+        cues = processor.process_segments(advanced_splitting=False, normal_handling=True)
+        writer.begin()
+        for cue in cues:
+            writer.write(cue)
+        writer.close()
+    else:
+        if mode == "sentences":
+            processor.segments = processor.process_segments(advanced_splitting=False, normal_handling=False)
+        processor.write([writer])
+
+    words = [(word.start, word.end) for segment in segments for word in segment.words or ()]
+    return sink.getvalue(), words
+
+
+def digest(lang, minutes, mode):
+    text, words = render(make_output(SEED, lang, minutes), lang, mode)
+    hashed = hashlib.sha256(text.encode("utf-8"))
+    hashed.update(repr(words).encode("utf-8"))
+    return hashed.hexdigest()[:32]
+
+
+def case_name(lang, minutes, mode):
+    return f"{lang}/{minutes}min/{mode}"
+
+
+def check(update):
+    digests = {
+        case_name(lang, minutes, mode): digest(lang, minutes, mode) for lang, minutes in CASES for mode in MODES
+    }
+    if update:
+        os.makedirs(os.path.dirname(GOLDEN), exist_ok=True)
+        with open(GOLDEN, "w", encoding="utf-8") as file:
+            json.dump({"seed": SEED, "cases": digests}, file, indent=2, sort_keys=True)
+            file.write("\n")
+        print(f"{len(digests)} cases written to {GOLDEN}.")
+        return 0
+
+    with open(GOLDEN, encoding="utf-8") as file:
+        golden = json.load(file)["cases"]
+    changed = sorted(name for name in digests.keys() | golden.keys() if digests.get(name) != golden.get(name))
+    for name in changed:
+        print(f"  {name}: {golden.get(name)} -> {digests.get(name)}")
+    if changed:
+        print(f"{len(changed)} of {len(digests)} cases differ from the golden digests.")
+        return 1
+
+    print(f"{len(digests)} cases match the golden digests.")
+    return 0
+
+
+def best_time(function, output, lang, line_breaking, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        processor = SubtitlesProcessor(segments_from_output(output["segments"]), lang, 60, 30, False, line_breaking)
+        start = time.perf_counter()
+        function(processor)
+        best = min(best, time.perf_counter() - start)
+
+    return best * 1000
+
+
+def timing(repeat):
+    for minutes in (1, 60, 180):
+        output = make_output(SEED, "en-us", minutes)
+        words = len(output["word_segments"])
+        results = []
+        for line_breaking in ("greedy", "optimal"):
+            process_ms = best_time(SubtitlesProcessor.process_segments, output, "en-us", line_breaking, repeat)
+            save_ms = best_time(lambda processor: processor.save(os.devnull), output, "en-us", line_breaking, repeat)
+            results.append(f"{line_breaking}: process_segments {process_ms:.1f} ms, save {save_ms:.1f} ms")
+        print(f"{minutes} min, {len(output['segments'])} segments, {words} words: {'; '.join(results)}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--update", action="store_true", help="rewrite the golden digests")
+    parser.add_argument("--no-timing", action="store_true")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    status = check(args.update)
+    if not args.no_timing:
+        timing(args.repeat)
+
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""
+utils.format_timestamps and utils.parse_timestamps against the scalar functions they batch.
+
+Checks the bulk functions give exactly the strings and floats of format_timestamp and parse_timestamp on
+seeded times: arbitrary floats, halves of a millisecond (where the rounding matters), whole milliseconds,
+the edges of each field and times of 100 hours or more. Then times them on `--count` timestamps, and
+SrtWriter on as many cues against formatting each cue's timestamps on its own, as it did before.
+
+    python benchmarks/timestamps.py --count 200000
+"""
+
+import argparse
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from subtitles import Cue  # noqa: E402
+from utils import format_timestamp, format_timestamps, parse_timestamp, parse_timestamps  # noqa: E402
+from writers import SrtWriter, SubtitleWriter  # noqa: E402
+
+
+class ScalarSrtWriter(SubtitleWriter):
+    """SrtWriter as it was, with format_timestamp called for each cue."""
+
+    def format(self, index, cue, text):
+        start = format_timestamp(cue.start)
+        end = format_timestamp(cue.end)
+        return f"{index}\n{start} --> {end}\n{text}\n\n"
+
+
+def make_times(rng, count):
+    edges = [0, 0.0005, 0.0015, 59.9995, 3599.9995, 359_999.9994, 359_999.9996, 360_000, 1e7]
+    return [
+        *edges,
+        *(rng.uniform(0, 20_000) for _ in range(count)),
+        *(rng.randrange(20_000_000) / 1000 + 0.0005 for _ in range(count)),
+        *(rng.randrange(20_000_000) / 1000 for _ in range(count)),
+        *(rng.uniform(0, 1_000_000) for _ in range(count // 10)),
+    ]
+
+
+def check(count, seed):
+    times = make_times(random.Random(seed), count)
+    for is_vtt in (False, True):
+        expected = [format_timestamp(seconds, is_vtt) for seconds in times]
+        if format_timestamps(times, is_vtt) != expected:
+            raise SystemExit(f"format_timestamps differs (is_vtt={is_vtt})")
+        if parse_timestamps(expected).tolist() != [parse_timestamp(timestamp) for timestamp in expected]:
+            raise SystemExit(f"parse_timestamps differs (is_vtt={is_vtt})")
+
+    print(f"{len(times)} times: format_timestamps and parse_timestamps match the scalar functions.")
+
+
+def best_time(function, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+
+    return best * 1000
+
+
+def write(writer, cues):
+    sink = io.StringIO()
+    srt = writer(sink)
+    srt.begin()
+    for cue in cues:
+        srt.write(cue)
+    srt.close()
+    return sink.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=200_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    check(args.count // 4, args.seed)
+
+    rng = random.Random(args.seed)
+    times = sorted(rng.uniform(0, 3 * 3600) for _ in range(args.count))
+    strings = format_timestamps(times)
+    scalar_ms = best_time(lambda: [format_timestamp(seconds) for seconds in times], args.repeat)
+    bulk_ms = best_time(lambda: format_timestamps(times), args.repeat)
+    print(f"Formatting {args.count}: format_timestamp {scalar_ms:.1f} ms, format_timestamps {bulk_ms:.1f} ms")
+    scalar_ms = best_time(lambda: [parse_timestamp(timestamp) for timestamp in strings], args.repeat)
+    bulk_ms = best_time(lambda: parse_timestamps(strings), args.repeat)
+    print(f"Parsing {args.count}: parse_timestamp {scalar_ms:.1f} ms, parse_timestamps {bulk_ms:.1f} ms")
+
+    cues = [Cue(start, start + rng.uniform(1, 4), "a line of text") for start in times]
+    if write(ScalarSrtWriter, cues) != write(SrtWriter, cues):
+        raise SystemExit("SrtWriter writes something else than formatting cue by cue")
+    scalar_ms = best_time(lambda: write(ScalarSrtWriter, cues), args.repeat)
+    bulk_ms = best_time(lambda: write(SrtWriter, cues), args.repeat)
+    print(f"Writing {len(cues)} cues as SRT: cue by cue {scalar_ms:.1f} ms, SrtWriter {bulk_ms:.1f} ms")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
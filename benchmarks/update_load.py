@@ -0,0 +1,78 @@
+"""
+Synthetic load test for PerUserUpdateProcessor.
+
+Sends `--users` x `--updates` fake updates with random handler latency through the processor, the way
+Application does (one task per update, in arrival order), and reports throughput, queue wait and any
+user whose updates were handled out of order. `--sequential` runs the same load one update at a time,
+which is how the bot processed updates before.
+
+    python benchmarks/update_load.py --users 200 --updates 10
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from update_processor import PerUserUpdateProcessor  # noqa: E402
+
+
+async def run(users, updates, latency, sequential, seed):
+    rng = random.Random(seed)
+    processor = PerUserUpdateProcessor()
+    handled = {user_id: [] for user_id in range(users)}
+
+    async def handler(user_id, sequence, delay):
+        await asyncio.sleep(delay)
+        handled[user_id].append(sequence)
+
+    load = [
+        (user_id, sequence, rng.uniform(0, latency * 2))
+        for sequence in range(updates)
+        for user_id in rng.sample(range(users), users)
+    ]
+
+    start = time.monotonic()
+    if sequential:
+        for user_id, sequence, delay in load:
+            await handler(user_id, sequence, delay)
+    else:
+        tasks = [
+            asyncio.create_task(
+                processor.process_update(
+                    SimpleNamespace(effective_user=SimpleNamespace(id=user_id)), handler(user_id, sequence, delay)
+                )
+            )
+            for user_id, sequence, delay in load
+        ]
+        await asyncio.gather(*tasks)
+    elapsed = time.monotonic() - start
+
+    out_of_order = [user_id for user_id, sequences in handled.items() if sequences != sorted(sequences)]
+
+    print(f"{len(load)} updates in {elapsed:.2f}s ({len(load) / elapsed:.0f} updates/s)")
+    if not sequential:
+        stats = processor.stats()
+        print(f"mean queue wait {stats['mean_wait'] * 1000:.1f}ms, max {stats['max_wait'] * 1000:.1f}ms")
+    print(f"users with out-of-order updates: {len(out_of_order)}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--updates", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.02, help="mean handler latency in seconds")
+    parser.add_argument("--sequential", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.users, args.updates, args.latency, args.sequential, args.seed))
+
+
+if __name__ == "__main__":
+    main()
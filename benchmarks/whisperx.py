@@ -0,0 +1,90 @@
+"""
+Seeded synthetic WhisperX results, for benchmarks and regression checks of the subtitle engine.
+
+make_output returns what the worker gets back from WhisperX: aligned segments with their words, the flat
+word_segments and the language. Words are made from the letters of each language's conjunctions (so every
+language in conjunctions.py has its own script), sentences carry commas, conjunctions of one or more words
+and end punctuation, and unspaced languages are aligned character by character. As with WhisperX, numbers
+have no timestamps, and `missing` of the other words lose theirs too.
+"""
+
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from conjunctions import conjunctions_by_language  # noqa: E402
+from profiles import profile_for  # noqa: E402
+
+LANGUAGES = sorted(conjunctions_by_language)
+
+
+def make_vocabulary(rng, lang, size=300):
+    letters = sorted({char for word in conjunctions_by_language[lang] for char in word.lower() if char.isalpha()})
+    # Unspaced languages are aligned by character, so their words are only a few characters long
+    longest = 9 if profile_for(lang).separator else 3
+    return ["".join(rng.choices(letters, k=rng.randint(2, longest))) for _ in range(size)]
+
+
+def make_sentence(rng, lang, vocabulary, weights):
+    profile = profile_for(lang)
+    conjunctions = sorted(conjunctions_by_language[lang])
+    words = []
+    for _ in range(rng.randint(2, 24)):
+        roll = rng.random()
+        if roll < 0.07 and words:
+            words.extend(rng.choice(conjunctions).split())
+        elif roll < 0.1:
+            words.append(str(rng.randint(1, 2024)))
+        else:
+            words.append(rng.choices(vocabulary, weights)[0])
+        if rng.random() < 0.06:
+            words[-1] += profile.comma
+    words[0] = words[0].capitalize()
+    words[-1] += rng.choice([".", ".", ".", "?", "!"])
+
+    if not profile.separator:
+        words = [char for word in words for char in word]
+    return words
+
+
+def make_output(seed, lang, minutes, missing=0.03):
+    """A WhisperX result for `minutes` of speech in lang (a key of conjunctions_by_language)."""
+    rng = random.Random(f"{seed}-{lang}-{minutes}")
+    separator = profile_for(lang).separator
+    vocabulary = make_vocabulary(rng, lang)
+    # Zipf-like: a few words make up most of the speech
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+
+    segments = []
+    clock = rng.choice([0.0, rng.uniform(0, 5)])
+    while clock < minutes * 60:
+        words = []
+        for _ in range(rng.choice([1, 1, 2, 3])):
+            words.extend(make_sentence(rng, lang, vocabulary, weights))
+
+        first = clock
+        aligned = []
+        for text in words:
+            word = {"word": text}
+            duration = 0.06 * len(text) + rng.uniform(0.05, 0.25)
+            if not text.strip(".,?!").isdigit() and rng.random() >= missing:
+                word["start"] = round(clock, 3)
+                word["end"] = round(clock + duration, 3)
+                word["score"] = round(rng.uniform(0.3, 1), 3)
+            aligned.append(word)
+            clock += duration + rng.uniform(0, 0.15)
+
+        timed = [word for word in aligned if "start" in word]
+        start = timed[0]["start"] if timed else round(first, 3)
+        end = timed[-1]["end"] if timed else round(clock, 3)
+        text = separator.join(words)
+        segments.append({"start": start, "end": end, "text": " " + text if separator else text, "words": aligned})
+        clock += rng.choice([0.0, rng.uniform(0.1, 0.5), rng.uniform(0.5, 3)])
+
+    return {
+        "segments": segments,
+        "word_segments": [word for segment in segments for word in segment["words"]],
+        "language": lang.split("-")[0],
+    }
@@ -0,0 +1,169 @@
+"""
+SubtitlesProcessor.process_segments on WhisperX transcripts: the columnar path (WordTimings) against the
+per-segment one it replaced, which determine_advanced_split_points and generate_subtitles_from_split_points
+still implement.
+
+Checks that both give the same cues and the same estimated word timestamps on seeded transcripts (words
+without timestamps, segments starting at 0, empty segments), then times both on a `--hours`-long transcript,
+and the columnar path stage by stage against estimating the same words one at a time. The array passes
+(fill_missing, cue_times) take about a millisecond for two hours; most of the rest is reading the Words into
+columns and making the cues, which is Python work per word and per cue either way. Also reports the memory
+its words take as the model's dicts, as Words and as the columns WordTimings keeps, and the peak memory of
+turning it into subtitles.
+
+    python benchmarks/word_timings.py --hours 2
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+from split_points import VOCABULARY, make_segment, word_times
+
+from subtitles import SubtitlesProcessor, segments_from_output
+from timings import WordTimings
+
+
+def make_transcript(rng, lang, minutes):
+    """Sentence-sized segments back to back, some words without timestamps, as WhisperX returns them."""
+    segments = []
+    clock = rng.choice([0, rng.uniform(0, 5)])
+    processor = SubtitlesProcessor([], lang)
+    while clock < minutes * 60:
+        segment = make_segment(rng, lang, clock, rng.randint(0, 40), True, rng.random(), processor.comma)
+        if rng.random() < 0.05:
+            # Words with only a start
+            for word in segment["words"]:
+                if "start" in word and rng.random() < 0.2:
+                    del word["end"]
+        segments.append(segment)
+        clock = segment["end"] + rng.choice([0, rng.uniform(0, 2)])
+
+    return segments
+
+
+def reference(processor):
+    """process_segments as it was before WordTimings."""
+    subtitles = []
+    for i, segment in enumerate(processor.segments):
+        next_segment_start_time = processor.segments[i + 1].start if i + 1 < len(processor.segments) else None
+        split_points = processor.determine_advanced_split_points(segment, next_segment_start_time)
+        subtitles.extend(processor.generate_subtitles_from_split_points(segment, split_points, next_segment_start_time))
+
+    return subtitles
+
+
+def cue_times(cues):
+    return [(cue.start, cue.end, cue.text) for cue in cues]
+
+
+def check(count, seed):
+    rng = random.Random(seed)
+    for index in range(count):
+        lang = rng.choice(list(VOCABULARY))
+        segments = make_transcript(rng, lang, rng.uniform(0.1, 5))
+        expected = SubtitlesProcessor(segments_from_output(segments), lang, 60, 30, line_breaking="greedy")
+        actual = SubtitlesProcessor(segments_from_output(segments), lang, 60, 30, line_breaking="greedy")
+        if cue_times(reference(expected)) != cue_times(actual.process_segments()) or list(
+            map(word_times, expected.segments)
+        ) != list(map(word_times, actual.segments)):
+            raise SystemExit(f"Transcript {index} ({lang}) differs")
+
+    print(f"{count} transcripts: cues and word timestamps match the per-segment path.")
+
+
+def best_time(function, segments, lang, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        processor = SubtitlesProcessor(segments_from_output(segments), lang, 60, 30, line_breaking="greedy")
+        start = time.perf_counter()
+        function(processor)
+        best = min(best, time.perf_counter() - start)
+
+    return best * 1000
+
+
+def stage_times(segments, lang, repeat):
+    """Best times of the columnar path's stages, and of estimating the same words one at a time as before."""
+    processor = SubtitlesProcessor([], lang, 60, 30, line_breaking="greedy")
+    best = {}
+
+    def timed(name, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        best[name] = min(best.get(name, float("inf")), (time.perf_counter() - start) * 1000)
+        return result
+
+    def estimate(cues):
+        for i, segment in enumerate(cues):
+            next_start = cues[i + 1].start if i + 1 < len(cues) else None
+            for j, word in enumerate(segment.words):
+                if word.start is None or word.end is None:
+                    processor.estimate_timestamp_for_word(segment.words, j, next_start)
+
+    for _ in range(repeat):
+        timed("per-word estimates", estimate, segments_from_output(segments))
+        timings = timed("from_segments", WordTimings.from_segments, segments_from_output(segments))
+        timed("fill_missing", timings.fill_missing)
+        timed("write_back", timings.write_back)
+        firsts, lasts, closing = timed("timed_cue_spans", processor.timed_cue_spans, timings)
+        timed("cue_times", timings.cue_times, firsts, lasts, closing)
+        timed("generate_subtitles_from_timings", lambda: list(processor.generate_subtitles_from_timings(timings)))
+
+    return best
+
+
+def allocated(build):
+    """What build() returns, the bytes that holds, and the most build() had allocated at once."""
+    tracemalloc.start()
+    kept = build()
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return kept, size, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--transcripts", type=int, default=300)
+    parser.add_argument("--hours", type=float, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    check(args.transcripts, args.seed)
+
+    segments = make_transcript(random.Random(args.seed), "en-us", args.hours * 60)
+    words = sum(len(segment["words"]) for segment in segments)
+    reference_ms = best_time(reference, segments, "en-us", args.repeat)
+    columnar_ms = best_time(SubtitlesProcessor.process_segments, segments, "en-us", args.repeat)
+    print(
+        f"{args.hours:g} h, {len(segments)} segments, {words} words: per-segment {reference_ms:.1f} ms, "
+        f"columnar {columnar_ms:.1f} ms ({reference_ms / columnar_ms:.1f}x)"
+    )
+    stages = stage_times(segments, "en-us", args.repeat)
+    print("Stages: " + ", ".join(f"{name} {ms:.1f} ms" for name, ms in stages.items()))
+
+    # The words' text is shared by all three, so it's left out of the sizes
+    texts = [[word["word"] for word in segment["words"]] for segment in segments]
+    dicts, dict_bytes, _ = allocated(lambda: [[dict(word) for word in segment["words"]] for segment in segments])
+    cues, word_bytes, _ = allocated(lambda: segments_from_output(segments))
+    timings = WordTimings.from_segments(cues)
+    _, column_bytes, _ = allocated(
+        lambda: (list(timings.texts), timings.starts.copy(), timings.ends.copy(), timings.lengths.copy())
+    )
+    print(
+        f"Words: dicts {dict_bytes / 2**20:.1f} MiB, Words {word_bytes / 2**20:.1f} MiB, "
+        f"columns {column_bytes / 2**20:.1f} MiB"
+    )
+    del dicts, texts
+
+    processor = SubtitlesProcessor(cues, "en-us", 60, 30, line_breaking="greedy")
+    _, _, peak = allocated(lambda: processor.save(os.devnull))
+    print(f"Subtitles: peak {peak / 2**20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -10,12 +10,12 @@ import asyncio
 import os
 import logging
 import deepl
-import threading
+import time
 from typing import Iterator
 from persistent import Persistent
-from datetime import datetime, time
+from datetime import datetime
 from ffmpeg import FfmpegProgress, get_video_duration, get_video_resolution, get_audio, get_font_size
-from subtitles import SubtitlesProcessor
+from subtitles import Cue, SubtitlesProcessor, segments_from_output
 from botocore.exceptions import NoCredentialsError
 from constants import (
     LANGUAGE_CODES,
@@ -24,6 +24,7 @@ from constants import (
     TO_KEEP_WARM,
     BAR_WIDTH,
     PROGRESS_BAR_STYLE,
+    BROADCAST_PRIORITY,
 )
 from s3 import AsynchronousS3
 from telegram import (
@@ -48,6 +49,8 @@ from utils import (
     language_to_flag,
     progress_function,
     make_url_friendly_datetime,
+    adopt_local_file,
+    local_file_uri,
 )
 from handlers import (
     start,
@@ -74,9 +77,19 @@ from handlers import (
     precheckout_callback,
     successful_payment_callback,
     support_command,
+    cancel_command,
 )
 from download import download_video
+from progress import ProgressMessage
+from ratelimiter import PriorityRateLimiter, RequestThrottle, ALLOWED, REJECTED
+from update_processor import PerUserUpdateProcessor
+from webhook import WEBHOOK_URL, run_webhook
+from jobs import JobWorker, JobFailed, RetryJob, job_inputs, JOB_WORKERS
+from pipeline import Checkpoints
+from scheduler import job_priority, job_class
+from eta import eta_model, eta_progress, format_remaining, StageTimer, refresh_eta_model, REFRESH_INTERVAL
 import yt_dlp
+import workspace
 from pathlib import Path
 
 
@@ -88,6 +101,7 @@ logging.getLogger("httpx").setLevel(logging.WARNING)
 logging.getLogger("deepl").setLevel(logging.WARNING)
 
 TOKEN = os.getenv("TOKEN")
+BOT_API_URL = os.getenv("BOT_API_URL", "http://localhost:8081")  # the local telegram-bot-api server
 DEEPL_API_KEY = os.getenv("deeplapi")
 BUCKETNAME = os.getenv("bucketname")
 VERSION = os.getenv("version")
@@ -102,15 +116,31 @@ TRANSCRIPTION_LIMIT_MIN = int(os.getenv("TRANSCRIPTION_LIMIT_MIN"))
 
 DEFAULT_AVAILABLE_MINUTES = int(os.getenv("DEFAULT_AVAILABLE_MINUTES"))
 
+request_throttle = RequestThrottle()
+
+
+async def throttled(update: Update, context: CallbackContext) -> bool:
+    """True for a link or video sent faster than the user's allowance; nothing has been done for it yet."""
+    verdict = await request_throttle.check(update)
+    if verdict == REJECTED:
+        await persistent.check_settings(update, context)
+        await update.message.reply_text(persistent.get_translation(context, "too_many_requests_text"))
+
+    return verdict != ALLOWED
+
 
 async def handle_link(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    if context.user_data.get("running_task"):
+    if await throttled(update, context):
+        return ConversationHandler.END
+
+    if await persistent.has_active_job(str(update.message.from_user.id)):
         return ConversationHandler.END
 
     link = context.user_data["link"] = update.message.text
-    persistent.check_settings(update, context)
+    await persistent.check_settings(update, context)
 
     context.user_data["document"] = False
+    context.user_data.pop("video_size", None)
 
     user_id = context.user_data["user_id"]
 
@@ -119,7 +149,7 @@ async def handle_link(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     )
     persistent.logger.info(f"Link: {context.user_data['link']}")
 
-    context.user_data["video_path"] = os.path.join(user_id, "video.mp4")
+    context.user_data["video_path"] = workspace.path(user_id, "video.mp4")
 
     if ("youtube.com" in link or "youtu.be" in link) and "playlist" in link:
         await update.message.reply_text(persistent.get_translation(context, "playlists_are_not_allowed"))
@@ -128,7 +158,8 @@ async def handle_link(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     if context.user_data.get("user_resolution") == "highest" or context.user_data.get("transcribe") == "yes":
         try:
             with yt_dlp.YoutubeDL({"noplaylist": True, "noprogress": True, "quiet": True}) as ydl:
-                info_dict = ydl.extract_info(link, download=False)
+                # extract_info blocks on the network; keep it off the event loop so other users aren't stalled
+                info_dict = await asyncio.to_thread(ydl.extract_info, link, download=False)
                 file_length = info_dict.get("duration_string")
                 file_length_min = None
                 if file_length:
@@ -137,6 +168,7 @@ async def handle_link(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
                     )
                     persistent.logger.info(f"Video duration: {file_length_min} minutes")
                 context.user_data["video_duration"] = file_length_min
+                context.user_data["video_size"] = workspace.estimate_download_bytes(info_dict)
         except Exception as e:
             logging.error(f"Error occurred in select_resolution: {str(e)}")
             traceback.print_exc()
@@ -253,11 +285,19 @@ async def handle_burn_or_display(update: Update, context: ContextTypes.DEFAULT_T
         chat_id = context.user_data["chat_id"]
         video_duration = context.user_data.get("video_duration")
 
-        persistent.logger.info(
-            f"Video_duration: {video_duration}; Available minutes: {context.user_data['available_minutes']}"
-        )
+        # Checked before any minutes are reserved: a job that can't fit on an empty disk would never be claimed
+        context.user_data["disk_bytes"] = workspace.estimate_job_bytes(context.user_data)
+        if context.user_data["disk_bytes"] > workspace.capacity():
+            persistent.logger.info(f"{context.user_data['name']} requested a video too large for the disk.")
+            text = persistent.get_translation(context, "video_too_large_text")
+            if message:
+                await message.edit_text(text)
+            else:
+                await context.bot.send_message(chat_id=chat_id, text=text)
+            return ConversationHandler.END
 
-        if video_duration and video_duration > context.user_data["available_minutes"]:
+        # Without a known duration the minutes are reserved once the download tells us how long the video is
+        if video_duration and not await reserve_job_minutes(context):
             persistent.logger.info(f"{context.user_data['name']} requested a video longer than their minutes left!")
 
             """lang = context.user_data["bot_language"]
@@ -278,11 +318,30 @@ async def handle_burn_or_display(update: Update, context: ContextTypes.DEFAULT_T
                 await context.bot.send_message(chat_id=chat_id, text=text, parse_mode="HTML")
             return ConversationHandler.END
 
-        loop = asyncio.get_running_loop()
-        threading.Thread(target=run_in_thread, args=(loop, context)).start()
+        # A worker in this or any other process picks the job up; the status message and the
+        # reservation travel with it. Shorter jobs, and paying users' jobs, are claimed first.
+        paid = await persistent.is_paying_user(context.user_data["user_id"])
+        job_id = await persistent.enqueue_job(
+            context.user_data["user_id"],
+            "video",
+            job_inputs(context.user_data),
+            priority=job_priority(context.user_data, paid),
+            job_class=job_class(context.user_data, paid),
+        )
+        if job_id is None:
+            persistent.logger.info(f"{context.user_data['name']} already has a job in progress.")
+            if "reservation_id" in context.user_data:
+                await persistent.release_reservation(context.user_data.pop("reservation_id"))
+            return ConversationHandler.END
+
+        persistent.logger.info(f"Queued job {job_id} for {context.user_data['name']}.")
+        context.user_data.pop("message", None)
+        context.user_data.pop("reservation_id", None)
 
     except Exception as e:
         persistent.logger.info(f"An error occured: {e}")
+        if "reservation_id" in context.user_data:
+            await persistent.release_reservation(context.user_data.pop("reservation_id"))
         await message.reply_text(persistent.get_translation(context, "general_error"))
 
     finally:
@@ -290,11 +349,32 @@ async def handle_burn_or_display(update: Update, context: ContextTypes.DEFAULT_T
         return ConversationHandler.END
 
 
-def run_in_thread(loop, context):
-    asyncio.run_coroutine_threadsafe(handle_video_operations(context), loop)
+async def reserve_job_minutes(context):
+    """
+    Takes the job's minutes off the balance before any work starts. The reservation is committed once the
+    result is delivered and released by handle_video_operations otherwise.
+    """
+    user_id = context.user_data["user_id"]
+    reservation = await persistent.reserve_minutes(user_id, context.user_data["video_duration"])
+
+    if reservation is None:
+        balance = await persistent.get_balance(user_id)
+        if balance is not None:
+            context.user_data["available_minutes"] = balance
+        return False
+
+    context.user_data["reservation_id"], context.user_data["available_minutes"] = reservation
+    persistent.logger.info(
+        f"Reserved {context.user_data['video_duration']} minute(s); {context.user_data['available_minutes']} left."
+    )
+
+    return True
 
 
 async def handle_video_operations(context):
+    checkpoints = Checkpoints(context)
+    retrying = False
+
     try:
         deepl_code = context.user_data.get("selected_language")
         message = context.user_data.get("message")
@@ -302,151 +382,161 @@ async def handle_video_operations(context):
         user_id = context.user_data["user_id"]
         isDocument = context.user_data.get("document")
         choice = context.user_data.get("choice")
-        context.user_data["running_task"] = True
         video_duration = context.user_data.get("video_duration")
-        need_to_check_video_duration = False
-
-        if not video_duration:
-            need_to_check_video_duration = True
+        video_path = context.user_data.get("video_path")
 
-        if isDocument:
-            video_path = context.user_data.get("video_path")
+        timer = StageTimer(context)
+        session = boto3.session.Session()
 
         persistent.logger.info(f"{context.user_data['name']} selected language: {deepl_code}")
 
-        transneed = False
+        if not message:
+            message = context.user_data["message"] = await context.bot.send_message(
+                chat_id=chat_id, text=persistent.get_translation(context, "downloading_video_text")
+            )
+        progress = context.user_data["progress"] = ProgressMessage(message)
 
-        if not isDocument:
-            persistent.logger.info("Downloading the video...")
-            if message:
-                await message.edit_text(persistent.get_translation(context, "downloading_video_text"))
-            else:
-                message = context.user_data["message"] = await context.bot.send_message(
-                    chat_id=chat_id, text=persistent.get_translation(context, "downloading_video_text")
-                )
+        if not isDocument and not checkpoints.done("download"):
+            await checkpoints.begin("download")
+            progress.update(persistent.get_translation(context, "downloading_video_text"))
             try:
-                video_path = await download_video(context.user_data["link"], context)
+                async with timer.stage("download"):
+                    video_path = await download_video(context.user_data["link"], context)
                 print("VIDEO PATH:", video_path)
-                if need_to_check_video_duration:
+                if not video_duration:
                     persistent.logger.info("The video duration wasn't found. Checking again..")
-                    context.user_data["video_duration"] = video_duration = get_video_duration(video_path)
-
-                    if video_duration > context.user_data["available_minutes"]:
-                        text = f"{persistent.get_translation(context, 'limit_exceed_text')} ({context.user_data['available_minutes']} 🕒)\n\n{persistent.get_translation(context, 'limit_exceed_text_extra')}<a href='https://telegram.org/blog/payments?setln=en'>{persistent.get_translation(context, 'prompt_check_out_text')}</a>"
-
-                        await message.edit_text(text, parse_mode="HTML")
-                        persistent.logger.info(
-                            f"{context.user_data['name']} requested a video longer than available minutes."
-                        )
-                        return
+                    video_duration = get_video_duration(video_path)
 
             except Exception as e:
+                if checkpoints.can_retry:
+                    raise RetryJob("download") from e
                 await message.reply_text(persistent.get_translation(context, "error_downloading_video_text"))
                 persistent.logger.info(f"Error downloading the video!\n{e}")
                 traceback.print_exc()
-                return
+                raise JobFailed(f"download: {e}") from e
+
+            await checkpoints.complete("download", video_path=video_path, video_duration=video_duration)
+
+        if "reservation_id" not in context.user_data:
+            if not await reserve_job_minutes(context):
+                text = f"{persistent.get_translation(context, 'limit_exceed_text')} ({context.user_data['available_minutes']} 🕒)\n\n{persistent.get_translation(context, 'limit_exceed_text_extra')}<a href='https://telegram.org/blog/payments?setln=en'>{persistent.get_translation(context, 'prompt_check_out_text')}</a>"
+
+                await progress.finish(text, parse_mode="HTML")
+                persistent.logger.info(f"{context.user_data['name']} requested a video longer than available minutes.")
+                raise JobFailed("not enough minutes")
+            await checkpoints.record(reservation_id=context.user_data["reservation_id"])
 
         # s3_thumbnail_path = f"{s3_base_path}thumbnails/"
 
-        await message.edit_text(persistent.get_translation(context, "extracting_audio_text"))
-        persistent.logger.info("Extracting audio...")
+        if not checkpoints.done("extract"):
+            await checkpoints.begin("extract")
+            progress.update(persistent.get_translation(context, "extracting_audio_text"))
 
-        audio_path, returncode = get_audio(video_path, message, context)
-        if returncode == 1:
-            await message.edit_text(persistent.get_translation(context, "no_audio_in_video_text"))
-            persistent.logger.info("No audio in this video!")
-            return
+            video_resolution = get_video_resolution(video_path)
+            async with timer.stage("extract"):
+                audio_path, returncode = await asyncio.to_thread(get_audio, video_path, message, context)
+            if returncode == 1:
+                await progress.finish(persistent.get_translation(context, "no_audio_in_video_text"))
+                persistent.logger.info("No audio in this video!")
+                raise JobFailed("no audio")
 
-        context.user_data["task"] = "transcribe"
-        if deepl_code == "EN-US":
-            context.user_data["task"] = "translate"
+            await checkpoints.complete("extract", audio_path=audio_path, video_resolution=video_resolution)
 
-        elif deepl_code != "Original":
-            transneed = True
+        context.user_data["task"] = "translate" if deepl_code == "EN-US" else "transcribe"
         to_transcribe = choice == "transcribe"
-        try:
-            persistent.logger.info("Generating subtitles/transcription...")
-            if to_transcribe:
-                await message.edit_text(persistent.get_translation(context, "generating_transcription_text"))
-            else:
-                await message.edit_text(persistent.get_translation(context, "generating_subtitles_text"))
+        generating_text = persistent.get_translation(
+            context, "generating_transcription_text" if to_transcribe else "generating_subtitles_text"
+        )
+
+        if not checkpoints.done("upload"):
+            await checkpoints.begin("upload")
+            progress.update(generating_text)
+            try:
+                s3_base_path, s3_audio_path = await asyncio.to_thread(
+                    upload_audio, context.user_data["audio_path"], context, session
+                )
+            except Exception as e:
+                if checkpoints.can_retry:
+                    raise RetryJob("upload") from e
+                await message.reply_text(persistent.get_translation(context, "error_generating_text"))
+                traceback.print_exc()
+                raise JobFailed(f"upload: {e}") from e
 
-            session = boto3.session.Session()
-            (
-                subtitles_or_transcription_path,
-                detected_language,
-            ) = await get_subtitles_or_transcription(audio_path, context, to_transcribe, message, session)
+            await checkpoints.complete("upload", s3_base_path=s3_base_path, s3_audio_path=s3_audio_path)
 
-            if context.user_data["original_language"] == "detect":
-                await message.edit_text(
-                    f"{persistent.get_translation(context, 'detected_language_text')} {detected_language}"
+        if not checkpoints.done("transcribe"):
+            await checkpoints.begin("transcribe")
+            progress.update(generating_text)
+            try:
+                (
+                    subtitles_or_transcription_path,
+                    detected_language,
+                ) = await get_subtitles_or_transcription(
+                    context.user_data["audio_path"], context, to_transcribe, message, session, checkpoints
                 )
 
-            upload_to_aws(
-                subtitles_or_transcription_path,
-                BUCKETNAME,
-                context.user_data["s3_subtitles_path"],
-                session,
-            )
+                if context.user_data["original_language"] == "detect":
+                    progress.update(f"{persistent.get_translation(context, 'detected_language_text')} {detected_language}")
 
-            if detected_language == deepl_code:
-                # await message.edit_text(persistent.get_translation(context, "language_detected_text"))
-                persistent.logger.info("Detected language is the chosen one.")
-                transneed = False
+                upload_to_aws(
+                    subtitles_or_transcription_path,
+                    BUCKETNAME,
+                    context.user_data["s3_subtitles_path"],
+                    session,
+                    callback=context.cancel_token.check,
+                )
 
-        except Exception as e:
-            await message.reply_text(persistent.get_translation(context, "error_generating_text"))
-            traceback.print_exc()
-            return
+            except Exception as e:
+                if checkpoints.can_retry:
+                    raise RetryJob("transcribe") from e
+                await message.reply_text(persistent.get_translation(context, "error_generating_text"))
+                traceback.print_exc()
+                raise JobFailed(f"transcribe: {e}") from e
+
+            await checkpoints.complete(
+                "transcribe",
+                subtitles_path=subtitles_or_transcription_path,
+                detected_language=detected_language,
+                length=context.user_data.get("length", 0),
+                link=context.user_data.get("link"),
+                s3_subtitles_path=context.user_data["s3_subtitles_path"],
+                s3_video_path=context.user_data["s3_video_path"],
+                s3_output_path=context.user_data["s3_output_path"],
+                result_link=context.user_data.get("result_link"),
+                response_code=context.user_data.get("response_code"),
+            )
+
+        subtitles_or_transcription_path = context.user_data["subtitles_path"]
+        detected_language = context.user_data["detected_language"]
 
         length = context.user_data.get("length", 0)
         if length < 2:  # "Captioning by SubtitlesGeneratorBot" subtitle
-            await message.edit_text(persistent.get_translation(context, "no_speech_detected_text"))
-            return
-        try:
-            if transneed:
-                persistent.logger.info("Translating subtitles/transcription...")
-                if to_transcribe:
-                    subtitles_or_transcription_path = await translate_transcription(
-                        subtitles_or_transcription_path, deepl_code, context, message
-                    )
+            await progress.finish(persistent.get_translation(context, "no_speech_detected_text"))
+            raise JobFailed("no speech detected")
 
-        except Exception as e:
-            await message.reply_text(persistent.get_translation(context, "error_translating_text"))
-            traceback.print_exc()
-            return
+        # English is produced by the model itself, and nothing needs translating into the detected language
+        transneed = deepl_code not in ("EN-US", "Original") and detected_language != deepl_code
+        if detected_language == deepl_code:
+            persistent.logger.info("Detected language is the chosen one.")
 
-        if to_transcribe:
-            if length < TELEGRAM_MESSAGE_LENGTH_LIMIT:
-                with open(subtitles_or_transcription_path, "r", encoding="utf-8") as file:
-                    text = file.read()
-                    await message.edit_text(f"{persistent.get_translation(context, 'transcription_result_text')}{text}")
-            else:
-                await message.reply_document(
-                    caption=persistent.get_translation(context, "transcription_result_text"),
-                    document=subtitles_or_transcription_path,
+        if to_transcribe and transneed and not checkpoints.done("translate"):
+            await checkpoints.begin("translate")
+            try:
+                subtitles_or_transcription_path = await translate_transcription(
+                    subtitles_or_transcription_path, deepl_code, context, message
                 )
-                await message.delete()
-            await message.reply_text(persistent.get_translation(context, "prompt_for_new_transcription_text"))
-            persistent.save_video(
-                context.user_data.get("user_id"),
-                context.user_data.get("username"),
-                context.user_data.get("name"),
-                "document" if isDocument else context.user_data.get("link"),
-                context.user_data.get("video_duration"),
-                "document" if isDocument else context.user_data.get("selected_resolution", "highest"),
-                context.user_data.get("selected_language").lower(),
-                True,
-            )
-            persistent.logger.info("Video saved succesfully.")
-            gc.collect()
+            except Exception as e:
+                if checkpoints.can_retry:
+                    raise RetryJob("translate") from e
+                await message.reply_text(persistent.get_translation(context, "error_translating_text"))
+                traceback.print_exc()
+                raise JobFailed(f"translate: {e}") from e
 
-            context.user_data["available_minutes"] -= context.user_data["video_duration"]
-            persistent.update_field(user_id, "available_minutes", context.user_data["available_minutes"])
-            return
+            await checkpoints.complete("translate", subtitles_path=subtitles_or_transcription_path)
 
-        if choice == "burn":
-            out_path = subtitles_or_transcription_path.replace(".srt", "_edited.mp4")
+        if choice == "burn" and not checkpoints.done("render"):
+            await checkpoints.begin("render")
+            out_path = workspace.path(user_id, "video_edited.mp4")
             print("out_path", out_path)
             print("video_path", video_path)
             font_size = (
@@ -496,80 +586,158 @@ async def handle_video_operations(context):
             ]
             print("command", command)
             try:
-                last_update = 0
                 update_threshold = (
                     1  # Set the threshold for the minimum change in progress required to trigger an update
                 )
                 persistent.logger.info("Adding subtitles...")
-                (width, height) = get_video_resolution(video_path)
-
-                for progress in run_ffmpeg_command(command):
-                    if progress - last_update >= update_threshold:
-
-                        bar = progress_function(0, 100, progress, BAR_WIDTH, progress_style=PROGRESS_BAR_STYLE)
-                        await message.edit_text(
-                            f"{persistent.get_translation(context, 'adding_subtitles_text')}<code>{bar} {progress}%</code>",
-                            parse_mode="HTML",
-                        )
-                        last_update = progress
+                burn_eta = eta_model.predict_for("burn", context.user_data)
+                burn_start = time.monotonic()
+
+                def burn():
+                    last_update = 0
+                    for percent in run_ffmpeg_command(command, context.cancel_token):
+                        if percent - last_update >= update_threshold:
+                            elapsed = time.monotonic() - burn_start
+                            # ffmpeg's own rate takes over from the model once it has made visible progress
+                            remaining = elapsed * (100 - percent) / percent if percent >= 5 else burn_eta - elapsed
+                            bar = progress_function(0, 100, percent, BAR_WIDTH, progress_style=PROGRESS_BAR_STYLE)
+                            progress.update_threadsafe(
+                                f"{persistent.get_translation(context, 'adding_subtitles_text')}<code>{bar} {percent}% {format_remaining(remaining)}</code>",
+                                parse_mode="HTML",
+                            )
+                            last_update = percent
+
+                # ffmpeg's output is read off the event loop, so other jobs and a cancellation aren't held up
+                async with timer.stage("burn"):
+                    await asyncio.to_thread(burn)
             except Exception as e:
+                if checkpoints.can_retry:
+                    raise RetryJob("render") from e
                 await message.reply_text(persistent.get_translation(context, "error_adding_subtitles_text"))
                 traceback.print_exc()
                 persistent.logger.info("Error while adding subtitles:")
-                return
+                raise JobFailed(f"render: {e}") from e
+
+            await checkpoints.complete("render", out_path=out_path)
 
+        await checkpoints.begin("deliver")
+
+        if to_transcribe:
             try:
-                persistent.logger.info("Saving the video...")
+                if length < TELEGRAM_MESSAGE_LENGTH_LIMIT:
+                    with open(subtitles_or_transcription_path, "r", encoding="utf-8") as file:
+                        text = file.read()
+                        await progress.finish(f"{persistent.get_translation(context, 'transcription_result_text')}{text}")
+                else:
+                    await message.reply_document(
+                        caption=persistent.get_translation(context, "transcription_result_text"),
+                        document=local_file_uri(subtitles_or_transcription_path),
+                    )
+                    await progress.close()
+                    await message.delete()
+                await message.reply_text(persistent.get_translation(context, "prompt_for_new_transcription_text"))
 
-                persistent.save_video(
-                    context.user_data.get("user_id"),
-                    context.user_data.get("username"),
-                    context.user_data.get("name"),
-                    context.user_data.get("link"),
-                    context.user_data.get("video_duration"),
-                    context.user_data.get("selected_resolution", "document"),
-                    context.user_data.get("selected_language").lower(),
-                    False,
-                )
-                persistent.logger.info("Video saved succesfully.")
+            except Exception as e:
+                if checkpoints.can_retry:
+                    raise RetryJob("deliver") from e
+                raise
+
+            await persistent.save_video(
+                context.user_data.get("user_id"),
+                context.user_data.get("username"),
+                context.user_data.get("name"),
+                "document" if isDocument else context.user_data.get("link"),
+                context.user_data.get("video_duration"),
+                "document" if isDocument else context.user_data.get("selected_resolution", "highest"),
+                context.user_data.get("selected_language").lower(),
+                True,
+            )
+            persistent.logger.info("Video saved succesfully.")
+            gc.collect()
 
-                await message.edit_text(persistent.get_translation(context, "sending_video_text"))
+            await persistent.commit_reservation(context.user_data["reservation_id"])
+            await checkpoints.complete("deliver")
+            return
 
-                await message.reply_chat_action("upload_video")
+        if choice == "burn":
+            out_path = context.user_data["out_path"]
+            (width, height) = context.user_data["video_resolution"]
 
-                await message.reply_video(
-                    out_path,
-                    supports_streaming=True,
-                    height=height,
-                    width=width,
-                    duration=video_duration * 60,
-                    write_timeout=1000,
-                    connect_timeout=1000,
-                    pool_timeout=1000,
-                    read_timeout=1000,
-                )
+            try:
+                # A retry after a failed send doesn't upload a video the user already has
+                if not context.user_data.get("video_delivered"):
+                    await progress.finish(persistent.get_translation(context, "sending_video_text"))
+
+                    await message.reply_chat_action("upload_video")
+
+                    async with timer.stage("upload"):
+                        await message.reply_video(
+                            local_file_uri(out_path),
+                            supports_streaming=True,
+                            height=height,
+                            width=width,
+                            duration=context.user_data["video_duration"] * 60,
+                            write_timeout=1000,
+                            connect_timeout=1000,
+                            pool_timeout=1000,
+                            read_timeout=1000,
+                        )
+                    await checkpoints.record(video_delivered=True)
 
                 await message.reply_document(
-                    document=subtitles_or_transcription_path,
+                    document=local_file_uri(subtitles_or_transcription_path),
                     caption=persistent.get_translation(context, "here_are_your_subtitles_text"),
                 )
                 await message.reply_text(persistent.get_translation(context, "prompt_for_new_subtitle_text"))
+                await progress.close()
                 await message.delete()
 
-                context.user_data["available_minutes"] -= context.user_data["video_duration"]
-                persistent.update_field(user_id, "available_minutes", context.user_data["available_minutes"])
-
             except Exception as e:
+                if checkpoints.can_retry:
+                    raise RetryJob("deliver") from e
                 await message.reply_text(persistent.get_translation(context, "error_sending_video_text"))
                 traceback.print_exc()
-                persistent.logger.info("Error while saving/sending the video...")
-                return
+                persistent.logger.info("Error while sending the video...")
+                raise JobFailed(f"deliver: {e}") from e
+
+            # Saved once the send went through, so retries of a failed send don't record the video again
+            persistent.logger.info("Saving the video...")
+            await persistent.save_video(
+                context.user_data.get("user_id"),
+                context.user_data.get("username"),
+                context.user_data.get("name"),
+                context.user_data.get("link"),
+                context.user_data.get("video_duration"),
+                context.user_data.get("selected_resolution", "document"),
+                context.user_data.get("selected_language").lower(),
+                False,
+            )
+            persistent.logger.info("Video saved succesfully.")
+
+            await persistent.commit_reservation(context.user_data["reservation_id"])
+            await checkpoints.complete("deliver")
 
         elif choice == "display":
             if context.user_data.get("response_code") == 200:
+                if "video_request_completed" not in context.user_data:
+                    # The S3 upload started by an earlier attempt died with its worker
+                    start_video_upload(context, session)
+
                 await check_request_completed(context, message)
+
+                srt_path = workspace.scratch_path(user_id, "subtitles.srt")
+                if os.path.exists(srt_path):
+                    try:
+                        await context.bot.send_document(
+                            chat_id=chat_id,
+                            document=local_file_uri(srt_path),
+                            caption=persistent.get_translation(context, "here_are_your_subtitles_text"),
+                        )
+                    except Exception as e:
+                        persistent.logger.info(f"Error: {e}")
+
                 persistent.logger.info("Saving the video...")
-                persistent.save_video(
+                await persistent.save_video(
                     user_id,
                     context.user_data.get("username"),
                     context.user_data.get("name"),
@@ -581,8 +749,8 @@ async def handle_video_operations(context):
                 )
                 persistent.logger.info("Video saved succesfully.")
 
-                context.user_data["available_minutes"] -= context.user_data["video_duration"]
-                persistent.update_field(user_id, "available_minutes", context.user_data["available_minutes"])
+                await persistent.commit_reservation(context.user_data["reservation_id"])
+                await checkpoints.complete("deliver")
 
                 return ConversationHandler.END
 
@@ -590,26 +758,57 @@ async def handle_video_operations(context):
                 await context.bot.send_message(
                     chat_id=chat_id, text=persistent.get_translation(context, "error_generating_page_text")
                 )
-                return
+                raise JobFailed(f"display: response code {context.user_data.get('response_code')}")
+
+    except RetryJob:
+        retrying = True
+        raise
+
+    except JobFailed:
+        raise
 
     except Exception as e:
         await context.bot.send_message(chat_id=chat_id, text=persistent.get_translation(context, "general_error"))
         traceback.print_exc()
-        return
+        raise JobFailed(str(e)) from e
 
     finally:
-        context.user_data["running_task"] = False
-
-        if os.path.exists(user_id):
-            shutil.rmtree(user_id)
+        cancelled = context.cancel_token.cancelled
+
+        # A job that is retried, or interrupted by a worker shutdown, goes back to the queue with its
+        # reservation and files so the next attempt can resume from its checkpoints
+        keep_for_retry = not cancelled and (retrying or asyncio.current_task().cancelling())
+
+        if cancelled:
+            persistent.logger.info(f"{context.user_data['name']} cancelled their job.")
+            prediction = context.user_data.pop("prediction", None)
+            if prediction is not None:
+                # Stops paying for model time nobody will read
+                try:
+                    await asyncio.to_thread(prediction.cancel)
+                except Exception as e:
+                    persistent.logger.info(f"Could not cancel the prediction: {e}")
+            if "progress" in context.user_data:
+                await context.user_data["progress"].finish(persistent.get_translation(context, "job_cancelled_text"))
+
+        # A job that didn't deliver gives its minutes back; for a committed one this is a no-op
+        reservation_id = context.user_data.pop("reservation_id", None)
+        if reservation_id is not None and not keep_for_retry:
+            balance = await persistent.release_reservation(reservation_id)
+            if balance is not None:
+                context.user_data["available_minutes"] = balance
+
+        if "progress" in context.user_data:
+            await context.user_data.pop("progress").close()
+
+        if not keep_for_retry:
+            workspace.remove(user_id)
 
         gc.collect()
 
         if "message" in context.user_data:
             del context.user_data["message"]
 
-        return
-
 
 async def check_request_completed(context, message, isDisplay=True):
     while not context.user_data.get("video_request_completed", False):
@@ -621,6 +820,7 @@ async def check_request_completed(context, message, isDisplay=True):
             f'<a href="{context.user_data["result_link"]}">{persistent.get_translation(context, "here_your_video")} {persistent.get_translation(context, "video")}</a>!\n\n{persistent.get_translation(context, "prompt_for_new_subtitle_text")}',
             parse_mode="HTML",
         )
+        await context.user_data["progress"].close()
         await context.user_data["message"].delete()
 
         persistent.logger.info("Generated a page succesfully.")
@@ -635,12 +835,50 @@ def on_failure(error):
     persistent.logger.info("An error occured: %s" % error)
 
 
-def run_ffmpeg_command(cmd: list[str], dry: bool = False) -> Iterator[float]:
+def run_ffmpeg_command(cmd: list[str], cancel_token=None, dry: bool = False) -> Iterator[float]:
     ff = FfmpegProgress(cmd, dry_run=dry)
-    yield from ff.run_command_with_progress()
+    progress = ff.run_command_with_progress()
+
+    # The first value comes once the process exists, so a cancellation from here on always finds it
+    yield next(progress)
+    if cancel_token is not None:
+        cancel_token.on_cancel(ff.kill)
+
+    yield from progress
+
 
+def upload_audio(audio_path, context, session):
+    user_name_clean = re.sub(r"[^a-zA-Z0-9]", "-", context.user_data["name"])
+
+    s3_base_path = os.path.join(f"{user_name_clean}-{context.user_data['user_id']}", make_url_friendly_datetime(), "")
+    s3_audio_path = os.path.join(s3_base_path, "audio.mp3")
+    print("s3_audio_path", s3_audio_path)
+    print("s3_base_path", s3_base_path)
+    persistent.logger.info("Uploading audio...")
 
-async def get_subtitles_or_transcription(audio_path: str, context, to_transcribe, message, session):
+    if not upload_to_aws(audio_path, BUCKETNAME, s3_audio_path, session, callback=context.cancel_token.check):
+        raise Exception("Could not upload the audio")
+
+    return s3_base_path, s3_audio_path
+
+
+def start_video_upload(context, session):
+    context.user_data["video_request_completed"] = False
+
+    s3 = AsynchronousS3(BUCKETNAME, session)
+
+    # The transfer callback aborts the upload once the job is cancelled
+    s3.upload_file(
+        context.user_data["video_path"],
+        context.user_data["s3_video_path"],
+        on_success,
+        on_failure,
+        context,
+        Callback=context.cancel_token.check,
+    )
+
+
+async def get_subtitles_or_transcription(audio_path: str, context, to_transcribe, message, session, checkpoints):
     isDisplay = context.user_data.get("choice") == "display"
 
     task = context.user_data.get("task", "transcribe")
@@ -653,26 +891,19 @@ async def get_subtitles_or_transcription(audio_path: str, context, to_transcribe
     model = replicate.models.get(MODEL_NAME)
     version = model.versions.get(MODEL_VERSION)
 
-    user_name = context.user_data["name"]
     user_id = context.user_data["user_id"]
 
-    user_name_clean = re.sub(r"[^a-zA-Z0-9]", "-", user_name)
-
-    path = os.path.join(
+    path = workspace.scratch_path(
         user_id, "transcription.txt" if to_transcribe else "subtitles.vtt" if isDisplay else "subtitles.srt"
     )
+    # The web player reads the VTT; the chat gets the same cues as SRT, written in the same pass
+    srt_copy = [workspace.scratch_path(user_id, "subtitles.srt")] if isDisplay else []
 
     isDocument = context.user_data.get("document")
 
-    currentTime = make_url_friendly_datetime()
-
-    s3_base_path = os.path.join(f"{user_name_clean}-{user_id}", currentTime, "")
-    s3_audio_path = os.path.join(s3_base_path, "audio.mp3")
-    print("s3_audio_path", s3_audio_path)
-    print("s3_base_path", s3_base_path)
-    persistent.logger.info("Uploading audio...")
-
-    upload_to_aws(audio_path, BUCKETNAME, s3_audio_path, session)
+    # Uploaded by the pipeline's upload stage
+    s3_base_path = context.user_data["s3_base_path"]
+    s3_audio_path = context.user_data["s3_audio_path"]
 
     original_language = (
         context.user_data["original_language"][:2] if context.user_data["original_language"] != "detect" else None
@@ -681,7 +912,20 @@ async def get_subtitles_or_transcription(audio_path: str, context, to_transcribe
     max_retries = 3  # Maximum number of retries
     retry_delay = 3  # Number of seconds to wait between retries
     print("language", original_language)
+
+    # A prediction started by an earlier attempt of this job is still running (or done) at Replicate
+    prediction = None
+    if context.user_data.get("prediction_id"):
+        prediction = replicate.predictions.get(context.user_data["prediction_id"])
+        if prediction.status in ("failed", "canceled"):
+            prediction = None
+        else:
+            persistent.logger.info(f"Resuming prediction {prediction.id}.")
+    resumed = prediction is not None
+
     for attempt in range(1, max_retries + 1):
+        if resumed:
+            break
         try:
             model_input = {
                 "audio_file": os.path.join(CLOUDFRONT_PATH, s3_audio_path),
@@ -699,35 +943,30 @@ async def get_subtitles_or_transcription(audio_path: str, context, to_transcribe
             else:
                 persistent.logger.info("Max retry attempts reached.")
 
+    if prediction is None:
+        raise Exception("Could not create a prediction")
+    if not resumed:
+        await checkpoints.record(prediction_id=prediction.id)
+
     context.user_data["prediction"] = prediction
-    duration = math.ceil(context.user_data.get("video_duration") * (1.1 if to_transcribe else 1.3)) + (
-        7 if TO_KEEP_WARM else 600
-    )
-    i = 0
+    progress = context.user_data["progress"]
+    prediction_start = time.monotonic()
+    eta = eta_model.predict_for("transcribe", context.user_data)
     # Keep looping until the prediction has succeeded
     last_progress = -1
 
     context.user_data["s3_subtitles_path"] = os.path.join(s3_base_path, "subtitles.srt")
 
-    user_name = context.user_data["name"]
-
-    user_id = context.user_data["user_id"]
-
-    user_name_clean = re.sub(r"[^a-zA-Z0-9]", "-", user_name)
-
     context.user_data["s3_video_path"] = s3_video_path = os.path.join(s3_base_path, "video.mp4")
 
     context.user_data["s3_output_path"] = os.path.join(s3_base_path, "output.mp4")
 
     persistent.logger.info("Uploading a video...")
-    context.user_data["video_request_completed"] = False
     if not isDisplay:
         persistent.logger.info(f"Video path: {os.path.join(CLOUDFRONT_PATH, s3_video_path)}")
         context.user_data["link"] = os.path.join(CLOUDFRONT_PATH, s3_video_path)
 
-    s3 = AsynchronousS3(BUCKETNAME, session)
-
-    s3.upload_file(context.user_data["video_path"], s3_video_path, on_success, on_failure, context)
+    start_video_upload(context, session)
 
     if isDisplay:
 
@@ -761,20 +1000,24 @@ async def get_subtitles_or_transcription(audio_path: str, context, to_transcribe
         if prediction.status == "succeeded":
             break
         elif prediction.status == "failed":
-            await message.reply_text(persistent.get_translation(context, "prediction_fail_error"))
+            # A retried job starts a new prediction, so the user only hears about the last failure
+            if not checkpoints.can_retry:
+                await message.reply_text(persistent.get_translation(context, "prediction_fail_error"))
             raise Exception("Prediction failed")
 
-        progress = int((i / duration) * 100)
+        elapsed = time.monotonic() - prediction_start
+        percent = eta_progress(elapsed, eta)
 
-        if i < duration and progress != last_progress:
-            bar = progress_function(0, 100, progress, BAR_WIDTH, progress_style=PROGRESS_BAR_STYLE)
-            await message.edit_text(f"{text}<code>{bar} {progress}%</code>", parse_mode="HTML")
-            last_progress = progress
+        if percent != last_progress:
+            bar = progress_function(0, 100, percent, BAR_WIDTH, progress_style=PROGRESS_BAR_STYLE)
+            progress.update(f"{text}<code>{bar} {percent}% {format_remaining(eta - elapsed)}</code>", parse_mode="HTML")
+            last_progress = percent
 
         await asyncio.sleep(0.5)
 
-        i += 1
-
+    # A resumed prediction was partly waited for by another attempt, so its duration says nothing
+    if not resumed:
+        await StageTimer(context).record("transcribe", time.monotonic() - prediction_start)
     # context.user_data["message"] = await message.edit_text(f"{text}<code>█████████████████ 100%</code>", parse_mode='HTML')
 
     output = prediction.output
@@ -794,6 +1037,7 @@ async def get_subtitles_or_transcription(audio_path: str, context, to_transcribe
         context.user_data["length"] = len(transcription)
 
     else:
+        segments = segments_from_output(output["segments"])
         advanced_splitting = context.user_data.get(
             "selected_language"
         ) == "Original" or detected_language == context.user_data.get("selected_language")
@@ -804,7 +1048,7 @@ async def get_subtitles_or_transcription(audio_path: str, context, to_transcribe
             if word_segments:
                 persistent.logger.info("advanced_splitting word segments")
                 subtitles_proccessor = SubtitlesProcessor(
-                    output["segments"],
+                    segments,
                     detected_language.lower(),
                     max_line_length=60,
                     min_char_length_splitter=30,
@@ -814,7 +1058,7 @@ async def get_subtitles_or_transcription(audio_path: str, context, to_transcribe
             else:
                 persistent.logger.info("language not supported but advanced_splitting spliiting")
                 subtitles_proccessor = SubtitlesProcessor(
-                    output["segments"],
+                    segments,
                     detected_language.lower(),
                     max_line_length=60,
                     min_char_length_splitter=30,
@@ -824,7 +1068,7 @@ async def get_subtitles_or_transcription(audio_path: str, context, to_transcribe
                     advanced_splitting=False, normal_handling=False
                 )
 
-            context.user_data["length"] = subtitles_proccessor.save(path, advanced_splitting=True)
+            context.user_data["length"] = subtitles_proccessor.save(path, advanced_splitting=True, also=srt_copy)
         else:
             normal_handling = task == "transcribe"
             word_segments = "word_segments" in output
@@ -833,7 +1077,7 @@ async def get_subtitles_or_transcription(audio_path: str, context, to_transcribe
             #     f"normal_handling: {normal_handling}, word_segments: {word_segments}, selected_language: {selected_language}"
             # )
             subtitles_proccessor = SubtitlesProcessor(
-                output["segments"],
+                segments,
                 selected_language,
                 max_line_length=75,
                 min_char_length_splitter=30,
@@ -853,22 +1097,16 @@ async def get_subtitles_or_transcription(audio_path: str, context, to_transcribe
                     # if not word_segments:
                     # persistent.logger.info('translating subittles not supported align')
                     translated_text_list = await translate_subtitles(
-                        [subtitle["text"] for subtitle in subtitles_list],
+                        [subtitle.text for subtitle in subtitles_list],
                         context.user_data["selected_language"],
                         context,
                         message,
                     )
                     translated_subtitles = []
                     for original, translated in zip(subtitles_list, translated_text_list):
-                        translated_subtitles.append(
-                            {
-                                "start": original["start"],
-                                "end": original["end"],
-                                "text": translated.text,
-                            }
-                        )
+                        translated_subtitles.append(Cue(original.start, original.end, translated.text))
                     subtitles_proccessor.segments = translated_subtitles
-            context.user_data["length"] = subtitles_proccessor.save(path, advanced_splitting=True)
+            context.user_data["length"] = subtitles_proccessor.save(path, advanced_splitting=True, also=srt_copy)
 
     del context.user_data["prediction"]
 
@@ -880,7 +1118,7 @@ async def get_subtitles_or_transcription(audio_path: str, context, to_transcribe
 async def translate_transcription(path, target_lang, context, message):
     translator = deepl.Translator(DEEPL_API_KEY)
     out_path = path.replace(".txt", "_translated.txt")
-    await message.edit_text(persistent.get_translation(context, "translating_transcription_text"))
+    context.user_data["progress"].update(persistent.get_translation(context, "translating_transcription_text"))
     with open(path, "rb") as in_file, open(out_path, "wb") as out_file:
         translator.translate_document(in_file, out_file, target_lang=target_lang)
     return out_path
@@ -908,7 +1146,7 @@ async def select_resolution(update: Update, context: ContextTypes.DEFAULT_TYPE,
             "quiet": True,
         }
     ) as ydl:
-        info_dict = ydl.extract_info(url, download=False)
+        info_dict = await asyncio.to_thread(ydl.extract_info, url, download=False)
         isYoutube = "youtube" in url or "youtu.be" in url
         resolutions_and_sizes = {}
         file_length = info_dict.get("duration_string")
@@ -955,6 +1193,8 @@ async def select_resolution(update: Update, context: ContextTypes.DEFAULT_TYPE,
 
         resolution_rows = [resolutions[i : i + 2] for i in range(0, len(resolutions), 2)]
 
+        context.user_data["resolution_sizes"] = resolutions_and_sizes
+
         text = persistent.get_translation(context, "prompt_resolution_choice_text")
 
         if len(info_dict["formats"]) >= 1 and len(resolutions) == 0:
@@ -985,6 +1225,8 @@ async def handle_resolution(update: Update, context: ContextTypes.DEFAULT_TYPE)
     selected_resolution = query.data
 
     context.user_data["selected_resolution"] = selected_resolution
+    size = context.user_data.pop("resolution_sizes", {}).get(selected_resolution)
+    context.user_data["video_size"] = int(size * 1024 * 1024) if size is not None else None
 
     await query.answer()
 
@@ -995,12 +1237,15 @@ async def handle_resolution(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 
 async def handle_video_or_document(update: Update, context: CallbackContext) -> int:
+    if await throttled(update, context):
+        return ConversationHandler.END
+
     try:
 
-        if context.user_data.get("running_task"):
+        if await persistent.has_active_job(str(update.message.from_user.id)):
             return ConversationHandler.END
 
-        persistent.check_settings(update, context)
+        await persistent.check_settings(update, context)
 
         context.user_data["link"] = None
         user_id = context.user_data["user_id"]
@@ -1012,15 +1257,15 @@ async def handle_video_or_document(update: Update, context: CallbackContext) ->
         context.user_data["message"] = await update.message.reply_text(
             persistent.get_translation(context, "downloading_video_text")
         )
-        context.user_data["video_path"] = video_path = f"{user_id}/video.mp4"
-        if not os.path.exists(user_id):
-            os.makedirs(user_id)
+        context.user_data["video_path"] = video_path = workspace.path(user_id, "video.mp4")
+        context.user_data["video_size"] = update.message.video.file_size
 
         # if update.message.video:
         file_id = update.message.video.file_id
         try:
             file = await context.bot.get_file(file_id, read_timeout=300)
-            await file.download_to_drive(video_path)
+            # The local server already stored the upload; link it into the workspace instead of copying it
+            await asyncio.to_thread(adopt_local_file, file.file_path, video_path, update.message.video.file_size)
             del file
 
         except Exception as e:
@@ -1031,7 +1276,6 @@ async def handle_video_or_document(update: Update, context: CallbackContext) ->
                 text=persistent.get_translation(context, "file_downloading_error"),
             )
             return ConversationHandler.END
-        video_path = file.file_path
         persistent.logger.info("Downloaded succesfully...")
         context.user_data["video_path"] = video_path
         context.user_data["document"] = True
@@ -1039,7 +1283,7 @@ async def handle_video_or_document(update: Update, context: CallbackContext) ->
             1 if update.message.video.duration < 60 else int(update.message.video.duration / 60)
         )  # seconds
         if context.user_data["user_font_size"] == "default":
-            context.user_data["font_size"] = get_font_size(video_path)
+            context.user_data["font_size"] = await asyncio.to_thread(get_font_size, video_path)
         await select_language(update, context, original_language=True)
         return ORIGINAL_LANGUAGE
 
@@ -1050,11 +1294,11 @@ async def handle_video_or_document(update: Update, context: CallbackContext) ->
         )
 
 
-def upload_to_aws(local_file, bucket, s3_file, session):
+def upload_to_aws(local_file, bucket, s3_file, session, callback=None):
     s3 = session.client("s3")
 
     try:
-        s3.upload_file(local_file, bucket, s3_file)
+        s3.upload_file(local_file, bucket, s3_file, Callback=callback)
         persistent.logger.info("Uploaded on S3 succesfully.")
         return True
     except FileNotFoundError:
@@ -1111,28 +1355,61 @@ async def close_bot(bot):
     print(f"Succesfull = {x}; y = {y}")
 
 
-async def send_initial_message(self, bot):
-    user_ids = persistent.get_user_ids()
-    message = ""
+async def post_init(application):
+    await persistent.open_pool()
 
-    for user_id in user_ids:
+    if JOB_WORKERS:
+        application.bot_data["job_worker"] = JobWorker(application.bot, handle_video_operations)
+        await application.bot_data["job_worker"].start()
+
+
+async def post_shutdown(application):
+    if "job_worker" in application.bot_data:
+        await application.bot_data.pop("job_worker").stop()
+
+    await persistent.close_pool()
+
+
+async def send_initial_message(bot, message=""):
+    user_ids = await persistent.get_user_ids()
+
+    async def send(user_id):
         try:
-            await bot.send_message(user_id, message, parse_mode="Markdown")
-            self.logger.info("Message sent succesfully")
+            await bot.send_message(user_id, message, parse_mode="Markdown", rate_limit_args=BROADCAST_PRIORITY)
+            return True
         except Exception as e:  # It's good to catch specific exceptions or log the general exception
-            self.logger.info(f"An error occurred while sending a message to user {user_id}: {e}")
+            persistent.logger.info(f"An error occurred while sending a message to user {user_id}: {e}")
+            return False
+
+    # The rate limiter paces the sends at the overall budget and lets interactive replies jump the queue,
+    # so the whole chunk can be handed over at once
+    sent = 0
+    chunk_size = 1000
+    for i in range(0, len(user_ids), chunk_size):
+        results = await asyncio.gather(*(send(user_id) for user_id in user_ids[i : i + chunk_size]))
+        sent += sum(results)
+
+    persistent.logger.info(f"Broadcast sent to {sent} of {len(user_ids)} users.")
 
 
 if __name__ == "__main__":
-    application = (
+    builder = (
         Application.builder()
         .token(TOKEN)
-        .base_url("http://localhost:8081/bot")
-        .base_file_url("http://localhost:8081/file/bot")
+        .base_url(f"{BOT_API_URL}/bot")
+        .base_file_url(f"{BOT_API_URL}/file/bot")
         .local_mode(True)
-        .build()
+        .rate_limiter(PriorityRateLimiter())
+        .concurrent_updates(PerUserUpdateProcessor())
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
     )
+    if WEBHOOK_URL:
+        # Updates arrive through our own aiohttp endpoint instead of long polling
+        builder = builder.updater(None)
+    application = builder.build()
     job_queue = application.job_queue
+    job_queue.run_repeating(refresh_eta_model, interval=REFRESH_INTERVAL, first=5)
     # job_queue.run_repeating(keep_warm, interval=550, first=10)
 
     # asyncio.get_event_loop().run_until_complete(close_bot(application.bot))
@@ -1204,6 +1481,8 @@ if __name__ == "__main__":
 
     application.add_handler(CommandHandler("buy_minutes", select_minutes_command))
 
+    application.add_handler(CommandHandler("cancel", cancel_command))
+
     application.add_handler(MessageHandler(filters.Regex("List Websites 📝"), list_websites))
 
     application.add_handler(MessageHandler(filters.Regex("Start 🔥"), start))
@@ -1245,9 +1524,11 @@ if __name__ == "__main__":
     application.add_handler(MessageHandler(filters.SUCCESSFUL_PAYMENT, successful_payment_callback))
 
     try:
-        application.run_polling(drop_pending_updates=True)
+        if WEBHOOK_URL:
+            run_webhook(application)
+        else:
+            # As with the webhook, updates that queued up during a restart are kept and handled
+            application.run_polling(drop_pending_updates=False)
 
     except Exception as e:
         traceback.print_exc()
-    finally:
-        persistent.close_connection()
@@ -0,0 +1,50 @@
+import threading
+
+
+class JobCancelled(Exception):
+    """Raised by work running in a thread (a download, an S3 transfer) once its job has been cancelled."""
+
+
+class CancelToken:
+    """
+    Cancellation signal shared by every stage of one job.
+
+    Stages register callbacks that stop what they started, e.g. killing an ffmpeg child. `cancel` runs them
+    right away, and any registered later runs immediately, so there's no window where a new subprocess
+    escapes. Callbacks run on the cancelling thread and must not block.
+    """
+
+    def __init__(self):
+        self._cancelled = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        with self._lock:
+            if self._cancelled.is_set():
+                return
+            self._cancelled.set()
+            callbacks, self._callbacks = self._callbacks, []
+
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def on_cancel(self, callback):
+        with self._lock:
+            if not self._cancelled.is_set():
+                self._callbacks.append(callback)
+                return
+
+        callback()
+
+    def check(self, *args):
+        """Raises JobCancelled once cancelled; accepts and ignores progress callback arguments."""
+        if self._cancelled.is_set():
+            raise JobCancelled
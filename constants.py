@@ -100,3 +100,29 @@ PROGRESS_BAR_STYLE = 2
 TELEGRAM_MESSAGE_LENGTH_LIMIT = 4096
 
 BAR_WIDTH = 17
+
+PROGRESS_EDIT_INTERVAL = 3  # seconds between edits of one progress message
+
+CHAT_EDIT_INTERVAL = 1  # seconds between progress edits in one chat
+
+CHAT_EDITS_PER_MINUTE = 20
+
+# Outgoing Bot API budgets, see https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this
+OVERALL_MESSAGES_PER_SECOND = 30
+
+PRIVATE_CHAT_MESSAGES_PER_SECOND = 1
+
+GROUP_CHAT_MESSAGES_PER_MINUTE = 20
+
+# Priorities passed as `rate_limit_args`; lower values are served first
+INTERACTIVE_PRIORITY, PROGRESS_PRIORITY, BROADCAST_PRIORITY = range(3)
+
+MAX_CONCURRENT_UPDATES = 256
+
+# Updates taken in at once, counting those waiting for an earlier update of the same user to finish
+MAX_PENDING_UPDATES = 4 * MAX_CONCURRENT_UPDATES
+
+# Links and uploads a user (and a group chat) can send in a burst, and how fast that allowance refills
+REQUEST_BURST = 5
+
+REQUESTS_PER_MINUTE = 4
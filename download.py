@@ -1,6 +1,7 @@
 import asyncio
 import re
 import yt_dlp
+import workspace
 from utils import progress_function
 from constants import PROGRESS_BAR_STYLE, BAR_WIDTH
 from persistent import Persistent
@@ -10,13 +11,16 @@ persistent = Persistent()
 
 
 async def download_video(url: str, context: CallbackContext):
-    message = context.user_data["message"]
+    progress = context.user_data["progress"]
     last_fragment = [-1]
     last_progress = [-1]
     total_frags_count = [0]
     ydl_opts = {}
 
     def progress_hook(data):
+        # Raising from a hook is how yt-dlp downloads are aborted
+        context.cancel_token.check()
+
         if data.get("status") == "downloading":
             total_frags = data.get("fragment_count", 1)
             current_frag = data.get("fragment_index", 0)
@@ -40,12 +44,13 @@ async def download_video(url: str, context: CallbackContext):
 
                 text_to_send = f"{persistent.get_translation(context, 'downloading_video_text')}<code>{bar} {current_progress}%</code>"
 
-                if current_frag >= last_fragment[0] and current_progress - last_progress[0] >= 12:
-                    asyncio.run_coroutine_threadsafe(message.edit_text(text_to_send, parse_mode="HTML"), loop)
+                # The progress channel throttles and coalesces the edits, so every visible change can be pushed
+                if current_frag >= last_fragment[0] and current_progress != last_progress[0]:
+                    progress.update_threadsafe(text_to_send, parse_mode="HTML")
                     last_fragment[0] = current_frag
                     last_progress[0] = current_progress
 
-    output_path = f"{context.user_data['user_id']}/video.mp4"
+    output_path = workspace.path(context.user_data["user_id"], "video.mp4")
 
     format_str = get_yt_dlp_format_str(url, context)
 
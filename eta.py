@@ -0,0 +1,202 @@
+import math
+import time
+from contextlib import asynccontextmanager
+from persistent import Persistent
+from constants import TO_KEEP_WARM
+
+persistent = Persistent()
+
+STAGES = ["download", "extract", "transcribe", "burn", "upload"]
+
+MIN_SAMPLES = 8  # Below this many timings for a stage/mode we keep using the hand-tuned heuristics
+
+RIDGE = 1e-3  # Keeps the normal equations solvable when every sample has the same resolution
+
+REFRESH_INTERVAL = 900  # seconds
+
+
+def job_features(user_data):
+    width, height = user_data.get("video_resolution") or (None, None)
+
+    return {
+        "mode": user_data.get("choice"),
+        "duration_min": user_data.get("video_duration"),
+        "width": width,
+        "height": height,
+        "language": user_data.get("original_language"),
+    }
+
+
+def _feature_vector(duration_min, width, height, language):
+    duration_min = duration_min or 1
+    megapixels = (width * height) / 1_000_000 if width and height else 0.5
+    detect = 1.0 if language in (None, "detect") else 0.0
+
+    return [1.0, float(duration_min), duration_min * megapixels, detect]
+
+
+def _solve(matrix, vector):
+    # Gaussian elimination with partial pivoting; the system is 4x4 so this is plenty
+    n = len(vector)
+    rows = [matrix[i][:] + [vector[i]] for i in range(n)]
+
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(rows[r][col]))
+        if abs(rows[pivot][col]) < 1e-12:
+            return None
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+
+        for r in range(col + 1, n):
+            factor = rows[r][col] / rows[col][col]
+            for c in range(col, n + 1):
+                rows[r][c] -= factor * rows[col][c]
+
+    solution = [0.0] * n
+    for r in range(n - 1, -1, -1):
+        solution[r] = (rows[r][n] - sum(rows[r][c] * solution[c] for c in range(r + 1, n))) / rows[r][r]
+
+    return solution
+
+
+def fit_linear(samples):
+    """
+    Least squares fit of seconds ~ features. `samples` is a list of (features, seconds).
+    Returns the coefficient list, or None if the system is degenerate.
+    """
+    n = len(samples[0][0])
+    xtx = [[0.0] * n for _ in range(n)]
+    xty = [0.0] * n
+
+    for x, y in samples:
+        for i in range(n):
+            xty[i] += x[i] * y
+            for j in range(n):
+                xtx[i][j] += x[i] * x[j]
+
+    for i in range(n):
+        xtx[i][i] += RIDGE
+
+    return _solve(xtx, xty)
+
+
+def fallback_seconds(stage, mode, duration_min):
+    duration_min = duration_min or 1
+
+    if stage == "transcribe":
+        # The original progress loop: one 0.5s tick per (duration * 1.1 or 1.3 + 7)
+        ticks = math.ceil(duration_min * (1.1 if mode == "transcribe" else 1.3)) + (7 if TO_KEEP_WARM else 600)
+        return ticks * 0.5
+    if stage == "download":
+        return 5 + duration_min * 2
+    if stage == "extract":
+        return 1 + duration_min * 0.5
+    if stage == "burn":
+        return 5 + duration_min * 20
+    if stage == "upload":
+        return 2 + duration_min * 1.5
+
+    return duration_min
+
+
+class EtaModel:
+    """
+    Per-stage regression of wall-clock seconds on job features (duration, resolution, language detection),
+    fitted separately for each processing mode from the `stage_timings` table.
+    """
+
+    def __init__(self):
+        self.coefficients = {}
+        self.sample_counts = {}
+        self.refreshed_at = None
+
+    async def refresh(self):
+        grouped = {}
+        for stage, mode, duration_min, width, height, language, seconds in await persistent.get_stage_timings():
+            grouped.setdefault((stage, mode), []).append(
+                (_feature_vector(duration_min, width, height, language), seconds)
+            )
+
+        coefficients = {}
+        for key, samples in grouped.items():
+            if len(samples) < MIN_SAMPLES:
+                continue
+            solution = fit_linear(samples)
+            if solution is not None:
+                coefficients[key] = solution
+
+        self.coefficients = coefficients
+        self.sample_counts = {key: len(samples) for key, samples in grouped.items()}
+        self.refreshed_at = time.time()
+        persistent.logger.info(f"ETA model refreshed with {len(coefficients)} fitted stage(s).")
+
+    def predict(self, stage, mode=None, duration_min=None, width=None, height=None, language=None):
+        coefficients = self.coefficients.get((stage, mode))
+        if coefficients is None:
+            return fallback_seconds(stage, mode, duration_min)
+
+        x = _feature_vector(duration_min, width, height, language)
+        seconds = sum(c * v for c, v in zip(coefficients, x))
+
+        # A fit can extrapolate below zero for tiny clips; never promise less than a second
+        return max(seconds, 1.0)
+
+    def predict_for(self, stage, user_data):
+        return self.predict(stage, **job_features(user_data))
+
+    def estimate_job_seconds(self, user_data):
+        features = job_features(user_data)
+        mode = features["mode"]
+        stages = ["extract", "transcribe"]
+
+        if not user_data.get("document"):
+            stages.insert(0, "download")
+        if mode == "burn":
+            stages += ["burn", "upload"]
+
+        return sum(self.predict(stage, **features) for stage in stages)
+
+
+eta_model = EtaModel()
+
+
+def eta_progress(elapsed, eta):
+    """
+    Maps elapsed/predicted seconds to a percentage that moves linearly until 90% of the ETA
+    and then creeps towards 99%, so an underestimate slows the bar down instead of freezing it.
+    """
+    if eta <= 0:
+        return 99
+
+    ratio = elapsed / eta
+    if ratio < 0.9:
+        return int(ratio * 100)
+
+    return min(99, int(90 + 9 * (1 - math.exp(-(ratio - 0.9) * 3))))
+
+
+def format_remaining(seconds):
+    seconds = max(0, int(seconds))
+
+    return f"~{seconds // 60}:{seconds % 60:02d}"
+
+
+class StageTimer:
+    """Records how long each pipeline stage of a job took, together with the job's features."""
+
+    def __init__(self, context):
+        self.context = context
+
+    @asynccontextmanager
+    async def stage(self, name):
+        start = time.monotonic()
+        yield
+        # Only successful stages are recorded; a failure's duration says nothing about the next job
+        await self.record(name, time.monotonic() - start)
+
+    async def record(self, name, seconds):
+        features = job_features(self.context.user_data)
+        await persistent.save_stage_timing(self.context.user_data.get("user_id"), name, seconds=seconds, **features)
+
+
+async def refresh_eta_model(context):
+    await eta_model.refresh()
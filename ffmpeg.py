@@ -2,6 +2,7 @@ import re
 import subprocess
 import json
 import os
+import workspace
 from typing import Any, Callable, Iterator, List, Optional, Union
 
 
@@ -21,8 +22,8 @@ def get_font_size(path):
 
 
 def get_audio(input_path, message, context):
-    output_path = os.path.splitext(input_path)[0] + ".mp3"
-    audio_extraction_process = subprocess.run(
+    output_path = workspace.scratch_path(context.user_data["user_id"], "audio.mp3")
+    audio_extraction_process = subprocess.Popen(
         [
             "ffmpeg",
             "-i",
@@ -41,6 +42,9 @@ def get_audio(input_path, message, context):
             "error",
         ]
     )
+    # Kills the extraction as soon as the job is cancelled
+    context.cancel_token.on_cancel(audio_extraction_process.kill)
+    audio_extraction_process.wait()
 
     return output_path, audio_extraction_process.returncode
 
@@ -145,3 +149,8 @@ class FfmpegProgress:
 
         yield 100
         self.process = None
+
+    def kill(self):
+        process = self.process
+        if process is not None and process.poll() is None:
+            process.kill()
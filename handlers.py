@@ -15,7 +15,7 @@ END = -1
 
 
 async def start(update: Update, context: CallbackContext):
-    persistent.check_settings(update, context)
+    await persistent.check_settings(update, context)
     keyboard = [
         ["Start 🔥"],
         ["List Websites 📝", "Help 🆘"],
@@ -44,15 +44,15 @@ async def start(update: Update, context: CallbackContext):
 
 
 async def reset_settings(update: Update, context: CallbackContext) -> None:
-    persistent.check_settings(update, context)
+    await persistent.check_settings(update, context)
     persistent.logger.info(f"{context.user_data['name']} is resetting the settings.")
-    persistent.reset_settings(context.user_data.get("user_id"), context)
+    await persistent.reset_settings(context.user_data.get("user_id"), context)
 
     await update.message.reply_text(f"{persistent.get_translation(context, 'reset_setting_prompt')}")
 
 
 async def translateto(update: Update, context: CallbackContext) -> int:
-    persistent.check_settings(update, context)
+    await persistent.check_settings(update, context)
     persistent.logger.info(f"{context.user_data['name']} is selecting a default language.")
     other_languages = [
         (lang, LANGUAGE_CODES[lang], FLAG_CODES[lang])
@@ -110,13 +110,13 @@ async def language_command_choice(update: Update, context: CallbackContext) -> i
 
     persistent.logger.info(f"{context.user_data['name']} chose {language} as their default language.")
     context.user_data["default_language"] = language
-    persistent.update_field(context.user_data.get("user_id"), "default_language", language)
+    await persistent.update_field(context.user_data.get("user_id"), "default_language", language)
 
     return END
 
 
 async def transcribe_command(update: Update, context: CallbackContext) -> None:
-    persistent.check_settings(update, context)
+    await persistent.check_settings(update, context)
     persistent.logger.info(f"{context.user_data['name']} is selecting a transcribe option")
     # Define the keyboard
     keyboard = [
@@ -149,11 +149,11 @@ async def handle_transcribe_command(update: Update, context: CallbackContext) ->
 
     persistent.logger.info(f"{context.user_data['name']} chose {decision} as a transcription option.")
     context.user_data["transcribe"] = decision
-    persistent.update_field(context.user_data["user_id"], "transcribe", decision)
+    await persistent.update_field(context.user_data["user_id"], "transcribe", decision)
 
 
 async def resolution(update: Update, context: CallbackContext) -> None:
-    persistent.check_settings(update, context)
+    await persistent.check_settings(update, context)
     persistent.logger.info(f"{context.user_data['name']} is selecting a resolution option")
     keyboard = [
         [
@@ -190,11 +190,11 @@ async def resolution_choice(update: Update, context: CallbackContext) -> None:
 
     persistent.logger.info(f"{context.user_data['name']} selected {decision} resolution.")
     context.user_data["user_resolution"] = decision
-    persistent.update_field(context.user_data["user_id"], "default_resolution", decision)
+    await persistent.update_field(context.user_data["user_id"], "default_resolution", decision)
 
 
 async def subtitle(update: Update, context: CallbackContext) -> None:
-    persistent.check_settings(update, context)
+    await persistent.check_settings(update, context)
     persistent.logger.info(f"{context.user_data['name']} is selecting a subtitle choice")
     keyboard = [
         [
@@ -236,11 +236,11 @@ async def subtitle_choice_handler(update: Update, context: CallbackContext) -> N
 
     persistent.logger.info(f"User selected {decision} for subtitles.")
     context.user_data["subtitle_choice"] = decision
-    persistent.update_field(context.user_data["user_id"], "subtitle_choice", decision)
+    await persistent.update_field(context.user_data["user_id"], "subtitle_choice", decision)
 
 
 async def list_websites(update: Update, context: CallbackContext) -> None:
-    persistent.check_settings(update, context)
+    await persistent.check_settings(update, context)
     supported_websites = [
         "Pinterest",
         "Instagram",
@@ -277,7 +277,7 @@ async def list_websites(update: Update, context: CallbackContext) -> None:
 
 
 async def help_command(update: Update, context: CallbackContext) -> None:
-    persistent.check_settings(update, context)
+    await persistent.check_settings(update, context)
     persistent.logger.info(f"{context.user_data['name']} activated !help command.")
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
@@ -287,7 +287,7 @@ async def help_command(update: Update, context: CallbackContext) -> None:
 
 
 async def bot_language(update: Update, context: CallbackContext) -> None:
-    persistent.check_settings(update, context)
+    await persistent.check_settings(update, context)
     persistent.logger.info(f"{context.user_data['name']} is selecting a bot language.")
     keyboard = [
         [
@@ -337,11 +337,11 @@ async def bot_language_choice(update: Update, context: CallbackContext) -> None:
         context.user_data["bot_language"] = decision
         await query.edit_message_text(text=persistent.get_translation(context, "selected_language_text"))
         persistent.logger.info(f"{context.user_data['name']} chose {decision} language.")
-        persistent.update_field(context.user_data.get("user_id"), "bot_language", decision)
+        await persistent.update_field(context.user_data.get("user_id"), "bot_language", decision)
 
 
 async def style(update: Update, context: CallbackContext) -> int:
-    persistent.check_settings(update, context)
+    await persistent.check_settings(update, context)
     persistent.logger.info(f"{context.user_data['name']} is selecting subtitles style.")
     if context.user_data.get("state") in [FONT, FONTSIZE, BORDERSTYLE]:
         context.user_data["state"] = END
@@ -382,7 +382,7 @@ async def style_font_choice(update: Update, context: CallbackContext) -> int:
         return END
     else:
         context.user_data["user_font"] = decision
-        persistent.update_field(context.user_data.get("user_id"), "user_font", decision)
+        await persistent.update_field(context.user_data.get("user_id"), "user_font", decision)
     persistent.logger.info(f"{context.user_data['name']} chose {decision} font.")
 
     # Generates a list of numbers from 10 to 32 in steps of 2
@@ -421,7 +421,7 @@ async def style_fontsize_choice(update: Update, context: CallbackContext) -> int
     else:
         # Save the selected font size
         context.user_data["user_font_size"] = decision
-        persistent.update_field(context.user_data["user_id"], "user_font_size", decision)
+        await persistent.update_field(context.user_data["user_id"], "user_font_size", decision)
     persistent.logger.info(f"{context.user_data['name']} chose {decision} fontsize.")
 
     keyboard = [
@@ -452,7 +452,7 @@ async def style_border_style_choice(update: Update, context: CallbackContext) ->
     else:
         context.user_data["user_border_style"] = decision
         await query.edit_message_text(text=persistent.get_translation(context, "font_update_confirmation_text"))
-        persistent.update_field(context.user_data.get("user_id"), "user_border_style", decision)
+        await persistent.update_field(context.user_data.get("user_id"), "user_border_style", decision)
 
     persistent.logger.info(f"{context.user_data['name']} chose {decision} borderstyle.")
 
@@ -460,9 +460,12 @@ async def style_border_style_choice(update: Update, context: CallbackContext) ->
 
 
 async def show_available_minutes(update: Update, context: CallbackContext) -> None:
-    persistent.check_settings(update, context)
+    await persistent.check_settings(update, context)
     persistent.logger.info(f"{context.user_data['name']} has requested a balance of available minutes.")
-    available_minutes = context.user_data["available_minutes"]
+    available_minutes = await persistent.get_balance(context.user_data["user_id"])
+    if available_minutes is None:
+        available_minutes = context.user_data["available_minutes"]
+    context.user_data["available_minutes"] = available_minutes
     await update.message.reply_text(
         f"{persistent.get_translation(context, 'current_available_minutes_text')} {available_minutes}\n\n{persistent.get_translation(context, 'current_available_minutes_text_extra')}",
         parse_mode="Markdown",
@@ -470,7 +473,7 @@ async def show_available_minutes(update: Update, context: CallbackContext) -> No
 
 
 async def select_minutes_command(update: Update, context: CallbackContext) -> None:
-    persistent.check_settings(update, context)
+    await persistent.check_settings(update, context)
     persistent.logger.info(f"{context.user_data['name']} wants to buy more minutes!")
     # Define the inline keyboard
     keyboard = [
@@ -544,8 +547,13 @@ async def precheckout_callback(update: Update, context: CallbackContext) -> None
 
 
 async def successful_payment_callback(update: Update, context: CallbackContext) -> None:
-    context.user_data["available_minutes"] += context.user_data["minutes_choice"]
-    persistent.update_field(context.user_data["user_id"], "available_minutes", context.user_data["available_minutes"])
+    balance = await persistent.credit_minutes(
+        context.user_data["user_id"],
+        context.user_data["minutes_choice"],
+        payment_id=update.message.successful_payment.telegram_payment_charge_id,
+    )
+    if balance is not None:
+        context.user_data["available_minutes"] = balance
 
     await update.message.reply_text(
         f"Thank you for your payment!\n\nYour current balance is: {context.user_data['available_minutes']} minutes"
@@ -569,21 +577,15 @@ async def support_command(update: Update, context: CallbackContext) -> None:
     await update.message.reply_text(persistent.get_translation(context, "support_text"))
 
 
-# async def cancel_handler(update: Update, context: CallbackContext) -> int:
-#     """Cancels and ends the conversation."""
-#     await update.message.reply_text(get(context, "goodbye_text"), reply_markup=ReplyKeyboardRemove())
-#     if os.path.exists(context.user_data["user_id"]):
-#         shutil.rmtree(context.user_data["user_id"])
-
-#     prediction = context.user_data.get("prediction")
-#     if prediction:
-#         context.user_data["available_minutes"] -= context.user_data["video_duration"]
-#         prediction.cancel()
-#         del context.user_data["prediction"]
+async def cancel_command(update: Update, context: CallbackContext) -> int:
+    """Cancels the user's queued or running job; the worker running it stops and releases its minutes."""
+    await persistent.check_settings(update, context)
+    cancelled = await persistent.cancel_job(context.user_data["user_id"])
 
-#     if "message" in context.user_data:
-#         del context.user_data["message"]
-
-#
+    if cancelled:
+        persistent.logger.info(f"{context.user_data['name']} has cancelled their job.")
+        await update.message.reply_text(persistent.get_translation(context, "job_cancelled_text"))
+    else:
+        await update.message.reply_text(persistent.get_translation(context, "no_job_to_cancel_text"))
 
-#     return END
+    return END
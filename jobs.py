@@ -0,0 +1,208 @@
+import asyncio
+import os
+import socket
+from datetime import date, datetime
+from telegram import Message
+from persistent import Persistent, JOB_CHANNEL, CANCEL_CHANNEL
+from cancellation import CancelToken
+import workspace
+
+persistent = Persistent()
+
+# In-process workers next to the Telegram frontend; 0 makes this process enqueue-only
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+
+POLL_INTERVAL = 10  # seconds; LISTEN/NOTIFY wakes idle workers sooner, this only covers lost notifications
+
+HEARTBEAT_INTERVAL = 15  # seconds
+
+STALE_JOB_TIMEOUT = 120  # seconds without a heartbeat before a running job is given to another worker
+
+MAX_ATTEMPTS = 3
+
+RETRY_DELAY = 30  # seconds before a job that asked to be retried can be claimed again
+
+# Live objects that are rebuilt (message) or recreated (progress) by the worker that runs the job
+TRANSIENT_KEYS = {"message", "progress", "prediction", "invoice_message"}
+
+
+def job_inputs(user_data):
+    """The JSON-serializable part of a conversation's `user_data`, plus the status message to edit."""
+    inputs = {}
+    for key, value in user_data.items():
+        if key in TRANSIENT_KEYS or isinstance(value, (date, datetime)):
+            continue
+        inputs[key] = value
+
+    message = user_data.get("message")
+    if message is not None:
+        inputs["message"] = message.to_dict()
+
+    return inputs
+
+
+class RetryJob(Exception):
+    """Raised by a job handler to put its job back in the queue; it resumes from its last checkpoint."""
+
+
+class JobFailed(Exception):
+    """Raised by a job handler that has told the user why their job failed; the job is recorded as failed."""
+
+
+class JobContext:
+    """
+    Stands in for the CallbackContext a job was created from: the same `bot` and `user_data` interface,
+    plus the job's `cancel_token`.
+    """
+
+    def __init__(self, bot, job, cancel_token=None):
+        self.bot = bot
+        self.job_id = job["id"]
+        self.cancel_token = cancel_token or CancelToken()
+        self.user_data = dict(job["inputs"])
+        # Whatever earlier attempts checkpointed takes precedence over the original inputs
+        self.user_data.update(job["artifacts"])
+        self.user_data["job_id"] = job["id"]
+        self.user_data["attempt"] = job["attempts"]
+
+        if "message" in self.user_data:
+            self.user_data["message"] = Message.de_json(self.user_data["message"], bot)
+
+
+class JobWorker:
+    """
+    Claims jobs from the `jobs` table and runs `handler(context)` for each, `concurrency` at a time.
+
+    Any number of these can run, in the bot process or in worker.py on other nodes; Postgres is the only
+    coordinator. Running jobs are heartbeated, and jobs whose worker disappeared are put back in the queue.
+    """
+
+    def __init__(self, bot, handler, concurrency=JOB_WORKERS):
+        self.bot = bot
+        self.handler = handler
+        self.concurrency = concurrency
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.running = {}  # job id -> (task, cancel token)
+        self.wakeup = asyncio.Event()
+        self.listener = None
+        self.tasks = []
+
+    async def start(self):
+        await self.collect_garbage()
+
+        self.listener = await persistent.pool.acquire()
+        await self.listener.add_listener(JOB_CHANNEL, self.notify)
+        await self.listener.add_listener(CANCEL_CHANNEL, self.notify_cancel)
+
+        loop = asyncio.get_running_loop()
+        self.tasks = [loop.create_task(self.work()) for _ in range(self.concurrency)]
+        self.tasks.append(loop.create_task(self.heartbeat()))
+        persistent.logger.info(f"Job worker {self.owner} started with {self.concurrency} slot(s).")
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+        if self.listener is not None:
+            await self.listener.remove_listener(JOB_CHANNEL, self.notify)
+            await self.listener.remove_listener(CANCEL_CHANNEL, self.notify_cancel)
+            await persistent.pool.release(self.listener)
+            self.listener = None
+
+    def notify(self, connection, pid, channel, payload):
+        self.wakeup.set()
+
+    def notify_cancel(self, connection, pid, channel, payload):
+        self.cancel(int(payload))
+
+    def cancel(self, job_id):
+        if job_id not in self.running:
+            return
+
+        task, token = self.running[job_id]
+        if token.cancelled:
+            return
+
+        persistent.logger.info(f"Cancelling job {job_id}.")
+        # The token first: the job's cleanup checks it to tell a cancellation from a worker shutdown
+        token.cancel()
+        task.cancel()
+
+    async def work(self):
+        while True:
+            # Cleared before claiming, so a notification that arrives while we look isn't lost
+            self.wakeup.clear()
+            async with workspace.admission() as free_bytes:
+                job = await persistent.claim_job(self.owner, free_bytes)
+                if job is not None:
+                    workspace.reserve(job["user_id"], job["inputs"].get("disk_bytes", 0))
+
+            if job is None:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self.run(job)
+            # The disk the job used may admit a queued job that didn't fit before
+            self.wakeup.set()
+
+    async def run(self, job):
+        persistent.logger.info(f"Running job {job['id']} (attempt {job['attempts']}) for user {job['user_id']}.")
+
+        # The handler runs as its own task, so cancelling one job leaves this worker slot running
+        token = CancelToken()
+        task = asyncio.get_running_loop().create_task(self.handler(JobContext(self.bot, job, token)))
+        self.running[job["id"]] = (task, token)
+
+        try:
+            await task
+
+        except asyncio.CancelledError:
+            if token.cancelled:
+                await persistent.finish_job(job["id"], "cancelled")
+            else:
+                await persistent.requeue_job(job["id"])
+            if asyncio.current_task().cancelling():
+                raise
+
+        except RetryJob as e:
+            if token.cancelled:
+                await persistent.finish_job(job["id"], "cancelled")
+            else:
+                persistent.logger.info(f"Job {job['id']} will be retried from its last checkpoint ({e}).")
+                await persistent.requeue_job(job["id"], delay=RETRY_DELAY)
+
+        except Exception as e:
+            await persistent.finish_job(job["id"], "cancelled" if token.cancelled else "failed", str(e))
+
+        else:
+            if asyncio.current_task().cancelling():
+                # The handler swallowed our cancellation; the job didn't finish, so another worker takes it
+                await persistent.requeue_job(job["id"])
+                raise asyncio.CancelledError
+            # A handler that returns has delivered; one that didn't raises JobFailed or another error
+            await persistent.finish_job(job["id"], "cancelled" if token.cancelled else "done")
+
+        finally:
+            self.running.pop(job["id"], None)
+
+    async def collect_garbage(self):
+        active_user_ids = await persistent.active_job_users()
+        if active_user_ids is None:
+            return
+
+        removed = await asyncio.to_thread(workspace.collect_garbage, active_user_ids)
+        if removed:
+            persistent.logger.info(f"Removed {removed} orphaned workspace(s).")
+
+    async def heartbeat(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            if self.running:
+                for job_id in await persistent.heartbeat_jobs(list(self.running), self.owner):
+                    self.cancel(job_id)
+            await persistent.requeue_stale_jobs(STALE_JOB_TIMEOUT, MAX_ATTEMPTS)
@@ -1,8 +1,198 @@
 import os
-import psycopg2
+import asyncio
+import asyncpg
 import logging
 import json
-from datetime import datetime, timezone
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+# Errors after which a retry on a fresh connection is worth it, e.g. while Postgres restarts
+RECONNECT_ERRORS = (
+    asyncpg.PostgresConnectionError,
+    asyncpg.InterfaceError,
+    asyncpg.exceptions.OperatorInterventionError,
+    ConnectionError,
+    OSError,
+)
+
+HEALTH_CHECK_INTERVAL = 30  # seconds
+
+SETTINGS_CACHE_TTL = 600  # seconds before a cached user row is read from the database again
+
+SETTINGS_CACHE_SIZE = 10_000  # least recently used rows are evicted beyond this
+
+WRITE_BEHIND_INTERVAL = 2  # seconds between flushes of coalesced setting writes
+
+# Flushes a queued setting write may fail for a reason other than the connection before it's logged and dropped
+MAX_WRITE_ATTEMPTS = 3
+
+# Advisory lock key held while the schema is created or migrated, so processes starting together take turns
+SCHEMA_LOCK = 0x6361_7074_696F_6E  # "caption"
+
+# Reservations older than this are left over from a crashed process and are given back on startup
+RESERVATION_TIMEOUT = 12 * 60 * 60  # seconds
+
+USER_COLUMNS = [
+    "user_id",
+    "username",
+    "name",
+    "start_time_utc",
+    "bot_language",
+    "user_font",
+    "user_font_size",
+    "user_border_style",
+    "default_language",
+    "default_resolution",
+    "transcribe",
+    "subtitle_choice",
+    "available_minutes",
+]
+
+# Fixed statements are prepared server-side once per pooled connection by asyncpg's statement cache
+GET_USER_DATA = f"""
+				SELECT {", ".join(USER_COLUMNS)}
+				FROM users
+				WHERE user_id = $1
+			"""
+
+SAVE_VIDEO = """
+				INSERT INTO videos (user_id, username, name, link, sent_time_utc, duration_min, resolution, selected_language, is_transcription)
+				VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+			"""
+
+# One statement per updatable column, since a column name can't be a bind parameter.
+# The balance isn't one of them: it only changes through the minutes ledger below.
+UPDATE_FIELD = {
+    field_name: f"""
+				UPDATE users
+				SET {field_name} = $2
+				WHERE user_id = $1 AND {field_name} IS DISTINCT FROM $2
+			"""
+    for field_name in USER_COLUMNS[4:-1]
+}
+
+RESET_SETTINGS = """
+				UPDATE users
+				SET user_font = $2,
+					user_font_size = $2,
+					user_border_style = $2,
+					default_language = $2,
+					default_resolution = $2,
+					transcribe = $2,
+					subtitle_choice = $2
+				WHERE user_id = $1
+			"""
+
+# users.available_minutes is the materialized sum of the user's ledger entries. Every statement below
+# moves the balance and appends the matching ledger entry in one round trip, so concurrent jobs, payments
+# and processes never see a half-applied change and need no lock beyond the row lock of the UPDATE.
+RESERVE_MINUTES = """
+				WITH debit AS (
+					UPDATE users
+					SET available_minutes = available_minutes - $2
+					WHERE user_id = $1 AND available_minutes >= $2
+					RETURNING available_minutes
+				), reservation AS (
+					INSERT INTO minute_reservations (user_id, minutes, status, created_time_utc, updated_time_utc)
+					SELECT $1, $2, 'reserved', $3, $3 FROM debit
+					RETURNING id
+				), entry AS (
+					INSERT INTO minutes_ledger (user_id, delta, kind, reservation_id, created_time_utc)
+					SELECT $1, -$2, 'reserve', id, $3 FROM reservation
+				)
+				SELECT reservation.id, debit.available_minutes
+				FROM debit, reservation
+			"""
+
+COMMIT_RESERVATION = """
+				UPDATE minute_reservations
+				SET status = 'committed', updated_time_utc = $2
+				WHERE id = $1 AND status = 'reserved'
+			"""
+
+# Releasing is a no-op for a reservation that was already committed or released
+RELEASE_RESERVATION = """
+				WITH released AS (
+					UPDATE minute_reservations
+					SET status = 'released', updated_time_utc = $2
+					WHERE id = $1 AND status = 'reserved'
+					RETURNING user_id, minutes
+				), credit AS (
+					UPDATE users
+					SET available_minutes = available_minutes + released.minutes
+					FROM released
+					WHERE users.user_id = released.user_id
+					RETURNING users.user_id, users.available_minutes
+				), entry AS (
+					INSERT INTO minutes_ledger (user_id, delta, kind, reservation_id, created_time_utc)
+					SELECT user_id, minutes, 'release', $1, $2 FROM released
+				)
+				SELECT user_id, available_minutes FROM credit
+			"""
+
+# A payment is credited once: crediting the same payment_id again changes nothing and returns no row
+CREDIT_MINUTES = """
+				WITH entry AS (
+					INSERT INTO minutes_ledger (user_id, delta, kind, payment_id, created_time_utc)
+					SELECT $1, $2, $3, $5, $4 FROM users WHERE user_id = $1
+					ON CONFLICT (payment_id) WHERE payment_id IS NOT NULL DO NOTHING
+					RETURNING user_id
+				), credit AS (
+					UPDATE users
+					SET available_minutes = available_minutes + $2
+					FROM entry
+					WHERE users.user_id = entry.user_id
+					RETURNING available_minutes
+				)
+				SELECT available_minutes FROM credit
+			"""
+
+JOB_CHANNEL = "captionyx_jobs"  # NOTIFY channel workers LISTEN on for new work
+
+CANCEL_CHANNEL = "captionyx_job_cancels"  # NOTIFY channel for cancelling jobs that are already running
+
+# The minutes reservation a job holds; it's taken by the frontend or, for links without a known
+# duration, checkpointed by the worker after the download
+JOB_RESERVATION = "COALESCE(artifacts->>'reservation_id', inputs->>'reservation_id')::bigint"
+
+JOB_AGING_RATE = 1  # priority points a queued job gains per second waited, so long jobs can't starve
+
+# Lower priority values, less the time waited, are claimed first. SKIP LOCKED lets any number of workers
+# on any node poll the same queue without blocking on, or double-claiming, each other's rows.
+CLAIM_JOB = f"""
+				UPDATE jobs
+				SET status = 'running', owner = $1, attempts = attempts + 1, heartbeat_time_utc = $2, updated_time_utc = $2,
+					claimed_time_utc = COALESCE(claimed_time_utc, $2)
+				WHERE id = (
+					SELECT id
+					FROM jobs
+					WHERE status = 'queued' AND (run_after_time_utc IS NULL OR run_after_time_utc <= $2)
+						-- Jobs that don't fit the claiming node's free disk are left for a later claim or another node
+						AND ($3::bigint IS NULL OR COALESCE((inputs->>'disk_bytes')::bigint, 0) <= $3)
+					ORDER BY priority - EXTRACT(EPOCH FROM $2 - created_time_utc) * {JOB_AGING_RATE}, id
+					LIMIT 1
+					FOR UPDATE SKIP LOCKED
+				)
+				RETURNING id, user_id, kind, stage, inputs, artifacts, attempts
+			"""
+
+# Refills the bucket for the time since its last request and takes a token; no row comes back when it's empty
+TAKE_REQUEST_TOKEN = """
+				INSERT INTO request_buckets (key, tokens, updated_time_utc)
+				VALUES ($1, $3 - 1, $4)
+				ON CONFLICT (key) DO UPDATE
+				SET tokens = LEAST($3, request_buckets.tokens + EXTRACT(EPOCH FROM $4 - request_buckets.updated_time_utc) * $2) - 1,
+					updated_time_utc = $4
+				WHERE LEAST($3, request_buckets.tokens + EXTRACT(EPOCH FROM $4 - request_buckets.updated_time_utc) * $2) >= 1
+				RETURNING tokens
+			"""
+
+GET_BALANCE = """
+				SELECT available_minutes
+				FROM users
+				WHERE user_id = $1
+			"""
 
 
 class Persistent:
@@ -16,8 +206,7 @@ class Persistent:
                     default_available_minutes (int): The default available minutes value.
                     data (dict): The loaded translations data.
                     list_of_supported_languages (list): The list of supported languages.
-                    conn (psycopg2.extensions.connection): The database connection object.
-                    cur (psycopg2.extensions.cursor): The database cursor object.
+                    pool (asyncpg.Pool): The database connection pool, opened by `open_pool`.
     """
 
     _instance = None
@@ -34,8 +223,14 @@ class Persistent:
             cls._instance.default_setting = "default"
             cls._instance.default_available_minutes = 60
             cls._instance.load_translations("translations/translations.json")
-            cls._instance.connect_to_database()
-            cls._instance.create_tables_if_not_exist()
+            # The pool needs the running event loop, so it's opened from the application's post_init
+            cls._instance.pool = None
+            cls._instance.health_check_task = None
+            cls._instance.settings_cache = OrderedDict()
+            cls._instance.pending_writes = {}
+            cls._instance.write_attempts = {}
+            cls._instance.flush_lock = asyncio.Lock()
+            cls._instance.flush_task = None
 
             print("Creating a new class.")
         else:
@@ -54,17 +249,65 @@ class Persistent:
     def get_translation(self, context, text_key):
         return self.data[context.user_data["bot_language"]][text_key]
 
-    def connect_to_database(self):
-
+    async def open_pool(self):
         if os.environ.get("production") == "True":
-            self.conn = psycopg2.connect(os.getenv("DATABASE_URL"))
+            dsn = os.getenv("DATABASE_URL")
         else:
-            self.conn = psycopg2.connect(os.getenv("DATABASE_PUBLIC_URL"))
+            dsn = os.getenv("DATABASE_PUBLIC_URL")
+
+        self.pool = await asyncpg.create_pool(
+            dsn,
+            min_size=int(os.getenv("DB_POOL_MIN_SIZE", "2")),
+            max_size=int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+            max_inactive_connection_lifetime=300,
+            command_timeout=30,
+        )
+        async with self.pool.acquire() as conn:
+            await conn.execute("SELECT pg_advisory_lock($1)", SCHEMA_LOCK)
+            try:
+                await self.create_tables_if_not_exist()
+            finally:
+                await conn.execute("SELECT pg_advisory_unlock($1)", SCHEMA_LOCK)
+        await self.release_stale_reservations()
+        self.health_check_task = asyncio.get_running_loop().create_task(self.health_check())
+        self.flush_task = asyncio.get_running_loop().create_task(self.write_behind())
+
+    async def close_pool(self):
+        if self.health_check_task:
+            self.health_check_task.cancel()
+        if self.flush_task:
+            self.flush_task.cancel()
+        if self.pool:
+            await self.flush_writes()
+            await self.pool.close()
 
-        self.cur = self.conn.cursor()
+    async def execute(self, method, query, *args, retry=False):
+        """
+        Runs `query` with the given asyncpg connection method. With retry, it's run again once on a fresh
+        connection if the connection was lost; only reads and writes that change nothing the second time may
+        ask for it, since the server may have committed the first run before the connection dropped.
+        """
+        for attempt in range(2):
+            try:
+                async with self.pool.acquire() as conn:
+                    return await getattr(conn, method)(query, *args)
+            except RECONNECT_ERRORS as e:
+                if attempt or not retry:
+                    raise
+                self.logger.info(f"Database connection lost ({e}), reconnecting...")
+                await self.pool.expire_connections()
 
-    def create_tables_if_not_exist(self):
-        self.cur.execute(
+    async def health_check(self):
+        while True:
+            await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+            try:
+                await self.execute("fetchval", "SELECT 1", retry=True)
+            except Exception as e:
+                self.logger.info(f"Database health check failed: {e}")
+
+    async def create_tables_if_not_exist(self):
+        await self.execute(
+            "execute",
             """
 			CREATE TABLE IF NOT EXISTS users (
 				user_id TEXT PRIMARY KEY,
@@ -81,12 +324,12 @@ class Persistent:
 				subtitle_choice TEXT,
 				available_minutes INTEGER
 			)
-		"""
+		""",
+            retry=True,
         )
 
-        self.conn.commit()
-
-        self.cur.execute(
+        await self.execute(
+            "execute",
             """
 			CREATE TABLE IF NOT EXISTS videos (
 				id SERIAL PRIMARY KEY,
@@ -101,25 +344,151 @@ class Persistent:
 				is_transcription BOOLEAN,
 				FOREIGN KEY (user_id) REFERENCES users (user_id)
 			)
-		"""
+		""",
+            retry=True,
+        )
+
+        await self.execute(
+            "execute",
+            """
+			CREATE TABLE IF NOT EXISTS stage_timings (
+				id SERIAL PRIMARY KEY,
+				user_id TEXT,
+				stage TEXT NOT NULL,
+				mode TEXT,
+				duration_min INTEGER,
+				width INTEGER,
+				height INTEGER,
+				language TEXT,
+				seconds REAL NOT NULL,
+				recorded_time_utc TIMESTAMP NOT NULL
+			)
+		""",
+            retry=True,
+        )
+
+        await self.execute(
+            "execute",
+            """
+			CREATE TABLE IF NOT EXISTS minute_reservations (
+				id BIGSERIAL PRIMARY KEY,
+				user_id TEXT NOT NULL,
+				minutes INTEGER NOT NULL,
+				status TEXT NOT NULL,
+				created_time_utc TIMESTAMP NOT NULL,
+				updated_time_utc TIMESTAMP NOT NULL,
+				FOREIGN KEY (user_id) REFERENCES users (user_id)
+			);
+			CREATE INDEX IF NOT EXISTS minute_reservations_open
+			ON minute_reservations (created_time_utc) WHERE status = 'reserved';
+
+			CREATE TABLE IF NOT EXISTS minutes_ledger (
+				id BIGSERIAL PRIMARY KEY,
+				user_id TEXT NOT NULL,
+				delta INTEGER NOT NULL,
+				kind TEXT NOT NULL,
+				reservation_id BIGINT REFERENCES minute_reservations (id),
+				created_time_utc TIMESTAMP NOT NULL,
+				FOREIGN KEY (user_id) REFERENCES users (user_id)
+			);
+			CREATE INDEX IF NOT EXISTS minutes_ledger_user_id ON minutes_ledger (user_id);
+			ALTER TABLE minutes_ledger ADD COLUMN IF NOT EXISTS payment_id TEXT;
+			CREATE UNIQUE INDEX IF NOT EXISTS minutes_ledger_payment ON minutes_ledger (payment_id) WHERE payment_id IS NOT NULL;
+			CREATE UNIQUE INDEX IF NOT EXISTS minutes_ledger_opening ON minutes_ledger (user_id) WHERE kind = 'opening';
+		""",
+            retry=True,
+        )
+
+        await self.create_jobs_table()
+
+        await self.execute(
+            "execute",
+            """
+			CREATE TABLE IF NOT EXISTS request_buckets (
+				key TEXT PRIMARY KEY,
+				tokens DOUBLE PRECISION NOT NULL,
+				updated_time_utc TIMESTAMP NOT NULL
+			)
+		""",
+            retry=True,
         )
-        self.conn.commit()
 
-    def get_user_data(self, user_id):
+        # Balances from before the ledger existed are carried over as each user's opening entry; the unique
+        # index keeps it to one even if this runs outside open_pool's lock
+        await self.execute(
+            "execute",
+            """
+			INSERT INTO minutes_ledger (user_id, delta, kind, created_time_utc)
+			SELECT user_id, COALESCE(available_minutes, 0), 'opening', $1
+			FROM users
+			WHERE NOT EXISTS (SELECT 1 FROM minutes_ledger WHERE minutes_ledger.user_id = users.user_id)
+			ON CONFLICT (user_id) WHERE kind = 'opening' DO NOTHING
+		""",
+            datetime.utcnow(),
+            retry=True,
+        )
+
+    async def create_jobs_table(self):
+        await self.execute(
+            "execute",
+            """
+			CREATE TABLE IF NOT EXISTS jobs (
+				id BIGSERIAL PRIMARY KEY,
+				user_id TEXT NOT NULL,
+				kind TEXT NOT NULL,
+				stage TEXT,
+				status TEXT NOT NULL,
+				priority INTEGER NOT NULL DEFAULT 0,
+				inputs JSONB NOT NULL,
+				artifacts JSONB NOT NULL DEFAULT '{}',
+				owner TEXT,
+				attempts INTEGER NOT NULL DEFAULT 0,
+				error TEXT,
+				heartbeat_time_utc TIMESTAMP,
+				created_time_utc TIMESTAMP NOT NULL,
+				updated_time_utc TIMESTAMP NOT NULL,
+				FOREIGN KEY (user_id) REFERENCES users (user_id)
+			);
+			CREATE INDEX IF NOT EXISTS jobs_queued ON jobs (priority, id) WHERE status = 'queued';
+			CREATE UNIQUE INDEX IF NOT EXISTS jobs_one_active_per_user ON jobs (user_id) WHERE status IN ('queued', 'running');
+			ALTER TABLE jobs ADD COLUMN IF NOT EXISTS run_after_time_utc TIMESTAMP;
+			ALTER TABLE jobs ADD COLUMN IF NOT EXISTS cancel_requested BOOLEAN NOT NULL DEFAULT FALSE;
+			ALTER TABLE jobs ADD COLUMN IF NOT EXISTS job_class TEXT;
+			ALTER TABLE jobs ADD COLUMN IF NOT EXISTS claimed_time_utc TIMESTAMP;
+		""",
+            retry=True,
+        )
+
+    def cache_user(self, user_id, row):
+        self.settings_cache[user_id] = (time.monotonic(), row)
+        self.settings_cache.move_to_end(user_id)
+
+        while len(self.settings_cache) > SETTINGS_CACHE_SIZE:
+            self.settings_cache.popitem(last=False)
+
+    async def get_user_data(self, user_id):
+        cached = self.settings_cache.get(user_id)
+        if cached is not None and time.monotonic() - cached[0] < SETTINGS_CACHE_TTL:
+            self.settings_cache.move_to_end(user_id)
+            return dict(cached[1])
+
         try:
-            self.cur.execute(
-                f"""
-				SELECT user_id, username, name, start_time_utc, bot_language, user_font, user_font_size, user_border_style, default_language, default_resolution, transcribe, subtitle_choice, available_minutes
-				FROM users
-				WHERE user_id = '{user_id}'
-			"""
-            )
-            return self.cur.fetchone()
+            record = await self.execute("fetchrow", GET_USER_DATA, user_id, retry=True)
         except Exception as e:
             self.logger.info(f"Error: {e}")
             return None
 
-    def check_settings(
+        if record is None:
+            return None
+
+        row = dict(record)
+        # Writes that haven't been flushed yet are newer than what the database returned
+        row.update(self.pending_writes.get(user_id, {}))
+        self.cache_user(user_id, row)
+
+        return dict(row)
+
+    async def check_settings(
         self,
         update,
         context,
@@ -128,7 +497,7 @@ class Persistent:
             return
 
         user_id = str(update.message.from_user.id)
-        db_data = self.get_user_data(user_id)
+        db_data = await self.get_user_data(user_id)
         context.user_data["chat_id"] = update.effective_chat.id
         if db_data is None:
             name = (
@@ -146,65 +515,56 @@ class Persistent:
             if bot_language == "ru":
                 bot_language = "uk"
 
-            self.save_user_settings(context, user_id, update.message.from_user.username, name, bot_language)
+            await self.save_user_settings(context, user_id, update.message.from_user.username, name, bot_language)
         else:
-            context.user_data.update(
-                dict(
-                    zip(
-                        [
-                            "user_id",
-                            "username",
-                            "name",
-                            "start_time_utc",
-                            "bot_language",
-                            "user_font",
-                            "user_font_size",
-                            "user_border_style",
-                            "default_language",
-                            "default_resolution",
-                            "transcribe",
-                            "subtitle_choice",
-                            "available_minutes",
-                        ],
-                        db_data,
-                    )
-                )
-            )
+            context.user_data.update(db_data)
 
-    def save_user_settings(self, context, user_id, username, name, bot_language):
+    async def save_user_settings(self, context, user_id, username, name, bot_language):
         try:
             start_time_utc = datetime.now(timezone.utc)  # get the current date and time
-            self.cur.execute(
+            # The free minutes are the user's first ledger entry, written together with the user
+            await self.execute(
+                "execute",
                 f"""
-				INSERT INTO users (user_id, username, name, start_time_utc, bot_language, user_font_size, user_font, user_border_style, default_language, default_resolution, transcribe, subtitle_choice, available_minutes)
-				VALUES ('{user_id}', '{username}', '{name}', '{start_time_utc}', '{bot_language}', '{self.default_setting}', '{self.default_setting}', '{self.default_setting}', '{self.default_setting}', '{self.default_setting}', '{self.default_setting}', '{self.default_setting}', '{self.default_available_minutes}')
-			"""
+				WITH new_user AS (
+					INSERT INTO users ({", ".join(USER_COLUMNS)})
+					VALUES ($1, $2, $3, $4, $5, $6, $6, $6, $6, $6, $6, $6, $7)
+					RETURNING user_id
+				)
+				INSERT INTO minutes_ledger (user_id, delta, kind, created_time_utc)
+				SELECT user_id, $7, 'grant', $4 FROM new_user
+			""",
+                user_id,
+                username,
+                name,
+                start_time_utc.replace(tzinfo=None),
+                bot_language,
+                self.default_setting,
+                self.default_available_minutes,
             )
-            self.conn.commit()
 
-            context.user_data.update(
-                {
-                    "user_id": user_id,
-                    "username": username,
-                    "name": name,
-                    "bot_language": bot_language,
-                    "start_time_utc": start_time_utc,
-                    "user_font": self.default_setting,
-                    "user_font_size": self.default_setting,
-                    "user_border_style": self.default_setting,
-                    "default_language": self.default_setting,
-                    "default_resolution": self.default_setting,
-                    "transcribe": self.default_setting,
-                    "subtitle_choice": self.default_setting,
-                    "available_minutes": self.default_available_minutes,
-                }
-            )
+            row = {
+                "user_id": user_id,
+                "username": username,
+                "name": name,
+                "bot_language": bot_language,
+                "start_time_utc": start_time_utc,
+                "user_font": self.default_setting,
+                "user_font_size": self.default_setting,
+                "user_border_style": self.default_setting,
+                "default_language": self.default_setting,
+                "default_resolution": self.default_setting,
+                "transcribe": self.default_setting,
+                "subtitle_choice": self.default_setting,
+                "available_minutes": self.default_available_minutes,
+            }
+            self.cache_user(user_id, row)
+            context.user_data.update(row)
 
         except Exception as e:
             self.logger.info(f"Error: {e}")
-            self.conn.rollback()
 
-    def save_video(
+    async def save_video(
         self,
         user_id,
         username,
@@ -217,47 +577,185 @@ class Persistent:
     ):
         try:
             sent_time_utc = datetime.utcnow()
-            self.cur.execute(
-                f"""
-				INSERT INTO videos (user_id, username, name, link, sent_time_utc, duration_min, resolution, selected_language, is_transcription)
-				VALUES ('{user_id}', '{username}', '{name}', '{link}', '{sent_time_utc}', '{duration_min}', '{resolution}', '{selected_language}', '{is_transcription}')
-			"""
+            await self.execute(
+                "execute",
+                SAVE_VIDEO,
+                user_id,
+                username,
+                name,
+                link,
+                sent_time_utc,
+                duration_min,
+                resolution,
+                selected_language,
+                is_transcription,
             )
-            self.conn.commit()
         except Exception as e:
             self.logger.info(f"Error saving the video:\n{e}")
-            self.conn.rollback()
 
-    def update_field(self, user_id, field_name, field_value):
+    async def save_stage_timing(self, user_id, stage, mode, duration_min, width, height, language, seconds):
         try:
-            self.cur.execute(
-                f"""
-				UPDATE users 
-				SET {field_name} = '{field_value}'
-				WHERE user_id = '{user_id}' AND {field_name} IS DISTINCT FROM '{field_value}'
-			"""
+            await self.execute(
+                "execute",
+                """
+				INSERT INTO stage_timings (user_id, stage, mode, duration_min, width, height, language, seconds, recorded_time_utc)
+				VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+			""",
+                user_id,
+                stage,
+                mode,
+                duration_min,
+                width,
+                height,
+                language,
+                seconds,
+                datetime.utcnow(),
             )
-            self.conn.commit()
+        except Exception as e:
+            self.logger.info(f"Error saving the stage timing:\n{e}")
+
+    async def take_request_token(self, key, rate, burst):
+        """Takes a token from the shared bucket for `key`. Lets the request through if the database is unreachable."""
+        try:
+            tokens = await self.execute("fetchval", TAKE_REQUEST_TOKEN, key, float(rate), float(burst), datetime.utcnow())
         except Exception as e:
             self.logger.info(f"Error: {e}")
-            self.conn.rollback()
+            return True
+
+        return tokens is not None
 
-    def reset_settings(self, user_id, context):
+    async def get_stage_timings(self, limit=5000):
+        # Most recent timings first, so the model follows hardware and model-version changes
         try:
-            self.cur.execute(
-                f"""
-				UPDATE users 
-				SET user_font = '{self.default_setting}',
-					user_font_size = '{self.default_setting}',
-					user_border_style = '{self.default_setting}',
-					default_language = '{self.default_setting}',
-					default_resolution = '{self.default_setting}',
-					transcribe = '{self.default_setting}',
-					subtitle_choice = '{self.default_setting}'
-				WHERE user_id = '{user_id}'
-			"""
+            return await self.execute(
+                "fetch",
+                """
+				SELECT stage, mode, duration_min, width, height, language, seconds
+				FROM stage_timings
+				ORDER BY recorded_time_utc DESC
+				LIMIT $1
+			""",
+                limit,
+                retry=True,
             )
-            self.conn.commit()
+        except Exception as e:
+            self.logger.info(f"Error: {e}")
+            return []
+
+    async def update_field(self, user_id, field_name, field_value):
+        """
+        Updates the cached row right away and queues the write; queued writes are coalesced per user and
+        field and flushed in one transaction every WRITE_BEHIND_INTERVAL seconds.
+        """
+        if field_name not in UPDATE_FIELD:
+            raise ValueError(f"Unknown user field: {field_name}")
+
+        cached = self.settings_cache.get(user_id)
+        if cached is not None:
+            cached[1][field_name] = field_value
+
+        self.pending_writes.setdefault(user_id, {})[field_name] = field_value
+        self.write_attempts.pop((user_id, field_name), None)
+
+    async def flush_writes(self):
+        async with self.flush_lock:
+            if not self.pending_writes:
+                return
+
+            pending, self.pending_writes = self.pending_writes, {}
+
+            by_field = {}
+            for user_id, fields in pending.items():
+                for field_name, field_value in fields.items():
+                    by_field.setdefault(field_name, []).append((user_id, field_value))
+
+            try:
+                async with self.pool.acquire() as conn:
+                    async with conn.transaction():
+                        for field_name, rows in by_field.items():
+                            await conn.executemany(UPDATE_FIELD[field_name], rows)
+
+            except RECONNECT_ERRORS as e:
+                self.logger.info(f"Error flushing {len(pending)} user(s) settings: {e}")
+                self.requeue_writes(pending)
+
+            except Exception as e:
+                # Most likely a value the database rejects, which mustn't hold up everyone else's writes
+                self.logger.info(f"Error flushing {len(pending)} user(s) settings, writing them one by one: {e}")
+                await self.retry_writes(pending)
+
+            else:
+                if self.write_attempts:
+                    for user_id, fields in pending.items():
+                        for field_name in fields:
+                            self.write_attempts.pop((user_id, field_name), None)
+
+    async def retry_writes(self, pending):
+        """
+        Writes the fields of a failed batch one at a time. A field that fails for a reason other than the
+        connection is queued again until it has failed MAX_WRITE_ATTEMPTS flushes, then logged and dropped.
+        """
+        writes = [
+            (user_id, field_name, field_value)
+            for user_id, fields in pending.items()
+            for field_name, field_value in fields.items()
+        ]
+        retry = {}
+        for index, (user_id, field_name, field_value) in enumerate(writes):
+            try:
+                await self.execute("execute", UPDATE_FIELD[field_name], user_id, field_value, retry=True)
+
+            except RECONNECT_ERRORS as e:
+                # The connection is gone rather than the value being wrong: the rest wait for the next flush
+                self.logger.info(f"Error flushing settings: {e}")
+                for user_id, field_name, field_value in writes[index:]:
+                    retry.setdefault(user_id, {})[field_name] = field_value
+                break
+
+            except Exception as e:
+                key = (user_id, field_name)
+                attempts = self.write_attempts.get(key, 0) + 1
+                if attempts < MAX_WRITE_ATTEMPTS:
+                    self.write_attempts[key] = attempts
+                    retry.setdefault(user_id, {})[field_name] = field_value
+                else:
+                    self.write_attempts.pop(key, None)
+                    self.logger.info(
+                        f"Error: dropped {field_name}={field_value!r} of user {user_id} after {attempts} attempts: {e}"
+                    )
+
+            else:
+                self.write_attempts.pop((user_id, field_name), None)
+
+        self.requeue_writes(retry)
+
+    def requeue_writes(self, writes):
+        # Puts writes back without overwriting anything newer that was queued meanwhile
+        for user_id, fields in writes.items():
+            self.pending_writes[user_id] = {**fields, **self.pending_writes.get(user_id, {})}
+
+    async def write_behind(self):
+        while True:
+            await asyncio.sleep(WRITE_BEHIND_INTERVAL)
+            await self.flush_writes()
+
+    async def reset_settings(self, user_id, context):
+        try:
+            reset = {field_name: self.default_setting for field_name in USER_COLUMNS[5:12]}
+
+            # Under the flush lock, a flush in flight commits before the reset, and the queued writes of these
+            # fields (including any a failed flush put back) are dropped rather than undoing it later
+            async with self.flush_lock:
+                fields = self.pending_writes.get(user_id, {})
+                for field_name in reset:
+                    fields.pop(field_name, None)
+                    self.write_attempts.pop((user_id, field_name), None)
+
+                cached = self.settings_cache.get(user_id)
+                if cached is not None:
+                    cached[1].update(reset)
+
+                await self.execute("execute", RESET_SETTINGS, user_id, self.default_setting, retry=True)
 
             context.user_data.update(
                 {
@@ -273,17 +771,395 @@ class Persistent:
 
         except Exception as e:
             self.logger.info(f"Error: {e}")
-            self.conn.rollback()
 
-    def get_user_ids(self):
-        # Retrieve user IDs from the database
+    def cache_balance(self, user_id, balance):
+        cached = self.settings_cache.get(user_id)
+        if cached is not None:
+            cached[1]["available_minutes"] = balance
+
+    async def get_balance(self, user_id):
+        try:
+            balance = await self.execute("fetchval", GET_BALANCE, user_id, retry=True)
+        except Exception as e:
+            self.logger.info(f"Error: {e}")
+            return None
+
+        self.cache_balance(user_id, balance)
+
+        return balance
+
+    async def is_paying_user(self, user_id):
+        try:
+            return await self.execute(
+                "fetchval",
+                """
+				SELECT EXISTS (SELECT 1 FROM minutes_ledger WHERE user_id = $1 AND kind = 'purchase')
+			""",
+                user_id,
+                retry=True,
+            )
+        except Exception as e:
+            self.logger.info(f"Error: {e}")
+            return False
+
+    async def reserve_minutes(self, user_id, minutes):
+        """
+        Takes `minutes` off the balance for a job that is about to start.
+        Returns (reservation_id, new balance), or None if the balance doesn't cover it.
+        """
+        try:
+            record = await self.execute("fetchrow", RESERVE_MINUTES, user_id, minutes, datetime.utcnow())
+        except Exception as e:
+            self.logger.info(f"Error reserving minutes: {e}")
+            return None
+
+        if record is None:
+            return None
+
+        self.cache_balance(user_id, record["available_minutes"])
+
+        return record["id"], record["available_minutes"]
+
+    async def commit_reservation(self, reservation_id):
+        try:
+            await self.execute("execute", COMMIT_RESERVATION, reservation_id, datetime.utcnow(), retry=True)
+        except Exception as e:
+            self.logger.info(f"Error committing reservation {reservation_id}: {e}")
+
+    async def release_reservation(self, reservation_id):
+        """Gives the reserved minutes back. Returns the new balance, or None if nothing was released."""
+        try:
+            record = await self.execute("fetchrow", RELEASE_RESERVATION, reservation_id, datetime.utcnow())
+        except Exception as e:
+            self.logger.info(f"Error releasing reservation {reservation_id}: {e}")
+            return None
+
+        if record is None:
+            return None
+
+        self.cache_balance(record["user_id"], record["available_minutes"])
+
+        return record["available_minutes"]
+
+    async def credit_minutes(self, user_id, minutes, kind="purchase", payment_id=None):
+        """
+        Adds `minutes` to the balance and returns the new balance. A payment_id (e.g. Telegram's
+        telegram_payment_charge_id) makes it safe to retry: a payment that was already credited is left as is.
+        """
+        try:
+            balance = await self.execute(
+                "fetchval",
+                CREDIT_MINUTES,
+                user_id,
+                minutes,
+                kind,
+                datetime.utcnow(),
+                payment_id,
+                retry=payment_id is not None,
+            )
+        except Exception as e:
+            self.logger.info(f"Error crediting minutes: {e}")
+            return None
+
+        if balance is None:
+            return await self.get_balance(user_id)
+
+        self.cache_balance(user_id, balance)
+
+        return balance
+
+    async def release_stale_reservations(self):
+        try:
+            rows = await self.execute(
+                "fetch",
+                """
+				SELECT id
+				FROM minute_reservations
+				WHERE status = 'reserved' AND created_time_utc < $1
+			""",
+                datetime.utcnow() - timedelta(seconds=RESERVATION_TIMEOUT),
+                retry=True,
+            )
+        except Exception as e:
+            self.logger.info(f"Error: {e}")
+            return
+
+        for row in rows:
+            await self.release_reservation(row["id"])
+
+        if rows:
+            self.logger.info(f"Released {len(rows)} stale minute reservation(s).")
+
+    async def enqueue_job(self, user_id, kind, inputs, priority=0, job_class=None):
+        """
+        Queues a job and wakes the workers. Returns the job id, or None if the user already has a job
+        queued or running.
+        """
+        try:
+            return await self.execute(
+                "fetchval",
+                f"""
+				WITH job AS (
+					INSERT INTO jobs (user_id, kind, status, priority, job_class, inputs, created_time_utc, updated_time_utc)
+					VALUES ($1, $2, 'queued', $3, $6, $4::jsonb, $5, $5)
+					ON CONFLICT (user_id) WHERE status IN ('queued', 'running') DO NOTHING
+					RETURNING id
+				)
+				SELECT id FROM job, pg_notify('{JOB_CHANNEL}', id::text)
+			""",
+                user_id,
+                kind,
+                priority,
+                json.dumps(inputs),
+                datetime.utcnow(),
+                job_class,
+            )
+        except Exception as e:
+            self.logger.info(f"Error enqueueing a job: {e}")
+            return None
+
+    async def claim_job(self, owner, max_disk_bytes=None):
+        try:
+            record = await self.execute("fetchrow", CLAIM_JOB, owner, datetime.utcnow(), max_disk_bytes)
+        except Exception as e:
+            self.logger.info(f"Error claiming a job: {e}")
+            return None
+
+        if record is None:
+            return None
+
+        job = dict(record)
+        job["inputs"] = json.loads(job["inputs"])
+        job["artifacts"] = json.loads(job["artifacts"])
+
+        return job
+
+    async def has_active_job(self, user_id):
+        try:
+            return await self.execute(
+                "fetchval",
+                """
+				SELECT EXISTS (SELECT 1 FROM jobs WHERE user_id = $1 AND status IN ('queued', 'running'))
+			""",
+                user_id,
+                retry=True,
+            )
+        except Exception as e:
+            self.logger.info(f"Error: {e}")
+            return False
+
+    async def active_job_users(self):
+        try:
+            records = await self.execute(
+                "fetch",
+                """
+				SELECT DISTINCT user_id FROM jobs WHERE status IN ('queued', 'running')
+			""",
+                retry=True,
+            )
+        except Exception as e:
+            self.logger.info(f"Error: {e}")
+            return None
 
-        self.cur.execute("SELECT user_id FROM users")
+        return {record["user_id"] for record in records}
+
+    async def get_queue_waits(self, window):
+        """(job class, seconds from enqueue to first claim) for the jobs claimed in the last `window` seconds."""
+        try:
+            return await self.execute(
+                "fetch",
+                """
+				SELECT job_class, EXTRACT(EPOCH FROM claimed_time_utc - created_time_utc)::float AS seconds
+				FROM jobs
+				WHERE claimed_time_utc >= $1
+			""",
+                datetime.utcnow() - timedelta(seconds=window),
+                retry=True,
+            )
+        except Exception as e:
+            self.logger.info(f"Error: {e}")
+            return []
+
+    async def set_job_stage(self, job_id, stage):
+        try:
+            await self.execute(
+                "execute",
+                """
+				UPDATE jobs
+				SET stage = $2, updated_time_utc = $3
+				WHERE id = $1
+			""",
+                job_id,
+                stage,
+                datetime.utcnow(),
+                retry=True,
+            )
+        except Exception as e:
+            self.logger.info(f"Error: {e}")
+
+    async def save_job_artifacts(self, job_id, artifacts):
+        try:
+            await self.execute(
+                "execute",
+                """
+				UPDATE jobs
+				SET artifacts = artifacts || $2::jsonb, updated_time_utc = $3
+				WHERE id = $1
+			""",
+                job_id,
+                json.dumps(artifacts),
+                datetime.utcnow(),
+                retry=True,
+            )
+        except Exception as e:
+            self.logger.info(f"Error saving job {job_id} artifacts: {e}")
+
+    async def heartbeat_jobs(self, job_ids, owner):
+        """Returns the ids of the heartbeated jobs that were asked to cancel, in case the NOTIFY was missed."""
+        try:
+            rows = await self.execute(
+                "fetch",
+                """
+				UPDATE jobs
+				SET heartbeat_time_utc = $3
+				WHERE id = ANY($1::bigint[]) AND owner = $2 AND status = 'running'
+				RETURNING id, cancel_requested
+			""",
+                job_ids,
+                owner,
+                datetime.utcnow(),
+                retry=True,
+            )
+        except Exception as e:
+            self.logger.info(f"Error: {e}")
+            return []
+
+        return [row["id"] for row in rows if row["cancel_requested"]]
+
+    async def cancel_job(self, user_id):
+        """
+        Cancels the user's active job. A queued one is cancelled here and its minutes are released; a running
+        one is flagged and its worker is notified, which stops it and cleans up. Returns False if there was
+        nothing to cancel.
+        """
+        try:
+            rows = await self.execute(
+                "fetch",
+                f"""
+				WITH job AS (
+					UPDATE jobs
+					SET status = CASE WHEN status = 'queued' THEN 'cancelled' ELSE status END,
+						cancel_requested = TRUE,
+						updated_time_utc = $2
+					WHERE user_id = $1 AND status IN ('queued', 'running')
+					RETURNING id, status, {JOB_RESERVATION} AS reservation_id
+				)
+				SELECT id, status, reservation_id,
+					CASE WHEN status = 'running' THEN pg_notify('{CANCEL_CHANNEL}', id::text) END AS notified
+				FROM job
+			""",
+                user_id,
+                datetime.utcnow(),
+            )
+        except Exception as e:
+            self.logger.info(f"Error cancelling a job: {e}")
+            return False
+
+        for row in rows:
+            if row["status"] == "cancelled" and row["reservation_id"] is not None:
+                await self.release_reservation(row["reservation_id"])
+
+        return bool(rows)
+
+    async def finish_job(self, job_id, status, error=None):
+        try:
+            await self.execute(
+                "execute",
+                """
+				UPDATE jobs
+				SET status = $2, error = $3, owner = NULL, updated_time_utc = $4
+				WHERE id = $1
+			""",
+                job_id,
+                status,
+                error,
+                datetime.utcnow(),
+                retry=True,
+            )
+        except Exception as e:
+            self.logger.info(f"Error finishing job {job_id}: {e}")
+
+    async def requeue_job(self, job_id, delay=0):
+        now = datetime.utcnow()
+        try:
+            await self.execute(
+                "execute",
+                f"""
+				WITH job AS (
+					UPDATE jobs
+					SET status = CASE WHEN cancel_requested THEN 'cancelled' ELSE 'queued' END,
+						owner = NULL,
+						run_after_time_utc = $3,
+						updated_time_utc = $2
+					WHERE id = $1 AND status = 'running'
+					RETURNING id, status
+				)
+				SELECT pg_notify('{JOB_CHANNEL}', id::text) FROM job WHERE status = 'queued'
+			""",
+                job_id,
+                now,
+                now + timedelta(seconds=delay),
+                retry=True,
+            )
+        except Exception as e:
+            self.logger.info(f"Error requeueing job {job_id}: {e}")
+
+    async def requeue_stale_jobs(self, timeout, max_attempts):
+        """
+        Hands jobs whose worker stopped heartbeating back to the queue. Jobs that were cancelled meanwhile,
+        or have used up max_attempts, end here instead and give their minutes back.
+        """
+        try:
+            rows = await self.execute(
+                "fetch",
+                f"""
+				WITH stale AS (
+					UPDATE jobs
+					SET status = CASE
+							WHEN cancel_requested THEN 'cancelled'
+							WHEN attempts >= $2 THEN 'failed'
+							ELSE 'queued'
+						END,
+						error = CASE WHEN NOT cancel_requested AND attempts >= $2 THEN 'worker lost' END,
+						owner = NULL,
+						updated_time_utc = $3
+					WHERE status = 'running' AND heartbeat_time_utc < $1
+					RETURNING id, status, {JOB_RESERVATION} AS reservation_id
+				)
+				SELECT id, status, reservation_id,
+					CASE WHEN status = 'queued' THEN pg_notify('{JOB_CHANNEL}', id::text) END AS notified
+				FROM stale
+			""",
+                datetime.utcnow() - timedelta(seconds=timeout),
+                max_attempts,
+                datetime.utcnow(),
+            )
+        except Exception as e:
+            self.logger.info(f"Error: {e}")
+            return []
+
+        for row in rows:
+            if row["status"] != "queued" and row["reservation_id"] is not None:
+                await self.release_reservation(row["reservation_id"])
+
+        if rows:
+            self.logger.info(f"Recovered {len(rows)} job(s) from lost workers.")
+
+        return rows
+
+    async def get_user_ids(self):
+        # Retrieve user IDs from the database
 
-        return [int(row[0]) for row in self.cur.fetchall()]
+        rows = await self.execute("fetch", "SELECT user_id FROM users", retry=True)
 
-    def close_connection(self):
-        if self.cur:
-            self.cur.close()
-        if self.conn:
-            self.conn.close()
+        return [int(row[0]) for row in rows]
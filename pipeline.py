@@ -0,0 +1,68 @@
+import os
+from persistent import Persistent
+from jobs import MAX_ATTEMPTS
+
+persistent = Persistent()
+
+STAGES = ["download", "extract", "upload", "transcribe", "translate", "render", "deliver"]
+
+# The file each stage leaves in the workspace, and the last stage that reads it
+STAGE_FILES = {
+    "download": ("video_path", "deliver"),
+    "extract": ("audio_path", "upload"),
+    "transcribe": ("subtitles_path", "deliver"),
+    "translate": ("subtitles_path", "deliver"),
+    "render": ("out_path", "deliver"),
+}
+
+
+class Checkpoints:
+    """
+    A job's progress through the pipeline STAGES.
+
+    Each completed stage stores the artifacts later stages need (file paths, S3 keys, the detected language...)
+    in the job's row. The worker merges them back into `user_data` when the job is claimed again, so a retry
+    or a restart resumes after the last completed stage instead of starting over.
+    """
+
+    def __init__(self, context):
+        self.context = context
+        self.job_id = context.user_data.get("job_id")
+        self.completed = list(context.user_data.get("completed_stages", []))
+
+        # A retry on another node, or after the workspace was collected, runs again from the first stage whose
+        # file is gone but still needed
+        for index, stage in enumerate(STAGES):
+            if stage not in self.completed or stage not in STAGE_FILES:
+                continue
+            key, last_reader = STAGE_FILES[stage]
+            path = context.user_data.get(key)
+            if path and last_reader not in self.completed and not os.path.exists(path):
+                persistent.logger.info(f"{path} is gone; resuming from the {stage} stage.")
+                self.completed = [done for done in self.completed if STAGES.index(done) < index]
+                break
+
+    def done(self, stage):
+        return stage in self.completed
+
+    @property
+    def can_retry(self):
+        if self.job_id is None or self.context.cancel_token.cancelled:
+            return False
+
+        return self.context.user_data.get("attempt", MAX_ATTEMPTS) < MAX_ATTEMPTS
+
+    async def begin(self, stage):
+        persistent.logger.info(f"Job stage: {stage}")
+        if self.job_id is not None:
+            await persistent.set_job_stage(self.job_id, stage)
+
+    async def record(self, **artifacts):
+        """Saves artifacts without completing a stage, e.g. an id that lets a half-finished stage continue."""
+        self.context.user_data.update(artifacts)
+        if self.job_id is not None:
+            await persistent.save_job_artifacts(self.job_id, artifacts)
+
+    async def complete(self, stage, **artifacts):
+        self.completed.append(stage)
+        await self.record(completed_stages=self.completed, **artifacts)
@@ -0,0 +1,148 @@
+"""
+What splitting subtitles needs to know about a language, compiled once at import from conjunctions.py and
+shared by every SubtitlesProcessor.
+
+Language codes are aliased to their base language, so "en", "en-us" and "en-gb" share a profile, as do "pt",
+"pt-pt" and "pt-br". Conjunctions of several words ("jak tylko", "sen jälkeen") are kept in a trie of
+normalized words, so each is matched against the words that follow without joining any text.
+"""
+
+from bisect import bisect_right
+
+import numpy as np
+
+from conjunctions import commas_by_language, conjunctions_by_language
+
+# Scripts that take more room per character get shorter lines: (max_line_length, min_char_length_splitter)
+COMPLEX_SCRIPT_LANGUAGES = {
+    "th",
+    "lo",
+    "my",
+    "km",
+    "am",
+    "ko",
+    "ja",
+    "zh",
+    "ti",
+    "ta",
+    "te",
+    "kn",
+    "ml",
+    "hi",
+    "ne",
+    "mr",
+    "ar",
+    "fa",
+    "ur",
+    "ka",
+}
+COMPLEX_SCRIPT_LINE = (30, 20)
+
+# Languages written without spaces between words
+UNSPACED_LANGUAGES = {"zh", "ja"}
+
+# Stripped from both ends of a word before it's compared with the conjunctions
+PUNCTUATION = "".join(
+    [
+        "!\"#$%&'()*+,-./:;<=>?@[\\]^_`{|}~",
+        "¡¿«»‹›“”„‘’‚–—…·•",
+        "、。，．！？：；（）【】「」『』《》〈〉",
+        "،؛؟۔",
+        "।॥",
+    ]
+)
+
+END = None  # key of a trie node where a conjunction ends
+
+# Break kinds of a word: it ends with a comma, or a conjunction starts at it
+COMMA = 1
+CONJUNCTION = 2
+_PREFIX = 3  # the word only begins longer conjunctions, which break_kinds resolves
+
+
+def base_language(lang):
+    return lang.lower().replace("_", "-").split("-")[0]
+
+
+def normalize(word):
+    return word.strip(PUNCTUATION).lower()
+
+
+class LanguageProfile:
+    __slots__ = ("comma", "separator", "add_space", "line_limits", "trie", "conjunctions")
+
+    def __init__(self, lang, comma=",", conjunctions=()):
+        self.comma = comma
+        self.separator = "" if lang in UNSPACED_LANGUAGES else " "
+        self.add_space = len(self.separator)
+        self.line_limits = COMPLEX_SCRIPT_LINE if lang in COMPLEX_SCRIPT_LANGUAGES else None
+
+        self.trie = {}
+        for conjunction in conjunctions:
+            words = [normalize(word) for word in conjunction.split()]
+            # Without spaces the model may give a conjunction as one word or character by character
+            spellings = [words, list("".join(words))] if not self.separator else [words]
+            for spelling in spellings:
+                node = self.trie
+                for word in spelling:
+                    node = node.setdefault(word, {})
+                node[END] = True
+
+        # The single-word conjunctions
+        self.conjunctions = frozenset(word for word, node in self.trie.items() if END in node)
+
+    def kind(self, text):
+        if text.endswith(self.comma):
+            return COMMA
+        node = self.trie.get(normalize(text))
+        if node is None:
+            return 0
+        return CONJUNCTION if END in node else _PREFIX
+
+    def break_kinds(self, texts, offsets=None):
+        """
+        The break kind of every word of texts, as an int8 array: COMMA, CONJUNCTION or 0. Conjunctions don't
+        run past the end of a segment when offsets (the first word of every segment, then len(texts)) are
+        given. Each distinct word is looked up once, and only the words that begin a longer conjunction walk
+        the trie, so this is linear in the words.
+        """
+        kinds_by_text = {text: self.kind(text) for text in set(texts)}
+        kinds = np.fromiter(map(kinds_by_text.__getitem__, texts), dtype=np.int8, count=len(texts))
+
+        for i in np.flatnonzero(kinds == _PREFIX).tolist():
+            stop = offsets[bisect_right(offsets, i)] if offsets is not None else len(texts)
+            node = self.trie[normalize(texts[i])]
+            kind = 0
+            for j in range(i + 1, stop):
+                node = node.get(normalize(texts[j]))
+                if node is None:
+                    break
+                if END in node:
+                    kind = CONJUNCTION
+                    break
+            kinds[i] = kind
+
+        return kinds
+
+
+def _compile():
+    conjunctions = {}
+    for lang, words in conjunctions_by_language.items():
+        conjunctions.setdefault(base_language(lang), set()).update(words)
+    commas = {base_language(lang): comma for lang, comma in commas_by_language.items()}
+
+    languages = set(conjunctions) | set(commas) | COMPLEX_SCRIPT_LANGUAGES | UNSPACED_LANGUAGES
+    return {
+        lang: LanguageProfile(lang, commas.get(lang, ","), sorted(conjunctions.get(lang, ())))
+        for lang in languages
+    }
+
+
+PROFILES = _compile()
+
+DEFAULT_PROFILE = LanguageProfile("")
+
+
+def profile_for(lang):
+    """The profile of a language code in any case or region ("EN-US", "pt_BR", "zh")."""
+    return PROFILES.get(base_language(lang), DEFAULT_PROFILE)
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+from collections import defaultdict, deque
+from telegram.error import BadRequest, RetryAfter
+from constants import PROGRESS_EDIT_INTERVAL, CHAT_EDIT_INTERVAL, CHAT_EDITS_PER_MINUTE, PROGRESS_PRIORITY
+from utils import retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+
+class _ChatBudget:
+    """Edit budget shared by every progress message in one chat."""
+
+    def __init__(self):
+        self.sent = deque()
+
+    def delay(self, now):
+        while self.sent and now - self.sent[0] >= 60:
+            self.sent.popleft()
+
+        wait = 0
+        if self.sent:
+            wait = self.sent[-1] + CHAT_EDIT_INTERVAL - now
+        if len(self.sent) >= CHAT_EDITS_PER_MINUTE:
+            wait = max(wait, self.sent[0] + 60 - now)
+
+        return max(wait, 0)
+
+    def spend(self, now):
+        self.sent.append(now)
+
+
+_chat_budgets = defaultdict(_ChatBudget)
+
+
+class ProgressMessage:
+    """
+    A coalescing, throttled editor for one status message.
+
+    Callers push states with `update` (or `update_threadsafe` from worker threads) as often as they like.
+    Only the newest state is kept, edits are spaced by `min_interval` and by the chat's budget, and a state
+    identical to what the user already sees is never sent. `flush`/`finish` push the latest state out
+    immediately and wait for it, `close` does the same and stops the channel.
+    """
+
+    def __init__(self, message, min_interval=PROGRESS_EDIT_INTERVAL):
+        self.message = message
+        self.min_interval = min_interval
+        self.updates_received = 0
+        self.edits_sent = 0
+
+        self._loop = asyncio.get_running_loop()
+        self._budget = _chat_budgets[message.chat_id]
+        # The state the user sees, as an edit to it would be sent: a message with formatting is compared as HTML
+        if message.entities:
+            self._last_text, self._last_kwargs = message.text_html, {"parse_mode": "HTML"}
+        else:
+            self._last_text, self._last_kwargs = message.text, {}
+        self._last_edit = 0
+        self._pending = None
+        self._urgent = False
+        self._closed = False
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._task = None
+
+    def update(self, text, **kwargs):
+        if self._closed:
+            return
+
+        self.updates_received += 1
+
+        if text == self._last_text and kwargs == self._last_kwargs:
+            # The user already sees this state; anything older that is still pending is obsolete
+            self._pending = None
+            self._wakeup.set()
+            return
+
+        self._pending = (text, kwargs)
+        self._idle.clear()
+        self._wakeup.set()
+
+        if self._task is None:
+            self._task = self._loop.create_task(self._run())
+
+    def update_threadsafe(self, text, **kwargs):
+        self._loop.call_soon_threadsafe(lambda: self.update(text, **kwargs))
+
+    async def flush(self):
+        if self._pending is None and self._idle.is_set():
+            return
+
+        self._urgent = True
+        self._wakeup.set()
+        await self._idle.wait()
+
+    async def finish(self, text, **kwargs):
+        self.update(text, **kwargs)
+        await self.flush()
+
+    async def close(self):
+        if self._closed:
+            return
+
+        await self.flush()
+        self._closed = True
+
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        logger.info(f"Progress message: {self.updates_received} updates coalesced into {self.edits_sent} edits.")
+
+    async def _run(self):
+        while True:
+            if self._pending is None:
+                self._urgent = False
+                self._idle.set()
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = self._loop.time()
+            wait = self._budget.delay(now)
+            if not self._urgent:
+                wait = max(wait, self._last_edit + self.min_interval - now)
+
+            if wait > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            text, kwargs = self._pending
+            self._pending = None
+            await self._send(text, kwargs)
+
+    async def _send(self, text, kwargs):
+        now = self._loop.time()
+        self._last_edit = now
+        self._budget.spend(now)
+
+        try:
+            await self.message.get_bot().edit_message_text(
+                text,
+                chat_id=self.message.chat_id,
+                message_id=self.message.message_id,
+                rate_limit_args=PROGRESS_PRIORITY,
+                **kwargs,
+            )
+            self.edits_sent += 1
+            self._last_text, self._last_kwargs = text, kwargs
+
+        except RetryAfter as e:
+            # Keep the newest state; the one that failed is only worth resending if nothing replaced it
+            if self._pending is None:
+                self._pending = (text, kwargs)
+            await asyncio.sleep(retry_after_seconds(e))
+
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                self._last_text, self._last_kwargs = text, kwargs
+            else:
+                logger.info(f"Dropping a progress edit: {e}")
+
+        except Exception as e:
+            logger.info(f"Dropping a progress edit: {e}")
@@ -0,0 +1,226 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from constants import (
+    OVERALL_MESSAGES_PER_SECOND,
+    PRIVATE_CHAT_MESSAGES_PER_SECOND,
+    GROUP_CHAT_MESSAGES_PER_MINUTE,
+    INTERACTIVE_PRIORITY,
+    REQUEST_BURST,
+    REQUESTS_PER_MINUTE,
+)
+from persistent import Persistent
+from utils import retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+persistent = Persistent()
+
+MAX_IDLE_LANES = 10_000
+
+# Also charge request buckets in Postgres, for deployments where a user's updates may reach several processes
+THROTTLE_SHARED = os.getenv("THROTTLE_SHARED") == "True"
+
+ALLOWED, REJECTED, REJECTED_SILENTLY = range(3)
+
+
+class _TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+
+    def delay(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        wait = self.paused_until - now
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+
+        return max(wait, 0)
+
+    def consume(self):
+        self.tokens -= 1
+
+    @property
+    def idle(self):
+        return self.delay() == 0 and self.tokens >= self.capacity
+
+
+class _Lane:
+    """A token bucket whose waiters are served in (priority, arrival) order."""
+
+    def __init__(self, rate, capacity):
+        self.bucket = _TokenBucket(rate, capacity)
+        self.waiters = []
+        self.condition = asyncio.Condition()
+
+
+class PriorityRateLimiter(BaseRateLimiter[int]):
+    """
+    Rate limiter for every request the application sends to the Bot API.
+
+    Each request first takes a token from its chat's bucket and then one from the overall bucket.
+    Waiters for a bucket are served by priority (`rate_limit_args`, see constants.py), so interactive
+    replies overtake queued progress edits and broadcasts. A RetryAfter pauses the affected bucket and
+    the request is retried up to `max_retries` times.
+    """
+
+    def __init__(
+        self,
+        overall_rate=OVERALL_MESSAGES_PER_SECOND,
+        private_chat_rate=PRIVATE_CHAT_MESSAGES_PER_SECOND,
+        group_chat_rate=GROUP_CHAT_MESSAGES_PER_MINUTE / 60,
+        burst=3,
+        max_retries=3,
+    ):
+        self.overall_rate = overall_rate
+        self.private_chat_rate = private_chat_rate
+        self.group_chat_rate = group_chat_rate
+        self.burst = burst
+        self.max_retries = max_retries
+
+        self._counter = itertools.count()
+        self._overall = _Lane(overall_rate, overall_rate)
+        self._chats = {}
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _chat_lane(self, chat_id):
+        lane = self._chats.get(chat_id)
+        if lane is None:
+            if len(self._chats) >= MAX_IDLE_LANES:
+                self._chats = {
+                    key: value for key, value in self._chats.items() if value.waiters or not value.bucket.idle
+                }
+
+            is_group = (isinstance(chat_id, int) and chat_id < 0) or isinstance(chat_id, str)
+            rate = self.group_chat_rate if is_group else self.private_chat_rate
+            lane = self._chats[chat_id] = _Lane(rate, self.burst)
+
+        return lane
+
+    async def _acquire(self, lane, priority):
+        entry = (priority, next(self._counter))
+        heapq.heappush(lane.waiters, entry)
+
+        try:
+            while True:
+                async with lane.condition:
+                    await lane.condition.wait_for(lambda: lane.waiters[0] == entry)
+
+                # A more urgent request may have arrived while we slept, hence the re-check above
+                wait = lane.bucket.delay()
+                if wait == 0:
+                    lane.bucket.consume()
+                    return
+                await asyncio.sleep(wait)
+
+        finally:
+            lane.waiters.remove(entry)
+            heapq.heapify(lane.waiters)
+            async with lane.condition:
+                lane.condition.notify_all()
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        priority = rate_limit_args if rate_limit_args is not None else INTERACTIVE_PRIORITY
+        chat_id = data.get("chat_id")
+        # getFile and friends don't count against the message limits
+        limited = not endpoint.startswith("get")
+
+        for attempt in range(self.max_retries + 1):
+            chat_lane = self._chat_lane(chat_id) if limited and chat_id is not None else None
+
+            if limited:
+                if chat_lane is not None:
+                    await self._acquire(chat_lane, priority)
+                await self._acquire(self._overall, priority)
+
+            try:
+                return await callback(*args, **kwargs)
+
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+
+                lane = chat_lane or self._overall
+                lane.bucket.paused_until = time.monotonic() + retry_after_seconds(e)
+                logger.info(f"Flood control on {endpoint} (chat {chat_id}), retrying in {retry_after_seconds(e)}s.")
+
+
+class RequestThrottle:
+    """
+    Token buckets in front of the handlers that start expensive work: yt-dlp lookups, downloads, DB reads.
+
+    A request takes a token from its user's bucket and, in a group, from the chat's. The in-memory check
+    runs before anything touches the network or the database, so a flood is turned away at no cost. With
+    `shared`, requests that pass are also charged in Postgres, which keeps the limits across processes
+    and restarts. A user whose bucket is empty is told once (REJECTED); later requests are dropped silently
+    until a token is back.
+    """
+
+    def __init__(self, rate=REQUESTS_PER_MINUTE / 60, burst=REQUEST_BURST, shared=THROTTLE_SHARED):
+        self.rate = rate
+        self.burst = burst
+        self.shared = shared
+        self._buckets = {}
+        self._warned = set()
+
+    @staticmethod
+    def _keys(update):
+        keys = []
+        if update.effective_user is not None:
+            keys.append(f"user:{update.effective_user.id}")
+        if update.effective_chat is not None and update.effective_chat.type != "private":
+            keys.append(f"chat:{update.effective_chat.id}")
+
+        return keys
+
+    def _bucket(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= MAX_IDLE_LANES:
+                self._buckets = {key: value for key, value in self._buckets.items() if not value.idle}
+                self._warned &= self._buckets.keys()
+            bucket = self._buckets[key] = _TokenBucket(self.rate, self.burst)
+
+        return bucket
+
+    def _reject(self, key):
+        if key in self._warned:
+            return REJECTED_SILENTLY
+
+        self._warned.add(key)
+        logger.info(f"Throttled requests from {key}.")
+        return REJECTED
+
+    async def check(self, update):
+        buckets = [(key, self._bucket(key)) for key in self._keys(update)]
+
+        for key, bucket in buckets:
+            if bucket.delay() > 0:
+                return self._reject(key)
+
+        if self.shared:
+            for key, _ in buckets:
+                if not await persistent.take_request_token(key, self.rate, self.burst):
+                    return self._reject(key)
+
+        for key, bucket in buckets:
+            bucket.consume()
+            self._warned.discard(key)
+
+        return ALLOWED
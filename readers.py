@@ -0,0 +1,154 @@
+"""
+Reading SRT and WebVTT files back, for user-supplied subtitles, re-styling and re-translation.
+
+read_subtitles matches the cues of a memory-mapped file in one regex pass, without decoding anything but the
+cue text, and returns a CueIndex: the cues sorted by start, with their times in arrays, answering which cues
+are on screen at a time or within a window in O((1 + k) log n) for k cues found, however long the cues are.
+"""
+
+import mmap
+import os
+import re
+
+import numpy as np
+
+from subtitles import Cue
+from utils import parse_timestamps
+
+TIMESTAMP = rb"((?:\d+:)?\d{1,2}:\d{2}[,.]\d{1,3})"
+
+# A timing line (VTT cue settings after it are ignored) and the non-empty lines of text under it. Counters,
+# cue identifiers, the WEBVTT header and NOTE or STYLE blocks have no timing line and fall between matches.
+CUE = re.compile(
+    rb"^[ \t]*" + TIMESTAMP + rb"[ \t]+-->[ \t]+" + TIMESTAMP + rb"[^\r\n]*(?:\r?\n|\Z)((?:[^\r\n]+(?:\r?\n|\Z))*)",
+    re.M,
+)
+
+THUMBNAIL = re.compile(r"^(.*)#xywh=(\d+),(\d+),(\d+),(\d+)$")
+
+CUE_BLOCK = 2048  # cues per leaf of CueIndex's tree of latest ends; a block is scanned in one array operation
+
+
+def parse_subtitles(data):
+    """The cues of SRT or VTT text (str, bytes or any buffer, e.g. an mmap)."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+
+    cues = CUE.findall(data)
+    if not cues:
+        return CueIndex([], [], [])
+
+    starts, ends, texts = zip(*cues)
+    texts = [text.rstrip(b"\r\n").replace(b"\r\n", b"\n").decode("utf-8", errors="replace") for text in texts]
+    return CueIndex(parse_timestamps(starts), parse_timestamps(ends), texts)
+
+
+def read_subtitles(path):
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return CueIndex([], [], [])
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return parse_subtitles(data)
+
+
+def thumbnail(text):
+    """(image, x, y, width, height) for the text of a thumbnail VTT cue ("sprite.jpg#xywh=0,0,160,90"), else None."""
+    match = THUMBNAIL.match(text.strip())
+    if match is None:
+        return None
+
+    image, *region = match.groups()
+    return (image, *map(int, region))
+
+
+class CueIndex:
+    def __init__(self, starts, ends, texts, block=CUE_BLOCK):
+        starts = np.array(starts, dtype=np.float64)
+        ends = np.array(ends, dtype=np.float64)
+        if np.any(starts[1:] < starts[:-1]):
+            order = np.argsort(starts, kind="stable")
+            starts = starts[order]
+            ends = ends[order]
+            texts = [texts[i] for i in order.tolist()]
+
+        self.starts = starts
+        self.ends = ends
+        self.texts = list(texts)
+        # The latest end among the cues up to each one: cues that have ended by t all come before the first
+        # cue whose reach is past t, so only the cues from there to t's position can be on screen
+        self.reach = np.maximum.accumulate(ends) if len(ends) else ends
+        # Among those, one long cue (a title card, an ASS background line) can keep the reach past t for every
+        # cue after it. levels[0] holds the latest end in each block of `block` cues and levels[h] the latest
+        # of two nodes of levels[h - 1], so the blocks holding cues still on screen are found without the rest
+        self.block = block
+        blocks = np.maximum.reduceat(ends, np.arange(0, len(ends), block)) if len(ends) else ends
+        level = np.full(1 << max(len(blocks) - 1, 0).bit_length(), -np.inf)
+        level[: len(blocks)] = blocks
+        self.levels = [level]
+        while len(level) > 1:
+            level = np.maximum(level[0::2], level[1::2])
+            self.levels.append(level)
+        self.levels = [level.tolist() for level in self.levels]
+
+    @classmethod
+    def from_cues(cls, cues, block=CUE_BLOCK):
+        cues = list(cues)
+        return cls([cue.start for cue in cues], [cue.end for cue in cues], [cue.text for cue in cues], block)
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __getitem__(self, index):
+        return Cue(self.starts[index].item(), self.ends[index].item(), self.texts[index])
+
+    def __iter__(self):
+        for start, end, text in zip(self.starts.tolist(), self.ends.tolist(), self.texts):
+            yield Cue(start, end, text)
+
+    def _overlapping(self, start, end, side):
+        """The indices of the cues from the first whose reach is past start to end's position that end after start."""
+        first = int(np.searchsorted(self.reach, start, side="right"))
+        last = int(np.searchsorted(self.starts, end, side=side))
+        size = self.block
+        if last - first <= 2 * size:
+            return (first + np.flatnonzero(self.ends[first:last] > start)).tolist()
+
+        indices = []
+        for block in self._blocks_ending_after(start, first // size, (last - 1) // size + 1):
+            low = max(block * size, first)
+            high = min(block * size + size, last)
+            indices += (low + np.flatnonzero(self.ends[low:high] > start)).tolist()
+        return indices
+
+    def _blocks_ending_after(self, t, low, high):
+        """The blocks in low..high - 1 with a cue ending after t, in order."""
+        blocks = []
+        stack = [(len(self.levels) - 1, 0)]
+        while stack:
+            height, node = stack.pop()
+            first = node << height
+            if first >= high or first + (1 << height) <= low or self.levels[height][node] <= t:
+                continue
+            if height == 0:
+                blocks.append(node)
+            else:
+                stack.append((height - 1, 2 * node + 1))
+                stack.append((height - 1, 2 * node))
+        return blocks
+
+    def active(self, t):
+        """The cues on screen at t (start <= t < end)."""
+        return [self[index] for index in self._overlapping(t, t, "right")]
+
+    def between(self, start, end):
+        """The cues on screen at any time in [start, end)."""
+        return [self[index] for index in self._overlapping(start, end, "left")]
+
+    def clip(self, start, end):
+        """
+        The cues of [start, end) cut to the window and shifted so it starts at 0, e.g. for burning a chunk of
+        a video or a preview clip.
+        """
+        return [
+            Cue(max(cue.start, start) - start, min(cue.end, end) - start, cue.text) for cue in self.between(start, end)
+        ]
@@ -0,0 +1,69 @@
+"""
+Priorities for queued jobs: shortest job first, with paying users ahead and aging so nothing starves.
+
+A job's priority is the number of seconds of work the ETA model predicts for it, scaled down for paying
+users. Workers claim the job with the lowest `priority - JOB_AGING_RATE * seconds waited`, so a job that
+waited as long as its own predicted run time is ahead of any job that has just arrived.
+"""
+
+from eta import eta_model
+from persistent import Persistent, JOB_AGING_RATE
+
+persistent = Persistent()
+
+PAID_WEIGHT = 0.25  # paying users' jobs are queued as if they were four times shorter
+
+UNKNOWN_DURATION_MINUTES = 30  # assumed for links whose duration is only known after the download
+
+SHORT_JOB_SECONDS = 300  # predicted run time up to which a job counts as short in the wait histograms
+
+WAIT_BUCKETS = [5, 15, 30, 60, 120, 300, 600, 1800, 3600]  # histogram upper bounds, in seconds
+
+WAIT_WINDOW = 24 * 60 * 60  # seconds of claimed jobs the histograms cover
+
+
+def job_seconds(user_data):
+    if user_data.get("video_duration"):
+        return eta_model.estimate_job_seconds(user_data)
+
+    return eta_model.estimate_job_seconds({**user_data, "video_duration": UNKNOWN_DURATION_MINUTES})
+
+
+def job_priority(user_data, paid):
+    return int(job_seconds(user_data) * (PAID_WEIGHT if paid else 1))
+
+
+def job_class(user_data, paid):
+    tier = "paid" if paid else "free"
+    size = "short" if job_seconds(user_data) <= SHORT_JOB_SECONDS else "long"
+
+    return f"{tier}:{size}"
+
+
+def effective_priority(priority, waited):
+    """What CLAIM_JOB orders queued jobs by."""
+    return priority - JOB_AGING_RATE * waited
+
+
+def wait_histograms(waits):
+    """
+    Cumulative histograms of queue waits per job class, from (job class, seconds) pairs:
+    {"free:short": {"5": 12, "15": 20, ..., "+Inf": 31, "count": 31, "sum": 840.5}, ...}
+    """
+    histograms = {}
+    for job_class, seconds in waits:
+        histogram = histograms.setdefault(
+            job_class or "unknown", {**{str(bound): 0 for bound in WAIT_BUCKETS}, "+Inf": 0, "count": 0, "sum": 0.0}
+        )
+        for bound in WAIT_BUCKETS:
+            if seconds <= bound:
+                histogram[str(bound)] += 1
+        histogram["+Inf"] += 1
+        histogram["count"] += 1
+        histogram["sum"] += seconds
+
+    return histograms
+
+
+async def queue_wait_histograms():
+    return wait_histograms(await persistent.get_queue_waits(WAIT_WINDOW))
@@ -1,233 +1,512 @@
+import os
 import re
-from conjunctions import get_conjunctions, get_comma
-from utils import format_timestamp
+from bisect import bisect_left, bisect_right
+from contextlib import ExitStack
+from itertools import accumulate
+
+import numpy as np
+
+from profiles import COMMA, CONJUNCTION, profile_for
+from timings import WordTimings
+from writers import SrtWriter, VttWriter, writer_for
+
+# "greedy" cuts at the first acceptable break; "optimal" picks the breaks of each segment together
+LINE_BREAKING = os.getenv("LINE_BREAKING", "greedy")
+
+# Costs of the optimal mode, in units of an empty line's squared slack
+SHORT_CUE_PENALTY = 1.0  # a cue under min_char_length_splitter
+COMMA_BONUS = 0.3
+CONJUNCTION_BONUS = 0.2  # breaking before a conjunction
+PAUSE_BONUS = 0.3  # for a pause of FULL_PAUSE seconds or more between the cues
+FULL_PAUSE = 0.5
+
+CREDIT_TEXT = "Captioning by\n<i>t.me/SubtitlesGeneratorBot</i>"  # the last cue of every subtitle file
+
+
+class Word:
+    """A word of a segment; start and end are None where the model gave no timestamp."""
+
+    __slots__ = ("text", "start", "end")
+
+    def __init__(self, text, start=None, end=None):
+        self.text = text
+        self.start = start
+        self.end = end
+
+
+class Cue:
+    """
+    Text shown from start to end: a subtitle, or a segment of the model's output, which also has its timed
+    `words` (None when the model didn't align them).
+    """
+
+    __slots__ = ("start", "end", "text", "words")
+
+    def __init__(self, start, end, text, words=None):
+        self.start = start
+        self.end = end
+        self.text = text
+        self.words = words
+
+
+def segments_from_output(segments):
+    """The WhisperX output segments ({"start", "end", "text", "words": [{"word", "start", "end"}]}) as Cues."""
+    return [
+        Cue(
+            segment["start"],
+            segment["end"],
+            segment["text"],
+            (
+                [Word(word["word"], word.get("start"), word.get("end")) for word in segment["words"]]
+                if "words" in segment
+                else None
+            ),
+        )
+        for segment in segments
+    ]
 
 
 class SubtitlesProcessor:
-    def __init__(self, segments, lang, max_line_length=45, min_char_length_splitter=30, is_vtt=False):
-        self.comma = get_comma(lang)
-        self.conjunctions = set(get_conjunctions(lang))
+    def __init__(
+        self,
+        segments,
+        lang,
+        max_line_length=45,
+        min_char_length_splitter=30,
+        is_vtt=False,
+        line_breaking=LINE_BREAKING,
+    ):
+        self.profile = profile_for(lang)
+        self.comma = self.profile.comma
         self.segments = segments
         self.lang = lang
         self.max_line_length = max_line_length
         self.min_char_length_splitter = min_char_length_splitter
         self.is_vtt = is_vtt
-        complex_script_languages = [
-            "th",
-            "lo",
-            "my",
-            "km",
-            "am",
-            "ko",
-            "ja",
-            "zh",
-            "ti",
-            "ta",
-            "te",
-            "kn",
-            "ml",
-            "hi",
-            "ne",
-            "mr",
-            "ar",
-            "fa",
-            "ur",
-            "ka",
-        ]
-        if self.lang in complex_script_languages:
-            self.max_line_length = 30
-            self.min_char_length_splitter = 20
+        self.line_breaking = line_breaking
+        self.fed = 0  # segments whose cues feed has returned
+        if self.profile.line_limits:
+            self.max_line_length, self.min_char_length_splitter = self.profile.line_limits
 
     def estimate_timestamp_for_word(self, words, i, next_segment_start_time=None):
         k = 0.25
-        has_prev_end = i > 0 and "end" in words[i - 1]
-        has_next_start = i < len(words) - 1 and "start" in words[i + 1]
+        word = words[i]
+        has_prev_end = i > 0 and words[i - 1].end is not None
+        has_next_start = i < len(words) - 1 and words[i + 1].start is not None
 
         if has_prev_end:
-            words[i]["start"] = words[i - 1]["end"]
+            word.start = words[i - 1].end
             if has_next_start:
-                words[i]["end"] = words[i + 1]["start"]
+                word.end = words[i + 1].start
             else:
                 if next_segment_start_time:
-                    words[i]["end"] = (
+                    word.end = (
                         next_segment_start_time
-                        if next_segment_start_time - words[i - 1]["end"] <= 1
+                        if next_segment_start_time - words[i - 1].end <= 1
                         else next_segment_start_time - 0.5
                     )
                 else:
-                    words[i]["end"] = words[i]["start"] + len(words[i]["word"]) * k
+                    word.end = word.start + len(word.text) * k
 
+        # Counting back from a start near 0 mustn't give a negative timestamp
         elif has_next_start:
-            words[i]["start"] = words[i + 1]["start"] - len(words[i]["word"]) * k
-            words[i]["end"] = words[i + 1]["start"]
+            word.start = max(0, words[i + 1].start - len(word.text) * k)
+            word.end = words[i + 1].start
 
         else:
             if next_segment_start_time:
-                words[i]["start"] = next_segment_start_time - 1
-                words[i]["end"] = next_segment_start_time - 0.5
+                word.start = max(0, next_segment_start_time - 1)
+                word.end = max(0, next_segment_start_time - 0.5)
             else:
-                words[i]["start"] = 0
-                words[i]["end"] = 0
+                word.start = 0
+                word.end = 0
 
     def process_segments(self, advanced_splitting=True, normal_handling=True):
-        subtitles = []
+        return list(self.iter_cues(advanced_splitting, normal_handling))
 
+    def iter_cues(self, advanced_splitting=True, normal_handling=True):
+        """The cues of process_segments, one at a time, for writing them as they're made."""
         if not normal_handling:
-            min_length = 10  # Minimum length of sentence to split, adjust as needed.
-            new_segments = []
-
-            for segment in self.segments:
-                # Split text into sentences
-                sentences = re.split("(?<=[.!?]) +", segment["text"])
-
-                total_length = sum(len(sentence) for sentence in sentences)
-                elapsed_time = 0  # Keep track of the time elapsed for previous sentences
-
-                for i, sentence in enumerate(sentences):
-                    # If the sentence is too short and it's not the last sentence in the list,
-                    # append it to the next sentence.
-                    if len(sentence) < min_length and i < len(sentences) - 1:
-                        sentences[i + 1] = sentence + " " + sentences[i + 1]
-                        continue  # skip to the next iteration, as we have merged the current sentence with the next one
-
-                    sentence_length = len(sentence)
-                    sentence_time_ratio = sentence_length / total_length  # Weight for the current sentence
-
-                    sentence_time_interval = (segment["end"] - segment["start"]) * sentence_time_ratio
+            self.segments = [sentence for segment in self.segments for sentence in self.split_sentences(segment)]
+
+        yield from self.segment_cues(self.segments, None, advanced_splitting, normal_handling)
+
+    def feed(self, segments, advanced_splitting=True, normal_handling=True, final=False):
+        """
+        Adds the next segments of a transcript that arrives in parts (partial results, transcribed chunks) to
+        self.segments and returns the cues that are final: those of every segment but the last, which waits
+        for the start of the segment after it, since its words' estimated timestamps and its cues' end times
+        depend on that. final=True ends the transcript and returns the last segment's cues too. However the
+        transcript is cut into parts, the cues are those of process_segments on all of it.
+        """
+        if not normal_handling:
+            segments = [sentence for segment in segments for sentence in self.split_sentences(segment)]
+        self.segments.extend(segments)
+
+        end = len(self.segments) if final else len(self.segments) - 1
+        if end <= self.fed:
+            return []
+
+        ready = self.segments[self.fed : end]
+        next_start = self.segments[end].start if end < len(self.segments) else None
+        self.fed = end
+        return list(self.segment_cues(ready, next_start, advanced_splitting, normal_handling))
+
+    @staticmethod
+    def split_sentences(segment):
+        """The sentences of a segment's text, each a segment timed in proportion to its length."""
+        min_length = 10  # Minimum length of sentence to split, adjust as needed.
+        new_segments = []
+
+        # Split text into sentences
+        sentences = re.split("(?<=[.!?]) +", segment.text)
+
+        total_length = sum(len(sentence) for sentence in sentences)
+        elapsed_time = 0  # Keep track of the time elapsed for previous sentences
+
+        for i, sentence in enumerate(sentences):
+            # If the sentence is too short and it's not the last sentence in the list,
+            # append it to the next sentence.
+            if len(sentence) < min_length and i < len(sentences) - 1:
+                sentences[i + 1] = sentence + " " + sentences[i + 1]
+                continue  # skip to the next iteration, as we have merged the current sentence with the next one
+
+            sentence_length = len(sentence)
+            sentence_time_ratio = sentence_length / total_length  # Weight for the current sentence
+
+            sentence_time_interval = (segment.end - segment.start) * sentence_time_ratio
+
+            new_segment = Cue(
+                segment.start + elapsed_time,
+                segment.start + elapsed_time + sentence_time_interval,
+                sentence.strip(),
+            )
 
-                    new_segment = {
-                        "start": segment["start"] + elapsed_time,
-                        "end": segment["start"] + elapsed_time + sentence_time_interval,
-                        "text": sentence.strip(),
-                    }
+            elapsed_time += sentence_time_interval  # Update the elapsed time
 
-                    elapsed_time += sentence_time_interval  # Update the elapsed time
+            new_segments.append(new_segment)
 
-                    new_segments.append(new_segment)
+        return new_segments
 
-            self.segments = new_segments
+    def segment_cues(self, segments, next_start, advanced_splitting, normal_handling):
+        """The cues of segments, given when the segment after them starts (None if they end the transcript)."""
+        # WhisperX segments: timestamps are estimated for all of the segments at once
+        timings = WordTimings.from_segments(segments, next_start)
+        if timings is not None:
+            timings.fill_missing()
+            timings.write_back()
+            if advanced_splitting and self.line_breaking != "optimal":
+                yield from self.generate_subtitles_from_timings(timings)
+                return
 
-        for i, segment in enumerate(self.segments):
-            next_segment_start_time = self.segments[i + 1]["start"] if i + 1 < len(self.segments) else None
+        for i, segment in enumerate(segments):
+            next_segment_start_time = segments[i + 1].start if i + 1 < len(segments) else next_start
 
             if advanced_splitting:
-                split_points = self.determine_advanced_split_points(segment, next_segment_start_time)
-                subtitles.extend(
-                    self.generate_subtitles_from_split_points(segment, split_points, next_segment_start_time)
-                )
+                if self.line_breaking == "optimal":
+                    split_points = self.determine_optimal_split_points(segment, next_segment_start_time)
+                else:
+                    split_points = self.determine_advanced_split_points(segment, next_segment_start_time)
+                yield from self.generate_subtitles_from_split_points(segment, split_points, next_segment_start_time)
             else:
                 if normal_handling:
-                    words = segment["words"]
+                    words = segment.words
                     for i, word in enumerate(words):
-                        if "start" not in word or "end" not in word:
+                        if word.start is None or word.end is None:
                             self.estimate_timestamp_for_word(words, i, next_segment_start_time)
 
-                subtitles.append({"start": segment["start"], "end": segment["end"], "text": segment["text"]})
+                yield Cue(segment.start, segment.end, segment.text)
+
+    @staticmethod
+    def word_lengths(words, add_space):
+        """
+        The text of each word, its length with the space after it, and prefix sums of the lengths as lines
+        are measured, so the characters in any run of words i..j are `prefix[j + 1] - prefix[i]`.
+        Timed words are measured without their space there, which the split points have always relied on.
+        """
+        texts = []
+        lengths = []
+        prefix = [0]
+        total = 0
+        for word in words:
+            if isinstance(word, Word):
+                text = word.text
+                total += len(text)
+            else:
+                text = word
+                total += len(text) + add_space
+            texts.append(text)
+            lengths.append(len(text) + add_space)
+            prefix.append(total)
 
-        return subtitles
+        return texts, lengths, prefix
 
     def determine_advanced_split_points(self, segment, next_segment_start_time=None):
         split_points = []
         last_split_point = 0
         char_count = 0
 
-        words = segment.get("words", segment["text"].split())
-        add_space = 0 if self.lang in ["zh", "ja"] else 1
+        words = segment.words if segment.words is not None else segment.text.split()
+        add_space = self.profile.add_space
 
-        total_char_count = sum(len(word["word"]) if isinstance(word, dict) else len(word) + add_space for word in words)
-        char_count_after = total_char_count
+        texts, lengths, prefix = self.word_lengths(words, add_space)
+        char_count_after = prefix[-1]
+        kinds = self.profile.break_kinds(texts).tolist()
+
+        max_line_length = self.max_line_length
+        min_chars = self.min_char_length_splitter
 
         for i, word in enumerate(words):
-            word_text = word["word"] if isinstance(word, dict) else word
-            word_length = len(word_text) + add_space
+            word_length = lengths[i]
             char_count += word_length
             char_count_after -= word_length
 
             char_count_before = char_count - word_length
 
-            if isinstance(word, dict) and ("start" not in word or "end" not in word):
+            if isinstance(word, Word) and (word.start is None or word.end is None):
                 self.estimate_timestamp_for_word(words, i, next_segment_start_time)
 
-            if (
-                word_text.endswith(self.comma)
-                and char_count_before >= self.min_char_length_splitter
-                and char_count_after >= self.min_char_length_splitter
-            ):
+            # Both punctuation and conjunction splits need enough text on either side
+            balanced = char_count_before >= min_chars and char_count_after >= min_chars
+
+            if balanced and kinds[i] == COMMA:
                 split_points.append(i)
                 last_split_point = i + 1
                 char_count = 0
 
-            elif (
-                word_text.lower() in self.conjunctions
-                and char_count_before >= self.min_char_length_splitter
-                and char_count_after >= self.min_char_length_splitter
-            ):
+            elif balanced and kinds[i] == CONJUNCTION:
                 split_points.append(i - 1)
                 last_split_point = i
                 char_count = word_length
 
-            elif char_count >= self.max_line_length:
-                midpoint = int((last_split_point + i) / 2)
-                if char_count_before >= self.min_char_length_splitter:
+            elif char_count >= max_line_length:
+                midpoint = (last_split_point + i) // 2
+                if char_count_before >= min_chars:
                     split_points.append(midpoint)
                     last_split_point = midpoint + 1
-                    char_count = sum(
-                        len(words[j]["word"]) if isinstance(words[j], dict) else len(words[j]) + add_space
-                        for j in range(last_split_point, i + 1)
-                    )
+                    char_count = prefix[i + 1] - prefix[last_split_point]
 
         return split_points
 
+    def determine_optimal_split_points(self, segment, next_segment_start_time=None):
+        """
+        Splits a segment into cues by minimizing, over all of its breaks together, the squared slack of every
+        cue against max_line_length, less bonuses for breaking at a comma, before a conjunction or at a
+        pause. Only cues that fit in max_line_length are considered, so this is O(words x words per line).
+        """
+        words = segment.words if segment.words is not None else segment.text.split()
+        add_space = self.profile.add_space
+        count = len(words)
+        if count == 0:
+            return []
+
+        for i, word in enumerate(words):
+            if isinstance(word, Word) and (word.start is None or word.end is None):
+                self.estimate_timestamp_for_word(words, i, next_segment_start_time)
+
+        texts = [word.text if isinstance(word, Word) else word for word in words]
+        # Characters in the cue of words i..j: ends[j + 1] - ends[i] - add_space
+        ends = [0, *accumulate(len(text) + add_space for text in texts)]
+        max_length = self.max_line_length
+        min_chars = self.min_char_length_splitter
+
+        # What breaking after word j is worth; nothing after the last word
+        kinds = self.profile.break_kinds(texts).tolist()
+        commas = [COMMA_BONUS if kind == COMMA else 0.0 for kind in kinds]
+        before_conjunctions = [CONJUNCTION_BONUS if kind == CONJUNCTION else 0.0 for kind in kinds[1:]]
+        if all(isinstance(word, Word) for word in words):
+            gaps = [after.start - before.end for before, after in zip(words, words[1:])]
+            scale = PAUSE_BONUS / FULL_PAUSE
+            pauses = [PAUSE_BONUS if gap >= FULL_PAUSE else gap * scale if gap > 0 else 0.0 for gap in gaps]
+        else:
+            pauses = [0.0] * (count - 1)
+        bonuses = [a + b + c for a, b, c in zip(commas, before_conjunctions, pauses)]
+        bonuses.append(0.0)
+
+        # The cost of a cue by its length in characters, up to a full line
+        cue_costs = [((max_length - chars) / max_length) ** 2 for chars in range(max_length + 1)]
+        short_cost = SHORT_CUE_PENALTY if ends[count] - add_space >= min_chars else 0
+
+        # costs[j] is the best cost of cutting words 0..j-1 into cues; starts[j] where the last of them starts.
+        # A cue ending at word j starts between `first` (the line is full) and `last` (it has min_chars);
+        # shorter cues are only tried when no such start exists.
+        costs = [0.0] * (count + 1)
+        starts = [0] * (count + 1)
+        first = 0
+        last = -1
+        for j in range(count):
+            end_j = ends[j + 1] - add_space
+            while end_j - ends[first] > max_length and first < j:
+                first += 1
+            while last < j and end_j - ends[last + 1] >= min_chars:
+                last += 1
+
+            if end_j - ends[first] > max_length:
+                # A single word longer than a line is a cue of its own
+                best, start = costs[j], j
+            else:
+                short = first > last
+                best = float("inf")
+                for i in range(first, j + 1 if short else last + 1):
+                    cost = costs[i] + cue_costs[end_j - ends[i]]
+                    if cost < best:
+                        best, start = cost, i
+                if short:
+                    best += short_cost
+
+            costs[j + 1] = best - bonuses[j]
+            starts[j + 1] = start
+
+        split_points = []
+        end = count
+        while end > 0:
+            start = starts[end]
+            if start > 0:
+                split_points.append(start - 1)
+            end = start
+
+        return split_points[::-1]
+
+    def timed_cue_spans(self, timings):
+        """
+        The words of every cue determine_advanced_split_points would cut the segments of a WordTimings into:
+        the index of each cue's first and last word, and which cues close their segment. Rather than visiting
+        every word, it jumps to the next word where anything can happen: a comma or conjunction with enough
+        text on both sides, or the word that fills the line.
+        """
+        add_space = self.profile.add_space
+        max_line_length = self.max_line_length
+        min_chars = self.min_char_length_splitter
+
+        # lines[i] counts the characters of the words before i as lines are measured, with a space after every
+        # word; the recount after a midpoint split and char_count_after leave the spaces out
+        texts = timings.texts
+        lines = np.zeros(len(texts) + 1, dtype=np.int64)
+        np.cumsum(timings.lengths + add_space, out=lines[1:])
+        lines = lines.tolist()
+        offsets = timings.offsets.tolist()
+        kinds = self.profile.break_kinds(texts, offsets)
+        breaks = np.flatnonzero(kinds).tolist()
+        breaks.append(len(texts))
+        kinds = kinds.tolist()
+
+        firsts = []
+        lasts = []
+        closing = []
+        next_break = 0
+        for first, end in zip(offsets, offsets[1:]):
+            # The last word with min_chars after it, as char_count_after is measured
+            total = lines[end] - lines[first] - add_space * (end - first)
+            latest = bisect_right(lines, lines[first] + total - min_chars, first, end + 1) - 2
+            last_split_point = first
+            char_count = 0
+            i = first
+            while i < end:
+                # The line so far started at lines[i] - char_count
+                base = lines[i] - char_count
+                balanced = bisect_left(lines, base + min_chars, i, end)
+                full = bisect_left(lines, base + max_line_length, i + 1, end + 1) - 1
+                if full < balanced:
+                    full = balanced
+                while breaks[next_break] < balanced:
+                    next_break += 1
+                candidate = breaks[next_break]
+
+                if candidate <= latest and candidate <= full:
+                    i = candidate
+                    if kinds[i] == COMMA:
+                        split_point = i
+                        char_count = 0
+                    else:
+                        split_point = i - 1
+                        char_count = lines[i + 1] - lines[i]
+                    last_split_point = split_point + 1
+                elif full < end:
+                    i = full
+                    split_point = (last_split_point + i) // 2
+                    last_split_point = split_point + 1
+                    char_count = lines[i + 1] - lines[last_split_point] - add_space * (i + 1 - last_split_point)
+                else:
+                    break
+
+                firsts.append(first)
+                lasts.append(split_point)
+                first = split_point + 1
+                i += 1
+
+            if first < end:
+                closing.append(len(firsts))
+                firsts.append(first)
+                lasts.append(end - 1)
+
+        return firsts, lasts, closing
+
+    def generate_subtitles_from_timings(self, timings):
+        """
+        determine_advanced_split_points and generate_subtitles_from_split_points for a whole WordTimings. The cue
+        times come from arrays, and each Cue is only made when it's asked for.
+        """
+        prefix = self.profile.separator
+        firsts, lasts, closing = self.timed_cue_spans(timings)
+        starts, ends = timings.cue_times(firsts, lasts, closing)
+
+        # The words are joined once; each cue's text is a slice of that
+        text = prefix.join(timings.texts)
+        positions = np.zeros(len(timings.texts) + 1, dtype=np.int64)
+        np.cumsum(timings.lengths + len(prefix), out=positions[1:])
+        heads = positions[firsts].tolist()
+        tails = (positions[np.array(lasts, dtype=np.int64) + 1] - len(prefix)).tolist()
+
+        for start, end, head, tail in zip(starts.tolist(), ends.tolist(), heads, tails):
+            yield Cue(start, end, text[head:tail])
+
     def generate_subtitles_from_split_points(self, segment, split_points, next_start_time=None):
         subtitles = []
 
-        words = segment.get("words", segment["text"].split())
+        timed = segment.words is not None
+        words = segment.words if timed else segment.text.split()
         total_word_count = len(words)
-        total_time = segment["end"] - segment["start"]
-        elapsed_time = segment["start"]
-        prefix = " " if self.lang not in ["zh", "ja"] else ""
+        total_time = segment.end - segment.start
+        elapsed_time = segment.start
+        prefix = self.profile.separator
+
+        # The words are joined once; the text of words i..j is text[positions[i] : positions[j + 1] - len(prefix)]
+        texts = [word.text for word in words] if timed else words
+        text = prefix.join(texts)
+        positions = [0, *accumulate(len(word_text) + len(prefix) for word_text in texts)]
+
         start_idx = 0
         for split_point in split_points:
-            fragment_words = words[start_idx : split_point + 1]
-            current_word_count = len(fragment_words)
+            fragment = text[positions[start_idx] : positions[split_point + 1] - len(prefix)]
+            current_word_count = split_point + 1 - start_idx
 
-            if isinstance(fragment_words[0], dict):
-                start_time = fragment_words[0]["start"]
-                end_time = fragment_words[-1]["end"]
-                next_start_time_for_word = words[split_point + 1]["start"] if split_point + 1 < len(words) else None
+            if timed:
+                start_time = words[start_idx].start
+                end_time = words[split_point].end
+                next_start_time_for_word = words[split_point + 1].start if split_point + 1 < len(words) else None
                 if next_start_time_for_word and (next_start_time_for_word - end_time) <= 0.8:
                     end_time = next_start_time_for_word
             else:
-                fragment = prefix.join(fragment_words).strip()
+                fragment = fragment.strip()
                 current_duration = (current_word_count / total_word_count) * total_time
                 start_time = elapsed_time
                 end_time = elapsed_time + current_duration
                 elapsed_time += current_duration
 
-            subtitles.append(
-                {
-                    "start": start_time,
-                    "end": end_time,
-                    "text": (
-                        fragment
-                        if not isinstance(fragment_words[0], dict)
-                        else prefix.join(word["word"] for word in fragment_words)
-                    ),
-                }
-            )
+            subtitles.append(Cue(start_time, end_time, fragment))
 
             start_idx = split_point + 1
 
         # Handle the last fragment
         if start_idx < len(words):
-            fragment_words = words[start_idx:]
-            current_word_count = len(fragment_words)
+            fragment = text[positions[start_idx] :]
+            current_word_count = len(words) - start_idx
 
-            if isinstance(fragment_words[0], dict):
-                start_time = fragment_words[0]["start"]
-                end_time = fragment_words[-1]["end"]
+            if timed:
+                start_time = words[start_idx].start
+                end_time = words[-1].end
             else:
-                fragment = prefix.join(fragment_words).strip()
+                fragment = fragment.strip()
                 current_duration = (current_word_count / total_word_count) * total_time
                 start_time = elapsed_time
                 end_time = elapsed_time + current_duration
@@ -235,44 +514,43 @@ class SubtitlesProcessor:
             if next_start_time and (next_start_time - end_time) <= 0.8:
                 end_time = next_start_time
 
-            subtitles.append(
-                {
-                    "start": start_time,
-                    "end": end_time if end_time is not None else segment["end"],
-                    "text": (
-                        fragment
-                        if not isinstance(fragment_words[0], dict)
-                        else prefix.join(word["word"] for word in fragment_words)
-                    ),
-                }
-            )
+            subtitles.append(Cue(start_time, end_time if end_time is not None else segment.end, fragment))
 
         return subtitles
 
-    def save(self, filename="subtitles.srt", advanced_splitting=True):
-        subtitles = self.process_segments(advanced_splitting)
-        last_end_time = subtitles[-1]["end"] if subtitles else 0
-        ending_start_time = last_end_time + 1
-        ending_end_time = last_end_time + 4.5
-        text = "Captioning by\n<i>t.me/SubtitlesGeneratorBot</i>"
-        subtitles.append({"start": ending_start_time, "end": ending_end_time, "text": text})
-
-        def write_subtitle(file, idx, start_time, end_time, text):
-            if not text:
-                return 0
-            file.write(f"{idx}\n")
-            file.write(f"{start_time} --> {end_time}\n")
-            file.write(text + "\n\n")
-
-        with open(filename, "w", encoding="utf-8") as file:
-            if self.is_vtt:
-                file.write("WEBVTT\n\n")
-
+    def write(self, writers, advanced_splitting=True):
+        """
+        Streams the cues, and the credit after them, into every writer (see writers.py) in one pass over the
+        segments. Returns the number of cues, counting the credit.
+        """
+        for writer in writers:
+            writer.begin()
+
+        count = 0
+        last_end_time = 0
+        for cue in self.iter_cues(advanced_splitting):
+            count += 1
+            last_end_time = cue.end
             if advanced_splitting:
-                for idx, subtitle in enumerate(subtitles, 1):
-                    start_time = format_timestamp(subtitle["start"], self.is_vtt)
-                    end_time = format_timestamp(subtitle["end"], self.is_vtt)
-                    text = subtitle["text"].strip()
-                    write_subtitle(file, idx, start_time, end_time, text)
-
-        return len(subtitles)
+                for writer in writers:
+                    writer.write(cue)
+
+        credit = Cue(last_end_time + 1, last_end_time + 4.5, CREDIT_TEXT)
+        if advanced_splitting:
+            for writer in writers:
+                writer.write(credit)
+
+        for writer in writers:
+            writer.close()
+
+        return count + 1
+
+    def save(self, filename="subtitles.srt", advanced_splitting=True, also=()):
+        """
+        Writes the subtitles to filename, as VTT if is_vtt else SRT, and to each path in `also` in the format
+        its extension names, all from one pass over the segments.
+        """
+        outputs = [(filename, VttWriter if self.is_vtt else SrtWriter), *((path, writer_for(path)) for path in also)]
+        with ExitStack() as stack:
+            writers = [writer(stack.enter_context(open(path, "w", encoding="utf-8"))) for path, writer in outputs]
+            return self.write(writers, advanced_splitting)
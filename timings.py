@@ -0,0 +1,146 @@
+"""
+Columnar word timings for SubtitlesProcessor.
+
+A two-hour transcript has tens of thousands of timed words. WordTimings keeps the words of all segments in flat
+arrays, with `offsets` marking where each segment's words begin, so missing timestamps and cue end times are
+worked out for the whole transcript in a few array operations. from_segments and write_back are the only places
+that touch the Word objects.
+"""
+
+from operator import attrgetter
+
+import numpy as np
+
+SECONDS_PER_CHAR = 0.25  # how long a word without timestamps is assumed to take, per character
+
+GAP_SNAP = 0.8  # seconds; a cue is held on screen until the next one when the gap is at most this
+
+
+class WordTimings:
+    def __init__(self, words, offsets, next_starts):
+        # The Words, for write_back
+        self.words = words
+        self.texts = list(map(attrgetter("text"), words))
+        self.lengths = np.fromiter(map(len, self.texts), dtype=np.int64, count=len(words))
+        # NaN where the model gave no timestamp
+        self.starts = np.array(list(map(attrgetter("start"), words)), dtype=np.float64)
+        self.ends = np.array(list(map(attrgetter("end"), words)), dtype=np.float64)
+        # The words of segment s are offsets[s]:offsets[s + 1]
+        self.offsets = offsets
+        # The start of the segment after each one, NaN after the last
+        self.next_starts = next_starts
+        self.estimated = np.zeros(len(words), dtype=bool)
+
+    @classmethod
+    def from_segments(cls, segments, next_start=None):
+        """None unless every segment has its timed words. next_start is when the segment after the last starts."""
+        word_lists = [segment.words for segment in segments]
+        if None in word_lists:
+            return None
+        words = [word for words in word_lists for word in words]
+
+        offsets = np.zeros(len(segments) + 1, dtype=np.int64)
+        np.cumsum(list(map(len, word_lists)), out=offsets[1:])
+        next_starts = np.array([segment.start for segment in segments[1:]] + [next_start], dtype=np.float64)
+
+        return cls(words, offsets, next_starts)
+
+    def fill_missing(self):
+        """
+        Estimates the words without timestamps, as SubtitlesProcessor.estimate_timestamp_for_word does one word
+        at a time: a word starts where the previous one ended and ends where the next one starts; failing that,
+        near the next segment's start, or SECONDS_PER_CHAR per character after its own start.
+        """
+        starts = self.starts
+        ends = self.ends
+        missing = np.isnan(starts) | np.isnan(ends)
+        if not missing.any():
+            return
+
+        count = len(starts)
+        counts = np.diff(self.offsets)
+        segment_of = np.repeat(np.arange(len(counts)), counts)
+        first = np.zeros(count, dtype=bool)
+        first[self.offsets[:-1][counts > 0]] = True
+        last = np.zeros(count, dtype=bool)
+        last[self.offsets[1:][counts > 0] - 1] = True
+
+        # The next word's own start (not an estimate) bounds a word; the next segment's start is only used
+        # when it's truthy, as in estimate_timestamp_for_word
+        next_word_starts = np.full(count, np.nan)
+        next_word_starts[:-1] = starts[1:]
+        next_word_starts[last] = np.nan
+        bounded = missing & ~np.isnan(next_word_starts)
+        segment_next = self.next_starts[segment_of]
+        has_next_segment = ~np.isnan(segment_next) & (segment_next != 0)
+        durations = self.lengths * SECONDS_PER_CHAR
+
+        new_starts = starts.copy()
+        new_ends = ends.copy()
+        new_ends[bounded] = next_word_starts[bounded]
+
+        # The first word of a segment has nothing before it to start at; counting back from a start near 0
+        # stops at 0
+        head = missing & first
+        mask = head & bounded
+        new_starts[mask] = np.maximum(next_word_starts[mask] - durations[mask], 0)
+        mask = head & ~bounded & has_next_segment
+        new_starts[mask] = np.maximum(segment_next[mask] - 1, 0)
+        new_ends[mask] = np.maximum(segment_next[mask] - 0.5, 0)
+        mask = head & ~bounded & ~has_next_segment
+        new_starts[mask] = 0
+        new_ends[mask] = 0
+
+        # Later words depend on the previous word's end. Before the next segment, a run of them ends at its
+        # start or half a second before, and a word after one of those always ends at the next segment's start
+        tail = missing & ~first & ~bounded
+        mask = tail & has_next_segment
+        indices = np.flatnonzero(mask)
+        previous = np.where(mask[indices - 1], segment_next[indices], new_ends[indices - 1])
+        new_ends[indices] = np.where(
+            segment_next[indices] - previous <= 1, segment_next[indices], segment_next[indices] - 0.5
+        )
+        # Without a next segment (the end of the transcript) the durations add up, one word after another; each
+        # run of such words is accumulated from the end before it, in order, so the sums round as they did
+        indices = np.flatnonzero(tail & ~has_next_segment)
+        for run in np.split(indices, np.flatnonzero(np.diff(indices) != 1) + 1) if len(indices) else ():
+            new_ends[run] = np.add.accumulate(np.concatenate(([new_ends[run[0] - 1]], durations[run])))[1:]
+
+        later = np.flatnonzero(missing & ~first)
+        new_starts[later] = new_ends[later - 1]
+
+        self.starts = new_starts
+        self.ends = new_ends
+        self.estimated = missing
+
+    def write_back(self):
+        """Sets the estimated timestamps on the Words they belong to."""
+        indices = np.flatnonzero(self.estimated)
+        for index, start, end in zip(indices.tolist(), self.starts[indices].tolist(), self.ends[indices].tolist()):
+            word = self.words[index]
+            word.start = start
+            word.end = end
+
+    def cue_times(self, firsts, lasts, closing):
+        """
+        Start and end times of the cues spanning words firsts[c]..lasts[c]. A cue is held until the next word,
+        or the next segment for the cues in `closing` (the last of their segment), when that starts at most
+        GAP_SNAP seconds later.
+        """
+        firsts = np.array(firsts, dtype=np.int64)
+        lasts = np.array(lasts, dtype=np.int64)
+        closing = np.array(closing, dtype=np.int64)
+        cue_starts = self.starts[firsts]
+        cue_ends = self.ends[lasts]
+
+        segment_of = np.searchsorted(self.offsets, firsts, side="right") - 1
+        after = lasts + 1
+        inside = after < self.offsets[segment_of + 1]
+        following = np.full(len(firsts), np.nan)
+        following[inside] = self.starts[after[inside]]
+        following[closing] = self.next_starts[segment_of[closing]]
+
+        snap = ~np.isnan(following) & (following != 0) & (following - cue_ends <= GAP_SNAP)
+        cue_ends[snap] = following[snap]
+
+        return cue_starts, cue_ends
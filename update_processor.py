@@ -0,0 +1,87 @@
+import asyncio
+import time
+from telegram.ext import BaseUpdateProcessor
+from constants import MAX_CONCURRENT_UPDATES, MAX_PENDING_UPDATES
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes updates of different users concurrently while keeping each user's updates strictly ordered.
+
+    Every update first waits for its user's lock (FIFO, so conversation steps run in the order they arrived)
+    and only then for one of the `running_updates` slots, so a user with a backlog doesn't tie up slots that
+    other users could run in. Updates without a user or chat are only bounded by the slots.
+
+    This all happens in do_process_update, the extension point PTB calls from its final process_update. PTB's
+    own limit, max_concurrent_updates, is taken before it and so counts the updates waiting for their user
+    too; it's set to `pending_updates` to bound those.
+    """
+
+    def __init__(self, running_updates=MAX_CONCURRENT_UPDATES, pending_updates=MAX_PENDING_UPDATES):
+        super().__init__(max(pending_updates, running_updates))
+        self._slots = asyncio.Semaphore(running_updates)
+        self.running = 0
+        self._locks = {}
+        self._queued = {}
+        self.processed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @staticmethod
+    def _key(update):
+        user = getattr(update, "effective_user", None)
+        if user is not None:
+            return user.id
+
+        chat = getattr(update, "effective_chat", None)
+        if chat is not None:
+            return chat.id
+
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self._key(update)
+        start = time.monotonic()
+        if key is None:
+            await self._run(start, coroutine)
+            return
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._queued[key] = self._queued.get(key, 0) + 1
+
+        try:
+            async with lock:
+                await self._run(start, coroutine)
+        finally:
+            self._queued[key] -= 1
+            if self._queued[key] == 0:
+                del self._queued[key]
+                del self._locks[key]
+
+    async def _run(self, start, coroutine):
+        async with self._slots:
+            wait = time.monotonic() - start
+            self.processed += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self.running += 1
+            try:
+                await coroutine
+            finally:
+                self.running -= 1
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def stats(self):
+        return {
+            "processed": self.processed,
+            "mean_wait": self.total_wait / self.processed if self.processed else 0.0,
+            "max_wait": self.max_wait,
+            "users_queued": len(self._queued),
+            "concurrent": self.running,
+            "pending": self.current_concurrent_updates,
+        }
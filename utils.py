@@ -4,10 +4,14 @@ import subprocess
 import secrets
 import string
 import math
+import shutil
+import numpy as np
+from functools import lru_cache
+from pathlib import Path
 from jinja2 import Environment, FileSystemLoader
 from email.message import EmailMessage
 from constants import BAR_STYLES
-from datetime import datetime
+from datetime import datetime, timedelta
 
 
 def make_url_friendly_datetime():
@@ -48,6 +52,89 @@ def format_timestamp(seconds: float, is_vtt: bool = False):
     return f"{hours_marker}{minutes:02d}:{seconds:02d}{separator}{milliseconds:03d}"
 
 
+def parse_timestamp(timestamp: str):
+    """The seconds in an SRT or VTT timestamp (hours are optional in VTT), the inverse of format_timestamp."""
+    clock, _, fraction = timestamp.strip().replace(",", ".").partition(".")
+
+    seconds = 0
+    for part in clock.split(":"):
+        seconds = seconds * 60 + int(part)
+
+    return seconds + (int(fraction) / 10 ** len(fraction) if fraction else 0)
+
+
+def format_timestamps(seconds, is_vtt: bool = False):
+    """
+    format_timestamp for many times at once, as a list of strings. The digits are worked out for all of them
+    together in numpy; rounding to the millisecond is round-half-even like round(), so every string is the one
+    format_timestamp gives.
+    """
+    seconds = np.asarray(seconds, dtype=np.float64)
+    assert np.all(seconds >= 0), "non-negative timestamp expected"
+
+    # Infinite and absurdly long times are left to format_timestamp, like those of 100 hours or more, which
+    # need a wider hours field
+    finite = seconds < 1e12
+    milliseconds = np.rint(np.where(finite, seconds, 0) * 1000.0).astype(np.int64)
+    hours, milliseconds = np.divmod(milliseconds, 3_600_000)
+    large = ~finite | (hours >= 100)
+    minutes, milliseconds = np.divmod(milliseconds, 60_000)
+    whole_seconds, milliseconds = np.divmod(milliseconds, 1_000)
+
+    # "HH:MM:SS,mmm" as 12 ASCII codes a row
+    chars = np.empty((len(seconds), 12), dtype=np.uint8)
+    chars[:, 0], chars[:, 1] = np.divmod(hours % 100, 10)
+    chars[:, 3], chars[:, 4] = np.divmod(minutes, 10)
+    chars[:, 6], chars[:, 7] = np.divmod(whole_seconds, 10)
+    chars[:, 9], rest = np.divmod(milliseconds, 100)
+    chars[:, 10], chars[:, 11] = np.divmod(rest, 10)
+    chars += ord("0")
+    chars[:, [2, 5]] = ord(":")
+    chars[:, 8] = ord("." if is_vtt else ",")
+
+    timestamps = chars.view("S12").ravel().astype("U12").tolist()
+    for i in np.flatnonzero(large).tolist():
+        timestamps[i] = format_timestamp(seconds[i].item(), is_vtt)
+
+    return timestamps
+
+
+def parse_timestamps(timestamps):
+    """
+    parse_timestamp for many timestamps (str or bytes) at once, as a float64 array. Those written like
+    format_timestamp ("HH:MM:SS,mmm" or "HH:MM:SS.mmm") are read together in numpy, giving the same floats;
+    any other form falls back to parse_timestamp.
+    """
+    raw = np.array(timestamps, dtype="S")
+    if raw.size == 0:
+        return np.zeros(0, dtype=np.float64)
+
+    if raw.itemsize == 12:
+        digits = raw.view(np.uint8).reshape(-1, 12).astype(np.int64) - ord("0")
+        hours = digits[:, 0] * 10 + digits[:, 1]
+        minutes = digits[:, 3] * 10 + digits[:, 4]
+        whole_seconds = digits[:, 6] * 10 + digits[:, 7]
+        milliseconds = digits[:, 9] * 100 + digits[:, 10] * 10 + digits[:, 11]
+        seconds = ((hours * 60 + minutes) * 60 + whole_seconds) + milliseconds / 1000
+        # Rows in another form (or padded short ones) have something other than a digit or the separators here
+        numbers = np.delete(digits, [2, 5, 8], axis=1)
+        separators = digits[:, [2, 5, 8]] + ord("0")
+        irregular = (
+            np.any((numbers < 0) | (numbers > 9), axis=1)
+            | np.any(separators[:, :2] != ord(":"), axis=1)
+            | ((separators[:, 2] != ord(",")) & (separators[:, 2] != ord(".")))
+        )
+    else:
+        seconds = np.zeros(raw.size, dtype=np.float64)
+        irregular = np.ones(raw.size, dtype=bool)
+
+    for i in np.flatnonzero(irregular).tolist():
+        seconds[i] = parse_timestamp(raw[i].decode("utf-8"))
+
+    return seconds
+
+
+@lru_cache(maxsize=2048)
 def progress_function(min, max, current, width, progress_style=0):
     style = BAR_STYLES[progress_style]
 
@@ -65,6 +152,16 @@ def progress_function(min, max, current, width, progress_style=0):
     )
 
 
+def retry_after_seconds(error):
+    # python-telegram-bot reports retry_after either as an int or as a timedelta depending on the version
+    retry_after = error.retry_after
+
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+
+    return float(retry_after)
+
+
 def normal_round(n):
     if n - math.floor(n) < 0.5:
         return math.floor(n)
@@ -228,22 +325,25 @@ def get_thumbnails(file_path):
 
             size_split = size.split("x")
 
-            vtt = "WEBVTT\n"
-
-            counter = 0
-
             num_images = normal_round((duration / interval) / (int(size_split[0]) * int(size_split[1])))
 
-            for jpg in range(1, num_images + 1):
-                for col in range(int(size_split[0])):
-                    for row in range(int(size_split[1])):
-                        start_time = format_timestamp(counter * interval)
-
-                        end_time = format_timestamp((counter + 1) * interval)
+            tiles = [
+                (jpg, col, row)
+                for jpg in range(1, num_images + 1)
+                for col in range(int(size_split[0]))
+                for row in range(int(size_split[1]))
+            ]
 
-                        vtt += f"\n{start_time} --> {end_time}\nimages/img{jpg}.jpg#xywh={row * width},{col * height},{width},{height}\n"
+            # Tile n is shown from n * interval to (n + 1) * interval
+            times = format_timestamps(np.arange(len(tiles) + 1) * interval)
 
-                        counter += 1
+            vtt = "WEBVTT\n" + "".join(
+                [
+                    f"\n{times[counter]} --> {times[counter + 1]}\n"
+                    f"images/img{jpg}.jpg#xywh={row * width},{col * height},{width},{height}\n"
+                    for counter, (jpg, col, row) in enumerate(tiles)
+                ]
+            )
 
             with open(output_path, "w") as f:
                 f.write(vtt)
@@ -255,6 +355,32 @@ def get_thumbnails(file_path):
         print(f"File {file_path} not found")
 
 
+def adopt_local_file(source_path, destination_path, expected_size=None):
+    """
+    Makes a file stored by the local telegram-bot-api server available at destination_path without
+    streaming it through Python. A hard link is instant and costs no space; across filesystems we fall back
+    to a kernel-side copy. The server's own file is left in place since it may serve the same file_id again.
+    """
+    if os.path.exists(destination_path):
+        os.remove(destination_path)
+
+    try:
+        os.link(source_path, destination_path)
+    except OSError:
+        shutil.copyfile(source_path, destination_path)
+
+    size = os.path.getsize(destination_path)
+    if expected_size is not None and size != expected_size:
+        raise IOError(f"{destination_path} has {size} bytes, expected {expected_size}")
+
+    return destination_path
+
+
+def local_file_uri(path):
+    # In local mode the Bot API server reads file:// URIs straight from disk instead of receiving the bytes
+    return Path(path).resolve().as_uri()
+
+
 def install_yt_dlp():
     try:
         subprocess.run(["pip3", "install", "yt-dlp"], check=True)
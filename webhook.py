@@ -0,0 +1,158 @@
+import asyncio
+import hmac
+import logging
+import os
+import signal
+import zlib
+from urllib.parse import urlparse
+import aiohttp
+from aiohttp import web
+from telegram import Update
+from scheduler import queue_wait_histograms
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+# Comma separated base URLs of every bot process (this one included), in the same order on every node
+WEBHOOK_PEERS = [peer for peer in os.getenv("WEBHOOK_PEERS", "").split(",") if peer]
+WEBHOOK_PEER_INDEX = int(os.getenv("WEBHOOK_PEER_INDEX", "0"))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "100"))
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+FORWARDED_HEADER = "X-Captionyx-Forwarded"
+
+
+def owner_index(data):
+    """
+    Index of the peer that handles this update. Updates are routed by user, so every step of a user's
+    conversation lands in the same process and keeps its order.
+    """
+    if len(WEBHOOK_PEERS) < 2:
+        return WEBHOOK_PEER_INDEX
+
+    for key in ("message", "edited_message", "callback_query", "pre_checkout_query", "my_chat_member"):
+        payload = data.get(key)
+        if payload and "from" in payload:
+            return zlib.crc32(str(payload["from"]["id"]).encode()) % len(WEBHOOK_PEERS)
+
+    return WEBHOOK_PEER_INDEX
+
+
+class WebhookServer:
+    """
+    In-process aiohttp endpoint that feeds Telegram webhook updates into the application's update queue.
+
+    The endpoint only answers 200 once the update is queued locally or accepted by the owning peer,
+    so Telegram keeps (and retries) anything a restarting or failing process couldn't take.
+    """
+
+    def __init__(self, application, secret=WEBHOOK_SECRET, path=None):
+        self.application = application
+        self.secret = secret
+        self.path = path or urlparse(WEBHOOK_URL).path or "/"
+        self.session = None
+        self.runner = None
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get("/healthz", self.handle_health)
+        app.router.add_get("/metrics/queue_wait", self.handle_queue_wait)
+
+        return app
+
+    async def handle_health(self, request):
+        return web.Response(text="ok")
+
+    async def handle_queue_wait(self, request):
+        return web.json_response(await queue_wait_histograms())
+
+    async def handle_update(self, request):
+        token = request.headers.get(SECRET_HEADER, "")
+        if not self.secret or not hmac.compare_digest(token, self.secret):
+            return web.Response(status=403)
+
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+
+        owner = owner_index(data)
+        if owner != WEBHOOK_PEER_INDEX and not request.headers.get(FORWARDED_HEADER):
+            return await self.forward(owner, data)
+
+        await self.application.update_queue.put(Update.de_json(data, self.application.bot))
+
+        return web.Response()
+
+    async def forward(self, owner, data):
+        headers = {SECRET_HEADER: self.secret, FORWARDED_HEADER: "1"}
+
+        try:
+            async with self.session.post(
+                WEBHOOK_PEERS[owner].rstrip("/") + self.path, json=data, headers=headers
+            ) as response:
+                return web.Response(status=response.status)
+
+        except aiohttp.ClientError as e:
+            # A non-2xx answer makes Telegram redeliver the update later
+            logger.info(f"Could not forward an update to peer {owner}: {e}")
+            return web.Response(status=503)
+
+    async def start(self):
+        self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+        self.runner = web.AppRunner(self.make_app())
+        await self.runner.setup()
+        await web.TCPSite(self.runner, WEBHOOK_LISTEN, WEBHOOK_PORT).start()
+        logger.info(f"Webhook endpoint listening on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{self.path}")
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+        if self.session:
+            await self.session.close()
+
+
+async def serve(application):
+    server = WebhookServer(application)
+    stop = asyncio.Event()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+
+        await application.start()
+        await server.start()
+
+        # Only one process registers the webhook; pending updates are kept so a restart loses nothing
+        if WEBHOOK_PEER_INDEX == 0:
+            await application.bot.set_webhook(
+                url=WEBHOOK_URL,
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+                drop_pending_updates=False,
+            )
+
+        await stop.wait()
+
+        # Stop accepting first, then let the application work through what is already queued
+        await server.stop()
+        await application.stop()
+
+        if application.post_stop:
+            await application.post_stop(application)
+
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+
+
+def run_webhook(application):
+    asyncio.run(serve(application))
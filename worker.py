@@ -0,0 +1,58 @@
+"""
+Standalone job worker: runs queued burn/transcription jobs without serving Telegram updates.
+
+Start as many as the hardware allows, on any node that reaches Postgres, the local telegram-bot-api server
+and the directory the bot keeps user files in:
+
+    JOB_WORKERS=2 python worker.py
+"""
+
+import asyncio
+import signal
+from telegram.ext import ExtBot
+from bot import TOKEN, BOT_API_URL, handle_video_operations
+from eta import eta_model, REFRESH_INTERVAL
+from jobs import JobWorker, JOB_WORKERS
+from persistent import Persistent
+from ratelimiter import PriorityRateLimiter
+
+persistent = Persistent()
+
+
+async def refresh_eta_model():
+    while True:
+        await eta_model.refresh()
+        await asyncio.sleep(REFRESH_INTERVAL)
+
+
+async def main():
+    stop = asyncio.Event()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    bot = ExtBot(
+        TOKEN,
+        base_url=f"{BOT_API_URL}/bot",
+        base_file_url=f"{BOT_API_URL}/file/bot",
+        local_mode=True,
+        rate_limiter=PriorityRateLimiter(),
+    )
+
+    async with bot:
+        await persistent.open_pool()
+        refresh_task = loop.create_task(refresh_eta_model())
+        worker = JobWorker(bot, handle_video_operations, concurrency=max(JOB_WORKERS, 1))
+        await worker.start()
+
+        await stop.wait()
+
+        # Interrupted jobs go back to the queue for the other workers
+        await worker.stop()
+        refresh_task.cancel()
+        await persistent.close_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,172 @@
+"""
+Per-job working directories and the disk budget jobs are admitted against.
+
+Every job writes into `WORKSPACE_ROOT/<user_id>/` (a user has at most one active job, so this is also the
+job's directory). Small files (the extracted audio, subtitles) can go to a node-local tmpfs instead by
+setting SCRATCH_ROOT, e.g. to /dev/shm/captionyx.
+
+Each workspace a worker is running a job in holds an estimate of the bytes the job will write. What a job
+has yet to write is counted against the free space of the filesystem, so every process sharing a
+WORKSPACE_ROOT, whichever tenant it belongs to, only claims the jobs that still fit.
+"""
+
+import asyncio
+import fcntl
+import os
+import shutil
+import time
+from contextlib import asynccontextmanager
+
+WORKSPACE_ROOT = os.getenv("WORKSPACE_ROOT", "workspaces")
+
+SCRATCH_ROOT = os.getenv("SCRATCH_ROOT") or None
+
+DISK_RESERVE = int(os.getenv("DISK_RESERVE_MB", "2048")) * 1024 * 1024  # never handed out to jobs
+
+VIDEO_BYTES_PER_MINUTE = 60 * 1024 * 1024  # ~8 Mbit/s; assumed when yt-dlp doesn't report a size
+
+AUDIO_BYTES_PER_MINUTE = 320 * 1000 // 8 * 60  # the 320k mp3 get_audio extracts
+
+DEFAULT_VIDEO_MINUTES = 30  # assumed when the duration isn't known before the download either
+
+ORPHAN_GRACE = 60 * 60  # seconds; a younger workspace may belong to a conversation that hasn't queued its job yet
+
+ESTIMATE_FILE = ".disk_estimate"
+
+LOCK_FILE = ".admission.lock"
+
+
+def directory(user_id):
+    path = os.path.join(WORKSPACE_ROOT, str(user_id))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def path(user_id, name):
+    return os.path.join(directory(user_id), name)
+
+
+def scratch_path(user_id, name):
+    """A path for a small file; on SCRATCH_ROOT when it's configured."""
+    if SCRATCH_ROOT is None:
+        return path(user_id, name)
+
+    scratch = os.path.join(SCRATCH_ROOT, str(user_id))
+    os.makedirs(scratch, exist_ok=True)
+    return os.path.join(scratch, name)
+
+
+def remove(user_id):
+    for root in (WORKSPACE_ROOT, SCRATCH_ROOT):
+        if root is not None:
+            shutil.rmtree(os.path.join(root, str(user_id)), ignore_errors=True)
+
+
+def estimate_download_bytes(info_dict):
+    """The size yt-dlp expects the download to have, or None if it doesn't say."""
+    formats = info_dict.get("requested_formats") or [info_dict]
+    sizes = [f.get("filesize") or f.get("filesize_approx") for f in formats]
+
+    if not sizes or None in sizes:
+        return None
+
+    return int(sum(sizes))
+
+
+def estimate_job_bytes(user_data):
+    """The most a job will have on disk at once in its workspace."""
+    minutes = user_data.get("video_duration") or DEFAULT_VIDEO_MINUTES
+    video_bytes = user_data.get("video_size") or minutes * VIDEO_BYTES_PER_MINUTE
+
+    needed = 0
+    if not user_data.get("document"):
+        # yt-dlp keeps the separate video and audio streams until the merged file is complete
+        needed += 2 * video_bytes
+    if user_data.get("choice") == "burn":
+        # The re-encoded output is about as large as the input
+        needed += video_bytes
+    if SCRATCH_ROOT is None:
+        needed += minutes * AUDIO_BYTES_PER_MINUTE
+
+    return int(needed)
+
+
+def capacity():
+    """The most any single job can be given on this node, with nothing else running."""
+    os.makedirs(WORKSPACE_ROOT, exist_ok=True)
+    return shutil.disk_usage(WORKSPACE_ROOT).total - DISK_RESERVE
+
+
+def disk_usage(path):
+    """Bytes used by the files in path. Hard links (adopted uploads) are shared with another file and cost nothing."""
+    used = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                stat = os.lstat(os.path.join(root, name))
+            except OSError:
+                continue
+            if stat.st_nlink == 1:
+                used += stat.st_blocks * 512
+
+    return used
+
+
+def outstanding_bytes():
+    """What the running jobs on this filesystem have yet to write, by their estimates."""
+    outstanding = 0
+    for entry in os.scandir(WORKSPACE_ROOT):
+        if not entry.is_dir():
+            continue
+        try:
+            with open(os.path.join(entry.path, ESTIMATE_FILE)) as file:
+                estimate = int(file.read())
+        except (OSError, ValueError):
+            continue
+        outstanding += max(estimate - disk_usage(entry.path), 0)
+
+    return outstanding
+
+
+def free_bytes():
+    os.makedirs(WORKSPACE_ROOT, exist_ok=True)
+    return shutil.disk_usage(WORKSPACE_ROOT).free - DISK_RESERVE - outstanding_bytes()
+
+
+def reserve(user_id, nbytes):
+    with open(os.path.join(directory(user_id), ESTIMATE_FILE), "w") as file:
+        file.write(str(int(nbytes)))
+
+
+@asynccontextmanager
+async def admission():
+    """
+    Yields the bytes a new job may use. Held across claiming a job and reserve(), so two workers sharing the
+    filesystem can't both be admitted against the same free space.
+    """
+    os.makedirs(WORKSPACE_ROOT, exist_ok=True)
+    lock = open(os.path.join(WORKSPACE_ROOT, LOCK_FILE), "w")
+    try:
+        await asyncio.to_thread(fcntl.flock, lock, fcntl.LOCK_EX)
+        yield await asyncio.to_thread(free_bytes)
+    finally:
+        # Closing the file releases the lock
+        lock.close()
+
+
+def collect_garbage(active_user_ids):
+    """Removes the workspaces left behind by jobs that are no longer queued or running, e.g. after a crash."""
+    removed = 0
+    now = time.time()
+    for root in (WORKSPACE_ROOT, SCRATCH_ROOT):
+        if root is None or not os.path.isdir(root):
+            continue
+        for entry in os.scandir(root):
+            if not entry.is_dir() or entry.name in active_user_ids:
+                continue
+            if now - entry.stat().st_mtime < ORPHAN_GRACE:
+                continue
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed += 1
+
+    return removed
@@ -0,0 +1,181 @@
+"""
+Subtitle file formats. A writer takes cues one at a time and writes them to any file-like sink in chunks, so
+SubtitlesProcessor.write can stream the cues of a transcript into several formats at once.
+"""
+
+import json
+import os
+import re
+
+import numpy as np
+
+from utils import format_timestamps
+
+BUFFER_SIZE = 64 * 1024  # characters gathered before each write to the sink
+BATCH_SIZE = 1024  # cues whose SRT or VTT timestamps are formatted together
+
+TAG = re.compile(r"<[^>]+>")
+
+
+class SubtitleWriter:
+    def __init__(self, sink):
+        self.sink = sink
+        self.chunks = []
+        self.buffered = 0
+        self.index = 0
+        self.written = 0
+
+    def header(self):
+        return ""
+
+    def footer(self):
+        return ""
+
+    def format(self, index, cue, text):
+        raise NotImplementedError
+
+    def emit(self, text):
+        self.chunks.append(text)
+        self.buffered += len(text)
+        if self.buffered >= BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.chunks:
+            self.sink.write("".join(self.chunks))
+            self.chunks.clear()
+            self.buffered = 0
+
+    def begin(self):
+        self.emit(self.header())
+
+    def write(self, cue):
+        # Cues without text are skipped but keep their number, as they always have in the SRT and VTT files
+        self.index += 1
+        text = cue.text.strip()
+        if not text:
+            return
+        self.add(self.index, cue, text)
+        self.written += 1
+
+    def add(self, index, cue, text):
+        self.emit(self.format(index, cue, text))
+
+    def close(self):
+        self.emit(self.footer())
+        self.flush()
+
+
+class SrtWriter(SubtitleWriter):
+    is_vtt = False
+
+    def __init__(self, sink):
+        super().__init__(sink)
+        self.pending = []
+
+    def add(self, index, cue, text):
+        # The timestamps are formatted in bulk, a batch of cues at a time
+        self.pending.append((index, cue.start, cue.end, text))
+        if len(self.pending) >= BATCH_SIZE:
+            self.format_pending()
+
+    def format_pending(self):
+        if not self.pending:
+            return
+
+        indices, starts, ends, texts = zip(*self.pending)
+        self.pending.clear()
+        timestamps = format_timestamps(np.array(starts + ends, dtype=np.float64), self.is_vtt)
+        self.emit(
+            "".join(
+                [
+                    f"{index}\n{start} --> {end}\n{text}\n\n"
+                    for index, start, end, text in zip(indices, timestamps, timestamps[len(indices) :], texts)
+                ]
+            )
+        )
+
+    def close(self):
+        self.format_pending()
+        super().close()
+
+
+class VttWriter(SrtWriter):
+    is_vtt = True
+
+    def header(self):
+        return "WEBVTT\n\n"
+
+
+class AssWriter(SubtitleWriter):
+    """Styled like the subtitles burned into videos, with the default font."""
+
+    def header(self):
+        return (
+            "[Script Info]\n"
+            "ScriptType: v4.00+\n"
+            "WrapStyle: 0\n"
+            "ScaledBorderAndShadow: yes\n"
+            "\n"
+            "[V4+ Styles]\n"
+            "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, "
+            "Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, "
+            "Alignment, MarginL, MarginR, MarginV, Encoding\n"
+            "Style: Default,Arial,16,&H00FFFFFF,&H000000FF,&H20000000,&H00000000,0,0,0,0,100,100,0.3,0,1,1,0,2,"
+            "10,10,10,1\n"
+            "\n"
+            "[Events]\n"
+            "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\n"
+        )
+
+    @staticmethod
+    def timestamp(seconds):
+        centiseconds = round(seconds * 100)
+        hours, centiseconds = divmod(centiseconds, 360_000)
+        minutes, centiseconds = divmod(centiseconds, 6_000)
+        seconds, centiseconds = divmod(centiseconds, 100)
+        return f"{hours}:{minutes:02d}:{seconds:02d}.{centiseconds:02d}"
+
+    def format(self, index, cue, text):
+        text = text.replace("<i>", "{\\i1}").replace("</i>", "{\\i0}").replace("\n", "\\N")
+        return f"Dialogue: 0,{self.timestamp(cue.start)},{self.timestamp(cue.end)},Default,,0,0,0,,{text}\n"
+
+
+class JsonWriter(SubtitleWriter):
+    """[{"start": seconds, "end": seconds, "text": ...}, ...]"""
+
+    def header(self):
+        return "["
+
+    def footer(self):
+        return "\n]\n" if self.written else "]\n"
+
+    def format(self, index, cue, text):
+        separator = "," if self.written else ""
+        cue_json = json.dumps({"start": cue.start, "end": cue.end, "text": text}, ensure_ascii=False)
+        return f"{separator}\n  {cue_json}"
+
+
+class TxtWriter(SubtitleWriter):
+    """The text of each cue on its own line, without markup."""
+
+    def format(self, index, cue, text):
+        return TAG.sub("", text) + "\n"
+
+
+WRITERS = {
+    "srt": SrtWriter,
+    "vtt": VttWriter,
+    "ass": AssWriter,
+    "json": JsonWriter,
+    "txt": TxtWriter,
+}
+
+
+def writer_for(path):
+    """The writer class for the format path's extension names."""
+    extension = os.path.splitext(path)[1][1:].lower()
+    if extension not in WRITERS:
+        raise ValueError(f"Unknown subtitle format: {path}")
+
+    return WRITERS[extension]